@@ -0,0 +1,164 @@
+"""
+Coarse-to-fine survey: only fetch ZOOM tiles where the area is built up.
+
+With SURVEY_MODE = "adaptive" the fetcher first downloads the search area at
+its COARSE_ZOOM into <LOCAL_SAVE_FOLDER>/coarse_z<COARSE_ZOOM> (xyz addressing,
+its own manifest, so it is fetched once and reused on resume). Each coarse
+tile covers 2**(ZOOM - COARSE_ZOOM) x 2**(ZOOM - COARSE_ZOOM) fine tiles
+(1/16 of the requests at zoom 17 for zoom 19, 1/64 at zoom 16):
+- every block of the coarse image that one fine tile covers is scored with
+  tile_prefilter.rooftop_score, against a cutoff calibrated on the annotated
+  tiles shrunk to the same scale (so RECALL_TARGET of panel tiles would pass),
+- a coarse tile passes when at least MIN_BUILT_UP_SHARE of its blocks look
+  built up, and all its fine children are then kept (CHILD_SELECTION =
+  "block" keeps only the children whose own block looks built up),
+- fine cells are matched to their coarse tile through their centre, so the
+  screen works for both "index" and "xyz" addressing of the fine grid, and
+  fine tiles under a coarse tile that failed to download are always kept.
+"""
+import os
+import asyncio
+import aiohttp
+import numpy as np
+import cv2
+from tqdm import tqdm
+
+import city_tile_fetcher as fetcher
+from tile_grid import generate_xyz_grid, latlon_to_pixel, tile_filename, xyz_to_id, ADDRESSING_XYZ
+from tile_manifest import TileManifest, STATUS_DOWNLOADED
+from tile_prefilter import calibrate_threshold, positive_training_images, rooftop_score, RECALL_TARGET
+
+# --- CONFIGURATION ---
+# (the coarse zoom itself is the fetcher's COARSE_ZOOM, passed in like ZOOM)
+# Share of a coarse tile's blocks that must look built up for its children to be fetched
+MIN_BUILT_UP_SHARE = 0.05
+# "tile": all children of a passing coarse tile; "block": only children over built-up blocks
+CHILD_SELECTION = "tile"
+# Block score cutoff (None = calibrated on ANNOTATIONS at RECALL_TARGET)
+BUILT_UP_SCORE = None
+ANNOTATIONS = "./train/_annotations.coco.json"
+# ----------------------------------------
+
+
+def coarse_folder(folder, coarse_zoom):
+    return os.path.join(folder, f"coarse_z{coarse_zoom}")
+
+
+def block_built_up(bgr_image, levels, cutoff):
+    """(n, n) bool grid, n = 2**levels: which fine-tile-sized blocks of a coarse image look built up."""
+    n = 2 ** levels
+    height, width = bgr_image.shape[:2]
+    return np.array([[rooftop_score(bgr_image[r * height // n:(r + 1) * height // n,
+                                              c * width // n:(c + 1) * width // n]) >= cutoff
+                      for c in range(n)] for r in range(n)])
+
+
+class CoarseScreen:
+    """Keeps the fine tiles under built-up coarse tiles (see module docstring)."""
+
+    def __init__(self, tile_ids, built_up, coarse_zoom, tile_size_px, min_share=MIN_BUILT_UP_SHARE,
+                 child_selection=CHILD_SELECTION):
+        order = np.argsort(tile_ids)
+        self.tile_ids = np.asarray(tile_ids, dtype=np.int64)[order]
+        self.built_up = built_up[order]
+        self.tile_pass = self.built_up.mean(axis=(1, 2)) >= min_share if len(order) else np.empty(0, dtype=bool)
+        self.coarse_zoom = coarse_zoom
+        self.tile_size_px = tile_size_px
+        self.child_selection = child_selection
+
+    def overlay(self, tile_ids, lats, lons):
+        """Mask of the fine tiles (centred on lats/lons) still to fetch."""
+        keep = np.ones(len(lats), dtype=bool)
+        if not len(self.tile_ids) or not len(lats):
+            return keep
+        px, py = latlon_to_pixel(lats, lons, self.coarse_zoom)
+        cx, cy = (px // self.tile_size_px).astype(np.int64), (py // self.tile_size_px).astype(np.int64)
+        pos = np.minimum(np.searchsorted(self.tile_ids, xyz_to_id(self.coarse_zoom, cx, cy)), len(self.tile_ids) - 1)
+        known = self.tile_ids[pos] == xyz_to_id(self.coarse_zoom, cx, cy)
+        if self.child_selection == "block":
+            n = self.built_up.shape[1]
+            bx = ((px - cx * self.tile_size_px) * n // self.tile_size_px).astype(np.int64).clip(0, n - 1)
+            by = ((py - cy * self.tile_size_px) * n // self.tile_size_px).astype(np.int64).clip(0, n - 1)
+            keep[known] = self.built_up[pos[known], by[known], bx[known]]
+        else:
+            keep[known] = self.tile_pass[pos[known]]
+        return keep
+
+    def screen_chunks(self, pending_chunks):
+        """Drops fine tiles under coarse tiles that did not pass from iter_pending_tiles chunks."""
+        for n_cells, indices, lats, lons in pending_chunks:
+            needed = self.overlay(indices, lats, lons)
+            yield n_cells, indices[needed], lats[needed], lons[needed]
+
+
+def request_counter(counts):
+    """aiohttp TraceConfig counting every request sent (retries included) in counts["requests"]."""
+    async def on_start(session, ctx, params):
+        counts["requests"] += 1
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_start)
+    return trace
+
+
+async def fetch_coarse_tiles(polygon, folder, coarse_zoom):
+    """
+    Downloads (or resumes) every coarse tile of the area into folder through
+    the fetcher's streaming path. Returns (downloaded tile ids, HTTP requests
+    made by this call, retries included; 0 when everything was already there).
+    """
+    tile_ids, lats, lons = generate_xyz_grid(polygon, coarse_zoom, fetcher.TILE_SIZE_PX)
+    saved = fetcher.ZOOM, fetcher.ADDRESSING, fetcher.LOCAL_SAVE_FOLDER
+    # fetch_tile and the writer stage read these from the fetcher module (as in campaign.py)
+    fetcher.ZOOM, fetcher.ADDRESSING, fetcher.LOCAL_SAVE_FOLDER = coarse_zoom, ADDRESSING_XYZ, folder
+    try:
+        with TileManifest(folder) as manifest:
+            existing = manifest.indices(STATUS_DOWNLOADED)
+            pending = ~np.isin(tile_ids, np.fromiter(existing, dtype=np.int64, count=len(existing)))
+            n_pending = int(pending.sum())
+            counts = {"downloaded": 0, "failed": 0, "requests": 0}
+            print(f"🛰️ Coarse pass: {len(tile_ids)} tiles at zoom {coarse_zoom}, {n_pending} still to fetch")
+            if n_pending:
+                rate_controller = None
+                if fetcher.ADAPTIVE_RATE_CONTROL:
+                    rate_controller = fetcher.AdaptiveRateController(fetcher.INITIAL_QPS, fetcher.MAX_QPS,
+                                                                     fetcher.INITIAL_CONCURRENCY,
+                                                                     fetcher.MAX_CONCURRENT_DOWNLOADS)
+                chunks = [(len(tile_ids), tile_ids[pending], lats[pending], lons[pending])]
+                async with fetcher.make_session([request_counter(counts)]) as session:
+                    await fetcher.run_streaming_downloads(session, asyncio.Semaphore(fetcher.MAX_CONCURRENT_DOWNLOADS),
+                                                          manifest, chunks, n_pending, counts, rate_controller)
+            downloaded = manifest.indices(STATUS_DOWNLOADED)
+    finally:
+        fetcher.ZOOM, fetcher.ADDRESSING, fetcher.LOCAL_SAVE_FOLDER = saved
+    return sorted(downloaded.intersection(tile_ids.tolist())), counts["requests"]
+
+
+def score_coarse_tiles(folder, tile_ids, levels, cutoff):
+    """(ids, (k, n, n) built-up blocks) for the readable coarse tiles in folder."""
+    scored_ids, grids = [], []
+    for tile_id in tqdm(tile_ids, desc="Scoring coarse tiles", leave=False, ncols=100):
+        img = cv2.imread(os.path.join(folder, tile_filename(tile_id)))
+        if img is not None:
+            scored_ids.append(tile_id)
+            grids.append(block_built_up(img, levels, cutoff))
+    n = 2 ** levels
+    return np.asarray(scored_ids, dtype=np.int64), np.asarray(grids, dtype=bool).reshape(-1, n, n)
+
+
+async def build_coarse_screen(polygon, folder, zoom, coarse_zoom, cutoff=BUILT_UP_SCORE,
+                              annotations_path=ANNOTATIONS, recall_target=RECALL_TARGET):
+    """Runs the coarse pass and returns (CoarseScreen, coarse HTTP requests made, retries included)."""
+    levels = zoom - coarse_zoom
+    if levels <= 0:
+        raise ValueError(f"COARSE_ZOOM ({coarse_zoom}) must be below ZOOM ({zoom})")
+    if cutoff is None:
+        cutoff = calibrate_threshold(positive_training_images(annotations_path), recall_target, downsample=2 ** levels)
+        print(f"🧮 Built-up block cutoff {cutoff:.4f} (recall target {recall_target:.0%})")
+    folder = coarse_folder(folder, coarse_zoom)
+    coarse_ids, requests = await fetch_coarse_tiles(polygon, folder, coarse_zoom)
+    scored_ids, built_up = score_coarse_tiles(folder, coarse_ids, levels, cutoff)
+    screen = CoarseScreen(scored_ids, built_up, coarse_zoom, fetcher.TILE_SIZE_PX)
+    print(f"🏙️ {int(screen.tile_pass.sum())} of {len(scored_ids)} coarse tiles look built up "
+          f"({built_up.mean() if built_up.size else 0:.0%} of blocks)")
+    return screen, requests
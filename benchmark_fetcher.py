@@ -0,0 +1,165 @@
+"""
+End-to-end throughput benchmark of city_tile_fetcher against mock_static_maps.
+
+For each MAX_CONCURRENT_DOWNLOADS value, downloads a synthetic circular area
+through the same streaming path main() uses (fetch_tile, manifest, rate
+controller, tile storage) against a local mock server, and reports tiles/s,
+p50/p99 request latency, retries, 429s and peak Python memory. No API key or
+quota is used, so downloader regressions can be caught offline.
+
+Each level also runs against every STORAGE_DIRS entry, with the writer stage
+(tile_writer.py) on and off, so adding a mounted Drive / NFS folder shows how
+much slow storage costs inline writes versus the writer thread.
+"""
+import asyncio
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import aiohttp
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import Point
+
+import city_tile_fetcher as fetcher
+from mock_static_maps import MockStaticMapsServer
+from tile_grid import compute_tile_steps
+from tile_manifest import TileManifest
+from tile_store import ShardedTileStore
+
+# --- CONFIGURATION ---
+CENTER_LAT, CENTER_LON = 28.5450, 77.1926   # IIT Delhi
+RADIUS_KM = 2.0                             # ~390 tiles at zoom 19
+CONCURRENCY_LEVELS = [10, 30, 60]
+# Folders to write tiles under (None = local temp dir); add e.g. "/content/drive/MyDrive/bench" for slow storage
+STORAGE_DIRS = [None]
+# fetcher.WRITE_STAGE values to compare
+WRITE_STAGES = [False, True]
+# Mock server behaviour (see mock_static_maps.py)
+MOCK_LATENCY_MS = 80
+MOCK_LATENCY_JITTER_MS = 40
+MOCK_ERROR_RATE = 0.01
+MOCK_THROTTLE_QPS = None
+MOCK_BURST_429_EVERY_S = 0
+MOCK_BURST_429_DURATION_S = 0
+MOCK_PAYLOAD_BYTES = 450_000
+# Fetcher overrides for the run (keeps retry sleeps short)
+MAX_BACKOFF_DELAY = 2
+# Fail (exit 1) if any level is slower than this, e.g. in CI (None = report only)
+MIN_TILES_PER_SECOND = None
+# ----------------------------------------
+
+
+def request_tracer(latencies, statuses):
+    """aiohttp TraceConfig recording per-request latency (s) and status."""
+    async def on_start(session, ctx, params):
+        ctx.start = time.perf_counter()
+
+    async def on_end(session, ctx, params):
+        latencies.append(time.perf_counter() - ctx.start)
+        statuses.append(params.response.status)
+
+    async def on_exception(session, ctx, params):
+        latencies.append(time.perf_counter() - ctx.start)
+        statuses.append(None)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_start)
+    trace.on_request_end.append(on_end)
+    trace.on_request_exception.append(on_exception)
+    return trace
+
+
+def benchmark_polygon():
+    df_point = gpd.GeoDataFrame(geometry=[Point(CENTER_LON, CENTER_LAT)], crs="EPSG:4326")
+    return df_point.to_crs(epsg=3857).buffer(RADIUS_KM * 1000).to_crs(epsg=4326).iloc[0]
+
+
+async def run_level(polygon, concurrency, storage_dir=None, write_stage=True):
+    folder = tempfile.mkdtemp(prefix="bench_tiles_", dir=storage_dir)
+    fetcher.LOCAL_SAVE_FOLDER = folder
+    fetcher.WRITE_STAGE = write_stage
+    fetcher.MAX_CONCURRENT_DOWNLOADS = concurrency
+    fetcher.TASK_QUEUE_SIZE = concurrency * 4
+    fetcher.MAX_BACKOFF_DELAY = MAX_BACKOFF_DELAY
+
+    minx, miny, maxx, maxy = polygon.bounds
+    step_x, step_y, _, _ = compute_tile_steps(miny, maxy, fetcher.ZOOM, fetcher.TILE_SIZE_PX)
+    existing = np.empty(0, dtype=np.int64)
+    total = sum(len(indices) for _, indices, _, _ in fetcher.iter_pending_tiles(polygon, step_x, step_y, existing))
+
+    latencies, statuses = [], []
+    counts = {"downloaded": 0, "failed": 0}
+    server = MockStaticMapsServer(latency_ms=MOCK_LATENCY_MS, latency_jitter_ms=MOCK_LATENCY_JITTER_MS,
+                                  error_rate=MOCK_ERROR_RATE, throttle_qps=MOCK_THROTTLE_QPS,
+                                  burst_429_every_s=MOCK_BURST_429_EVERY_S,
+                                  burst_429_duration_s=MOCK_BURST_429_DURATION_S, payload_bytes=MOCK_PAYLOAD_BYTES)
+    async with server:
+        fetcher.STATIC_MAPS_URL = server.url
+        manifest = TileManifest(folder)
+        tile_store = ShardedTileStore(folder) if fetcher.TILE_STORAGE == "shards" else None
+        rate_controller = None
+        if fetcher.ADAPTIVE_RATE_CONTROL:
+            rate_controller = fetcher.AdaptiveRateController(fetcher.INITIAL_QPS, fetcher.MAX_QPS,
+                                                             fetcher.INITIAL_CONCURRENCY, concurrency)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        async with fetcher.make_session([request_tracer(latencies, statuses)]) as session:
+            pending = fetcher.iter_pending_tiles(polygon, step_x, step_y, existing)
+            await fetcher.run_streaming_downloads(session, semaphore, manifest, pending, total, counts,
+                                                  rate_controller, tile_store)
+        elapsed = time.perf_counter() - start
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+
+        if tile_store is not None: tile_store.close()
+        manifest.close()
+    shutil.rmtree(folder, ignore_errors=True)
+
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "concurrency": concurrency,
+        "storage": storage_dir or "local",
+        "write_stage": write_stage,
+        "tiles": total,
+        "downloaded": counts["downloaded"],
+        "failed": counts["failed"],
+        "tiles_per_s": counts["downloaded"] / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else 0.0,
+        "p99_ms": float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else 0.0,
+        "requests": len(statuses),
+        "retries": len(statuses) - counts["downloaded"] - counts["failed"],
+        "throttled": statuses.count(429),
+        "peak_mb": peak_mb,
+        "settled_qps": rate_controller.summary()["qps"] if rate_controller else None,
+    }
+
+
+async def main():
+    polygon = benchmark_polygon()
+    print(f"🏁 Fetcher benchmark: {RADIUS_KM} km radius, mock latency {MOCK_LATENCY_MS}±{MOCK_LATENCY_JITTER_MS} ms, "
+          f"error rate {MOCK_ERROR_RATE}, payload ~{MOCK_PAYLOAD_BYTES // 1000} KB, storage '{fetcher.TILE_STORAGE}'")
+    results = [await run_level(polygon, n, storage_dir, write_stage)
+               for storage_dir in STORAGE_DIRS for write_stage in WRITE_STAGES for n in CONCURRENCY_LEVELS]
+
+    print(f"\n{'storage':<24} {'writer':>6} {'conc':>5} {'tiles':>6} {'ok':>6} {'fail':>5} {'tiles/s':>8} {'p50 ms':>7} {'p99 ms':>7} "
+          f"{'retries':>7} {'429s':>5} {'peak MB':>8} {'QPS':>6}")
+    for r in results:
+        qps = f"{r['settled_qps']:.1f}" if r["settled_qps"] is not None else "-"
+        print(f"{r['storage'][-24:]:<24} {'on' if r['write_stage'] else 'off':>6} {r['concurrency']:>5} {r['tiles']:>6} {r['downloaded']:>6} {r['failed']:>5} {r['tiles_per_s']:>8.1f} "
+              f"{r['p50_ms']:>7.1f} {r['p99_ms']:>7.1f} {r['retries']:>7} {r['throttled']:>5} {r['peak_mb']:>8.1f} {qps:>6}")
+
+    if MIN_TILES_PER_SECOND is not None:
+        slow = [r for r in results if r["tiles_per_s"] < MIN_TILES_PER_SECOND]
+        if slow:
+            print(f"❌ Regression: {len(slow)} level(s) below {MIN_TILES_PER_SECOND} tiles/s")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main())
@@ -0,0 +1,184 @@
+"""
+CPU inference benchmark of the eager fp32 model against exported variants.
+
+Every VARIANTS entry is exported with model_export.export_model (unless it
+is the eager fp32 baseline) and run over the test split in its own spawned
+process, so the reported peak RSS (ru_maxrss) belongs to that variant alone.
+For each variant it reports:
+- tiles/s of the predictor call (model + mask pasting, decoding excluded),
+- peak RSS of the process,
+- COCO bbox / segm AP against test/_annotations.coco.json (pycocotools),
+- mean per-image IoU of the panel mask union against the ground truth and
+  against the fp32 baseline's union at SCORE_THRESH_TEST (the drift), plus
+  the AP deltas to the baseline.
+All models keep detections down to CACHE_SCORE_FLOOR, as in cached runs,
+so AP is computed over the full ranking.
+"""
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+import numpy as np
+import cv2
+
+# --- CONFIGURATION ---
+TEST_ANNOTATIONS = "./test/_annotations.coco.json"
+# (name, input size, quantize); input size None = eager fp32 model through BatchPredictor
+VARIANTS = [
+    ("fp32 eager", None, False),
+    ("ts fp32 640", 640, False),
+    ("ts int8 640", 640, True),
+    ("ts int8 512", 512, True),
+]
+EXPORT_DIR = "./exported_models"
+WEIGHTS = None  # None = detection_pipeline.MODEL_WEIGHTS
+TORCH_THREADS = None  # None = torch default (all cores)
+# Fail (exit 1) if any variant loses more segm AP than this vs fp32, e.g. in CI (None = report only)
+MAX_SEGM_AP_DROP = None
+# ----------------------------------------
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3  # bytes on macOS, KB on Linux
+
+
+def run_variant(cfg_yaml, exported_path, images, score_thresh):
+    """
+    Runs one predictor over images ((image_id, path) pairs) in this process.
+    Returns timing, peak RSS, COCO result dicts and packed mask unions.
+    """
+    import torch
+    from detectron2.config import CfgNode
+    from pycocotools import mask as mask_utils
+    from heatmap_inference import make_predictor
+    if TORCH_THREADS:
+        torch.set_num_threads(TORCH_THREADS)
+    cfg = CfgNode.load_cfg(cfg_yaml)
+    predictor = make_predictor(cfg, exported_path)
+    decoded = [(image_id, cv2.imread(path)) for image_id, path in images]
+    predictor([predictor.preprocess(decoded[0][1])])  # Warm-up (allocator, lazy init)
+
+    detections, unions, model_s = [], {}, 0.0
+    for image_id, bgr_image in decoded:
+        model_input = predictor.preprocess(bgr_image)
+        start = time.perf_counter()
+        instances = predictor([model_input])[0]["instances"].to("cpu")
+        model_s += time.perf_counter() - start
+        masks = instances.pred_masks.numpy().astype(np.uint8)
+        scores = instances.scores.numpy()
+        boxes = instances.pred_boxes.tensor.numpy()
+        for mask, score, (x0, y0, x1, y1) in zip(masks, scores, boxes):
+            rle = mask_utils.encode(np.asfortranarray(mask))
+            rle["counts"] = rle["counts"].decode()
+            detections.append({"image_id": image_id, "category_id": 1, "score": float(score), "segmentation": rle,
+                               "bbox": [float(x0), float(y0), float(x1 - x0), float(y1 - y0)]})
+        union = masks[scores >= score_thresh].any(axis=0) if len(masks) else np.zeros(bgr_image.shape[:2], bool)
+        unions[image_id] = np.packbits(union)
+    return {
+        "tiles_per_s": len(decoded) / model_s if model_s > 0 else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "detections": detections,
+        "unions": unions,
+    }
+
+
+def coco_ap(coco_gt, detections, iou_type):
+    """(AP, AP50) of detections; single class, so categories are ignored."""
+    from pycocotools.cocoeval import COCOeval
+    if not detections:
+        return 0.0, 0.0
+    coco_eval = COCOeval(coco_gt, coco_gt.loadRes(detections), iou_type)
+    coco_eval.params.useCats = 0
+    coco_eval.evaluate()
+    coco_eval.accumulate()
+    coco_eval.summarize()
+    return float(coco_eval.stats[0]), float(coco_eval.stats[1])
+
+
+def mean_iou(unions, references):
+    """Mean per-image IoU of packed unions against references (both empty = 1)."""
+    ious = []
+    for image_id, packed in unions.items():
+        pred, ref = np.unpackbits(packed).astype(bool), np.unpackbits(references[image_id]).astype(bool)
+        union = np.count_nonzero(pred | ref)
+        ious.append(np.count_nonzero(pred & ref) / union if union else 1.0)
+    return float(np.mean(ious)) if ious else 0.0
+
+
+def ground_truth_unions(coco_gt):
+    unions = {}
+    for image_id, info in coco_gt.imgs.items():
+        union = np.zeros((info["height"], info["width"]), dtype=bool)
+        for ann in coco_gt.loadAnns(coco_gt.getAnnIds(imgIds=image_id)):
+            union |= coco_gt.annToMask(ann).astype(bool)
+        unions[image_id] = np.packbits(union)
+    return unions
+
+
+def main():
+    from pycocotools.coco import COCO
+    from detection_cache import caching_cfg
+    from detection_pipeline import build_model_cfg
+    from model_export import export_model
+
+    cfg = build_model_cfg(WEIGHTS) if WEIGHTS else build_model_cfg()
+    score_thresh = cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST
+    cfg = caching_cfg(cfg)
+    cfg.MODEL.DEVICE = "cpu"
+    coco_gt = COCO(TEST_ANNOTATIONS)
+    test_dir = os.path.dirname(TEST_ANNOTATIONS)
+    images = [(image_id, os.path.join(test_dir, info["file_name"])) for image_id, info in sorted(coco_gt.imgs.items())]
+    gt_unions = ground_truth_unions(coco_gt)
+    print(f"🏁 Inference benchmark: {len(images)} test tiles, {len(VARIANTS)} variants, "
+          f"threads {TORCH_THREADS or 'default'}, masks at score >= {score_thresh}")
+
+    results = []
+    for name, input_size, quantize in VARIANTS:
+        exported_path = None
+        if input_size is not None:
+            exported_path = os.path.join(EXPORT_DIR, f"model_{'int8' if quantize else 'fp32'}_{input_size}.ts")
+            export_model(cfg, exported_path, input_size=input_size, quantize=quantize)
+        # A fresh process per variant, so ru_maxrss is not shared between them
+        with mp.get_context("spawn").Pool(1) as pool:
+            run = pool.apply(run_variant, (cfg.dump(), exported_path, images, score_thresh))
+        bbox_ap, bbox_ap50 = coco_ap(coco_gt, run["detections"], "bbox")
+        segm_ap, segm_ap50 = coco_ap(coco_gt, run["detections"], "segm")
+        results.append({
+            "name": name,
+            "size_mb": os.path.getsize(exported_path or cfg.MODEL.WEIGHTS) / 1e6,
+            "tiles_per_s": run["tiles_per_s"],
+            "peak_rss_mb": run["peak_rss_mb"],
+            "bbox_ap": bbox_ap, "bbox_ap50": bbox_ap50, "segm_ap": segm_ap, "segm_ap50": segm_ap50,
+            "gt_iou": mean_iou(run["unions"], gt_unions),
+            "unions": run["unions"],
+        })
+
+    baseline = results[0]
+    print(f"\n{'variant':<14} {'MB':>6} {'tiles/s':>8} {'speedup':>7} {'RSS MB':>7} {'bbox AP':>7} {'segm AP':>7} "
+          f"{'AP50':>6} {'dAP':>6} {'IoU gt':>6} {'IoU fp32':>8}")
+    for r in results:
+        r["segm_ap_drop"] = baseline["segm_ap"] - r["segm_ap"]
+        r["drift_iou"] = mean_iou(r["unions"], baseline["unions"])
+        speedup = r["tiles_per_s"] / baseline["tiles_per_s"] if baseline["tiles_per_s"] else 0.0
+        print(f"{r['name']:<14} {r['size_mb']:>6.0f} {r['tiles_per_s']:>8.2f} {speedup:>6.2f}x {r['peak_rss_mb']:>7.0f} "
+              f"{r['bbox_ap']:>7.3f} {r['segm_ap']:>7.3f} {r['segm_ap50']:>6.3f} {-r['segm_ap_drop']:>+6.3f} "
+              f"{r['gt_iou']:>6.3f} {r['drift_iou']:>8.3f}")
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    with open(os.path.join(EXPORT_DIR, "benchmark_inference.json"), "w") as f:
+        json.dump([{k: v for k, v in r.items() if k != "unions"} for r in results], f, indent=2)
+    if MAX_SEGM_AP_DROP is not None:
+        worse = [r for r in results if r["segm_ap_drop"] > MAX_SEGM_AP_DROP]
+        if worse:
+            print(f"❌ Regression: {len(worse)} variant(s) lose more than {MAX_SEGM_AP_DROP} segm AP vs fp32")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
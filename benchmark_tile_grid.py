@@ -0,0 +1,87 @@
+"""
+Benchmark for tile_grid.generate_tile_grid at city and state scale.
+
+Uses synthetic boundaries (no geocoding / network) and reports candidate
+grid cells tested per second. The original per-cell shapely loop is timed on
+a small sample of rows for comparison.
+"""
+import time
+import numpy as np
+import shapely
+from shapely import affinity
+from shapely.geometry import Point, MultiPolygon, Polygon
+
+from tile_grid import compute_tile_steps, grid_axes, generate_tile_grid
+
+# --- CONFIGURATION ---
+ZOOM = 19
+TILE_SIZE_PX = 640
+CENTER_LAT, CENTER_LON = 26.9124, 75.7873  # Jaipur
+CITY_RADIUS_KM = 15        # ~700 sq km, roughly a municipal boundary
+STATE_SPAN_KM = 250        # Multipolygon spread over ~250 x 250 km
+STATE_LOBES = 12
+LEGACY_SAMPLE_ROWS = 20    # Rows of the original loop to time for comparison
+# ----------------------------------------
+
+
+def circle_deg(lat, lon, radius_km):
+    """Approximate circular boundary in EPSG:4326 around (lat, lon)."""
+    radius_deg = radius_km / 111.32
+    circle = Point(lon, lat).buffer(radius_deg, quad_segs=64)
+    return affinity.scale(circle, xfact=1 / np.cos(np.radians(lat)), yfact=1.0)
+
+
+def synthetic_state(lat, lon, span_km, lobes, seed=0):
+    """Irregular multipolygon made of overlapping/disjoint circular lobes."""
+    rng = np.random.default_rng(seed)
+    span_deg = span_km / 111.32
+    parts = []
+    for _ in range(lobes):
+        dlat, dlon = rng.uniform(-span_deg / 2, span_deg / 2, size=2)
+        parts.append(circle_deg(lat + dlat, lon + dlon, rng.uniform(span_km / 12, span_km / 5)))
+    merged = shapely.union_all(parts)
+    return merged if merged.geom_type == "MultiPolygon" else MultiPolygon([merged])
+
+
+def legacy_rows(polygon, step_x, step_y, n_rows):
+    """Times the original per-cell Polygon + intersects() loop over the first n_rows rows."""
+    x_vals, y_vals = grid_axes(polygon, step_x, step_y)
+    half_step_x, half_step_y = step_x / 2, step_y / 2
+    mid = len(y_vals) // 2
+    rows = y_vals[mid:mid + n_rows]
+    start = time.perf_counter()
+    for lat in rows:
+        for lon in x_vals:
+            tile_box = Polygon([
+                (lon - half_step_x, lat - half_step_y), (lon - half_step_x, lat + half_step_y),
+                (lon + half_step_x, lat + half_step_y), (lon + half_step_x, lat - half_step_y)
+            ])
+            polygon.intersects(tile_box)
+    return len(rows) * len(x_vals), time.perf_counter() - start
+
+
+def run(name, polygon):
+    minx, miny, maxx, maxy = polygon.bounds
+    step_x, step_y, tile_size_meters, _ = compute_tile_steps(miny, maxy, ZOOM, TILE_SIZE_PX)
+    x_vals, y_vals = grid_axes(polygon, step_x, step_y)
+    total_cells = len(x_vals) * len(y_vals)
+
+    start = time.perf_counter()
+    indices, _, _ = generate_tile_grid(polygon, step_x, step_y)
+    elapsed = time.perf_counter() - start
+
+    legacy_cells, legacy_elapsed = legacy_rows(polygon, step_x, step_y, LEGACY_SAMPLE_ROWS)
+    legacy_rate = legacy_cells / legacy_elapsed if legacy_elapsed > 0 else float("nan")
+    rate = total_cells / elapsed if elapsed > 0 else float("nan")
+
+    print(f"--- {name} ({len(shapely.get_parts(polygon))} part(s)) ---")
+    print(f"   Grid: {len(x_vals)} x {len(y_vals)} = {total_cells} cells, {len(indices)} intersecting")
+    print(f"   Vectorized: {elapsed:.2f}s -> {rate:,.0f} cells/s")
+    print(f"   Legacy loop (sampled {legacy_cells} cells): {legacy_rate:,.0f} cells/s "
+          f"(~{total_cells / legacy_rate:.0f}s for the full grid)")
+    print(f"   Speedup: {rate / legacy_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    run(f"City ({CITY_RADIUS_KM} km radius)", circle_deg(CENTER_LAT, CENTER_LON, CITY_RADIUS_KM))
+    run(f"State (~{STATE_SPAN_KM} km span)", synthetic_state(CENTER_LAT, CENTER_LON, STATE_SPAN_KM, STATE_LOBES))
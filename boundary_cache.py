@@ -0,0 +1,106 @@
+"""
+Local cache of city boundaries / search areas.
+
+Every entry point resolves its area of interest through resolve_boundary(),
+which reads BOUNDARY_CACHE_DIR first and only geocodes with OSMnx on a miss.
+Each entry is a one-row GeoParquet file (EPSG:4326) keyed by the query string
+and buffer radius:
+- radius_km=None: the OSM boundary polygon of the query (ox.geocode_to_gdf),
+- radius_km=R:    an R km circle around the geocoded point of the query.
+Local shapefiles / GeoJSON (as used by Code_Shapefile_Image_gen) are stored
+under a query name with import_boundary(). With offline=True nothing goes to
+the network and a missing entry is an error.
+
+    python boundary_cache.py <boundary file> "<query>" [radius_km]
+"""
+import hashlib
+import os
+import re
+import sys
+import time
+import geopandas as gpd
+from shapely.geometry import Point
+
+# --- CONFIGURATION ---
+BOUNDARY_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "boundary_cache")
+# True: never geocode over the network (entries must already be cached or imported)
+OFFLINE = False
+# ----------------------------------------
+
+
+def boundary_path(query, radius_km=None, cache_dir=BOUNDARY_CACHE_DIR):
+    """Cache file for (query, radius_km); the query is normalized for case and whitespace."""
+    normalized = " ".join(query.split()).lower()
+    key = f"{normalized}|{'' if radius_km is None else float(radius_km)}"
+    slug = re.sub(r"[^a-z0-9]+", "_", normalized).strip("_")[:48]
+    return os.path.join(cache_dir, f"{slug}_{hashlib.sha1(key.encode()).hexdigest()[:12]}.parquet")
+
+
+def _store(gdf, query, radius_km, source, cache_dir):
+    gdf = gdf.to_crs(epsg=4326)
+    entry = gpd.GeoDataFrame({"query": [query], "radius_km": [radius_km], "source": [source],
+                              "created_at": [time.time()]}, geometry=[gdf.union_all()], crs="EPSG:4326")
+    path = boundary_path(query, radius_km, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    entry.to_parquet(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return entry
+
+
+def circle_around(lat, lon, radius_km):
+    """radius_km circle (EPSG:4326 GeoDataFrame) around a point, buffered in Web-Mercator meters."""
+    point = gpd.GeoDataFrame(geometry=[Point(lon, lat)], crs="EPSG:4326")
+    return gpd.GeoDataFrame(geometry=point.to_crs(epsg=3857).buffer(radius_km * 1000), crs="EPSG:3857").to_crs(epsg=4326)
+
+
+def geocode_boundary(query, radius_km=None):
+    """Looks the area up with OSMnx (network) as an EPSG:4326 GeoDataFrame."""
+    import osmnx as ox
+    if radius_km is None:
+        return ox.geocode_to_gdf(query).to_crs(epsg=4326)
+    lat, lon = ox.geocode(query)
+    return circle_around(lat, lon, radius_km)
+
+
+def resolve_boundary(query, radius_km=None, offline=None, cache_dir=BOUNDARY_CACHE_DIR, refresh=False):
+    """
+    One-row EPSG:4326 GeoDataFrame of the area for (query, radius_km), from the
+    cache when present, else geocoded and cached. Raises LookupError when it is
+    not cached and offline (OFFLINE by default) or geocoding fails.
+    """
+    offline = OFFLINE if offline is None else offline
+    path = boundary_path(query, radius_km, cache_dir)
+    if os.path.isfile(path) and not refresh:
+        return gpd.read_parquet(path)
+    if offline:
+        raise LookupError(f"No cached boundary for {query!r} (radius_km={radius_km}) in '{cache_dir}' and offline "
+                          f"mode is on; import one with boundary_cache.import_boundary()")
+    try:
+        gdf = geocode_boundary(query, radius_km)
+    except Exception as e:
+        raise LookupError(f"Could not geocode {query!r}: {e}") from e
+    return _store(gdf, query, radius_km, "osm", cache_dir)
+
+
+def import_boundary(path, query, radius_km=None, cache_dir=BOUNDARY_CACHE_DIR):
+    """
+    Caches a local boundary file (shapefile, GeoJSON, GeoPackage...) under query,
+    so resolve_boundary(query, radius_km) returns it without a network lookup.
+    With radius_km, the circle is drawn around the file's centroid.
+    """
+    gdf = gpd.read_file(path)
+    if gdf.crs is None:
+        gdf = gdf.set_crs(epsg=4326)
+    if radius_km is not None:
+        centroid = gdf.to_crs(epsg=3857).union_all().centroid
+        lon, lat = gpd.GeoSeries([centroid], crs="EPSG:3857").to_crs(epsg=4326).iloc[0].coords[0]
+        gdf = circle_around(lat, lon, radius_km)
+    return _store(gdf, query, radius_km, os.path.abspath(path), cache_dir)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        sys.exit(__doc__)
+    radius = float(sys.argv[3]) if len(sys.argv) == 4 else None
+    import_boundary(sys.argv[1], sys.argv[2], radius)
+    print(f"✅ Cached boundary for {sys.argv[2]!r} as '{boundary_path(sys.argv[2], radius)}'")
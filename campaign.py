@@ -0,0 +1,344 @@
+"""
+Multi-city fetch campaign: several regions downloaded through one pool.
+
+A campaign file lists the regions to fetch, each into its own folder and
+manifest, exactly as city_tile_fetcher.py would:
+
+    {
+      "zoom": 19,
+      "daily_quota": 25000,
+      "regions": [
+        {"name": "Jaipur", "city": "Jaipur Municipal Corporation, India",
+         "folder": "./Jaipur_Correct_City_Tiles", "priority": 2},
+        {"name": "Lucknow", "city": "Lucknow, India", "radius_km": 14,
+         "folder": "./Lucknow_City_Radius_Tiles", "priority": 1, "storage": "shards"}
+      ]
+    }
+
+- tiles of all regions are interleaved into one bounded queue by stride
+  scheduling, so a region with priority 2 gets twice the share of one with
+  priority 1; regions that finish hand their share to the rest,
+- every request goes through one ClientSession (fetcher.make_session), one
+  AdaptiveRateController and one QuotaBudget: a per-UTC-day request budget
+  kept in <campaign>.state.sqlite and shared by every campaign run that day,
+- each region's tiles and manifest rows are written by its own TileWriter
+  thread (tile_writer.py, with fetcher.WRITE_STAGE), off the event loop,
+- manifests and shard stores are checkpointed every CHECKPOINT_S (and on
+  exit), so a killed campaign resumes from the manifests with at most a few
+  seconds of tiles fetched twice. When the day's budget runs out the workers
+  stop, and the next run continues with the tiles that are left.
+
+    python campaign.py campaign.json     (or: python cli.py campaign campaign.json)
+"""
+import asyncio
+import heapq
+import json
+import os
+import sqlite3
+import sys
+import time
+import numpy as np
+from tqdm import tqdm
+
+import city_tile_fetcher as fetcher
+import telemetry
+from boundary_cache import resolve_boundary
+from rate_control import AdaptiveRateController
+from tile_grid import compute_tile_steps
+from tile_manifest import TileManifest, STATUS_DOWNLOADED
+from tile_store import ShardedTileStore
+from tile_writer import TileWriter
+
+# --- CONFIGURATION ---
+# Requests allowed per UTC day across all campaign runs (None = unlimited)
+DAILY_QUOTA = None
+# Requests reserved (and persisted) at a time; a killed run over-counts by at most this
+QUOTA_BLOCK = 50
+# Seconds between manifest / shard store commits
+CHECKPOINT_S = 10
+DEFAULT_PRIORITY = 1
+# ----------------------------------------
+
+
+class QuotaExhausted(Exception):
+    """The day's request budget is used up."""
+
+
+class QuotaBudget:
+    """Per-UTC-day request counter persisted in SQLite, reserved QUOTA_BLOCK requests at a time."""
+
+    def __init__(self, path, daily_quota, block=QUOTA_BLOCK):
+        self.daily_quota = daily_quota
+        self.block = block
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS quota (day TEXT PRIMARY KEY, used INTEGER NOT NULL)")
+        self._conn.commit()
+        self._day = None
+        self._reserved = 0
+        self.requests = 0
+
+    @staticmethod
+    def _today():
+        return time.strftime("%Y-%m-%d", time.gmtime())
+
+    def used(self):
+        row = self._conn.execute("SELECT used FROM quota WHERE day = ?", (self._today(),)).fetchone()
+        return row[0] if row else 0
+
+    def remaining(self):
+        return None if self.daily_quota is None else max(0, self.daily_quota - self.used() + self._reserved)
+
+    def take(self):
+        """Counts one request; raises QuotaExhausted once the day's budget is spent."""
+        if self._day != self._today():
+            self._day, self._reserved = self._today(), 0
+        if self._reserved == 0:
+            used = self.used()
+            grant = self.block if self.daily_quota is None else min(self.block, self.daily_quota - used)
+            if grant <= 0:
+                raise QuotaExhausted(f"Daily quota of {self.daily_quota} requests used up for {self._day} (UTC)")
+            with self._conn:
+                self._conn.execute("INSERT INTO quota VALUES (?, ?) ON CONFLICT(day) DO UPDATE SET used = used + ?",
+                                   (self._day, grant, grant))
+            self._reserved = grant
+        self._reserved -= 1
+        self.requests += 1
+
+    def close(self):
+        # Unused reservations are handed back
+        if self._conn is not None:
+            if self._reserved and self._day == self._today():
+                with self._conn:
+                    self._conn.execute("UPDATE quota SET used = MAX(0, used - ?) WHERE day = ?", (self._reserved, self._day))
+            self._conn.close()
+            self._conn = None
+
+
+class QuotaRateController:
+    """
+    Rate controller handed to fetch_tile: every attempt takes one request from
+    the QuotaBudget before going through the shared AdaptiveRateController.
+    """
+
+    def __init__(self, budget, inner=None):
+        self.budget = budget
+        self.inner = inner
+
+    async def acquire(self):
+        self.budget.take()
+        if self.inner is not None:
+            await self.inner.acquire()
+
+    async def release(self, status):
+        if self.inner is not None:
+            await self.inner.release(status)
+
+
+class Region:
+    """One campaign region: its search area, manifest, optional shard store and pending tiles."""
+
+    def __init__(self, spec, zoom):
+        self.name = spec.get("name", spec["city"])
+        self.city = spec["city"]
+        self.radius_km = spec.get("radius_km")
+        self.folder = spec["folder"]
+        self.priority = float(spec.get("priority", DEFAULT_PRIORITY))
+        self.storage = spec.get("storage", fetcher.TILE_STORAGE)
+        self.zoom = zoom
+        self.counts = {"downloaded": 0, "failed": 0}
+        self.manifest = None
+        self.tile_store = None
+        self.tile_writer = None
+
+    def open(self, offline=False):
+        """Resolves the area, opens the manifest and counts the tiles still to fetch."""
+        self.polygon = resolve_boundary(self.city, self.radius_km, offline=offline).geometry.iloc[0]
+        minx, miny, maxx, maxy = self.polygon.bounds
+        self.step_x, self.step_y, _, _ = compute_tile_steps(miny, maxy, self.zoom, fetcher.TILE_SIZE_PX)
+        self.manifest = TileManifest(self.folder)
+        self.tile_store = ShardedTileStore(self.folder) if self.storage == "shards" else None
+        existing = self.manifest.indices(STATUS_DOWNLOADED)
+        self.existing_sorted = np.sort(np.fromiter(existing, dtype=np.int64, count=len(existing)))
+        self.pending = sum(len(indices) for _, indices, _, _ in
+                           fetcher.iter_pending_tiles(self.polygon, self.step_x, self.step_y, self.existing_sorted))
+        return self.pending
+
+    def iter_tasks(self):
+        """fetch_tile argument tuples for every tile not downloaded yet (lazy)."""
+        for _, indices, lats, lons in fetcher.iter_pending_tiles(self.polygon, self.step_x, self.step_y, self.existing_sorted):
+            for index, lat, lon in zip(indices.tolist(), lats.tolist(), lons.tolist()):
+                yield index, self.pending, lat, lon, self.folder
+
+    def start_writer(self):
+        if fetcher.WRITE_STAGE:
+            self.tile_writer = TileWriter(self.folder, self.zoom, self.manifest, self.tile_store, fetcher.FSYNC_POLICY)
+            self.tile_writer.start()
+
+    async def stop_writer(self):
+        if self.tile_writer is not None:
+            await self.tile_writer.close()
+            self.tile_writer = None
+
+    async def checkpoint(self):
+        if self.tile_writer is not None:
+            # Commits on the writer thread, between two batches
+            await self.tile_writer.checkpoint()
+            return
+        # Shard data first, so a committed manifest row always has its bytes on disk
+        if self.tile_store is not None:
+            self.tile_store.flush()
+        if self.manifest is not None:
+            self.manifest.commit()
+
+    def close(self):
+        if self.tile_store is not None:
+            self.tile_store.close()
+            self.tile_store = None
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+
+
+def interleave(regions):
+    """Stride scheduling: yields (region, task) with each region's share proportional to its priority."""
+    heap = [(0.0, order, region, region.iter_tasks()) for order, region in enumerate(regions) if region.pending]
+    heapq.heapify(heap)
+    while heap:
+        pass_value, order, region, tasks = heapq.heappop(heap)
+        task = next(tasks, None)
+        if task is None:
+            continue
+        yield region, task
+        heapq.heappush(heap, (pass_value + 1.0 / region.priority, order, region, tasks))
+
+
+async def campaign_producer(queue, regions, n_workers, stop):
+    for region, task in interleave(regions):
+        if stop.is_set():
+            break
+        await queue.put((region, task))
+    for _ in range(n_workers):
+        await queue.put(None)
+
+
+async def campaign_worker(session, semaphore, queue, rate_controller, pbar, stop):
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        if stop.is_set():
+            continue
+        region, task = item
+        try:
+            fetcher.tally_result(region.counts, await fetcher.fetch_tile(session, semaphore, task, region.manifest,
+                                                                         rate_controller, region.tile_store,
+                                                                         tile_writer=region.tile_writer))
+        except QuotaExhausted as exc:
+            # The tile was not recorded, so it is fetched by the next run
+            if not stop.is_set():
+                print(f"\n⛽ {exc}; stopping the campaign.")
+                stop.set()
+            continue
+        except Exception as exc:
+            region.counts["failed"] += 1; print(f"❗️ Task processing error: {exc}")
+        pbar.update(1)
+
+
+async def checkpointer(regions, stop, interval_s=CHECKPOINT_S):
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval_s)
+        except asyncio.TimeoutError:
+            pass
+        for region in regions:
+            await region.checkpoint()
+
+
+def load_campaign(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+async def run_campaign(campaign_path, offline=False):
+    campaign = load_campaign(campaign_path)
+    zoom = campaign.get("zoom", fetcher.ZOOM)
+    daily_quota = campaign.get("daily_quota", DAILY_QUOTA)
+    # fetch_tile and iter_pending_tiles read the zoom from the fetcher module
+    fetcher.ZOOM = zoom
+    if "addressing" in campaign:
+        fetcher.ADDRESSING = campaign["addressing"]
+
+    regions = [Region(spec, zoom) for spec in campaign["regions"]]
+    budget = QuotaBudget(os.path.splitext(campaign_path)[0] + ".state.sqlite", daily_quota)
+    try:
+        print(f"🗺️ Campaign '{campaign_path}': {len(regions)} regions at zoom {zoom}")
+        for region in regions:
+            pending = region.open(offline)
+            print(f"   {region.name}: {pending} tiles to fetch into '{region.folder}' (priority {region.priority:g})")
+        total = sum(region.pending for region in regions)
+        remaining = budget.remaining()
+        if remaining is not None:
+            print(f"⛽ Daily quota: {remaining} of {daily_quota} requests left today (UTC)")
+        if total == 0:
+            print("\n✅ No new tiles need to be downloaded.")
+            return
+
+        inner = None
+        if fetcher.ADAPTIVE_RATE_CONTROL:
+            inner = AdaptiveRateController(fetcher.INITIAL_QPS, fetcher.MAX_QPS, fetcher.INITIAL_CONCURRENCY,
+                                           fetcher.MAX_CONCURRENT_DOWNLOADS)
+        rate_controller = QuotaRateController(budget, inner)
+        semaphore = asyncio.Semaphore(fetcher.MAX_CONCURRENT_DOWNLOADS)
+        stop = asyncio.Event()
+        queue = asyncio.Queue(maxsize=fetcher.TASK_QUEUE_SIZE)
+        start = time.perf_counter()
+        for region in regions:
+            region.start_writer()
+        async with fetcher.make_session() as session:
+            with tqdm(total=total, desc="Campaign", ncols=100) as pbar:
+                workers = [asyncio.create_task(campaign_worker(session, semaphore, queue, rate_controller, pbar, stop))
+                           for _ in range(fetcher.MAX_CONCURRENT_DOWNLOADS)]
+                producer = asyncio.create_task(campaign_producer(queue, regions, len(workers), stop))
+                saver = asyncio.create_task(checkpointer(regions, stop))
+                loop_monitor = asyncio.create_task(telemetry.monitor_event_loop())
+                try:
+                    await asyncio.gather(producer, *workers)
+                finally:
+                    stop.set()
+                    producer.cancel()
+                    loop_monitor.cancel()
+                    for worker in workers: worker.cancel()
+                    await asyncio.gather(saver, return_exceptions=True)
+                    for region in regions:
+                        await region.stop_writer()
+        elapsed = time.perf_counter() - start
+    finally:
+        for region in regions:
+            region.close()
+        budget.close()
+
+    for region in regions:
+        telemetry.event("campaign_region_summary", region=region.name, pending=region.pending, **region.counts)
+
+    print("\n🎉 Campaign run complete!")
+    print(f"--- Summary ({elapsed:.0f}s, {budget.requests} requests) ---")
+    for region in regions:
+        print(f"{region.name}: {region.counts['downloaded']} downloaded, {region.counts['failed']} failed "
+              f"of {region.pending} pending")
+    if inner is not None:
+        rate = inner.summary()
+        print(f"Rate control: settled at {rate['qps']:.1f} QPS / {rate['concurrency']} concurrent")
+    print(f"-------------")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        sys.exit(__doc__)
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(run_campaign(argv[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,259 +1,500 @@
-import geopandas as gpd
-from shapely.geometry import Point, Polygon
-import numpy as np
-import requests 
-import os
-import osmnx as ox
-import time
-import random
-import asyncio 
-import aiohttp 
-import glob
-import re
-import sys
-from tqdm import tqdm 
-from tqdm.asyncio import tqdm_asyncio 
-
-# --- CONFIGURATION ---
-API_KEY = ""  # <--- YOUR API KEY
-# Changed to specific campus name for accurate geocoding
-CITY_NAME = "Indian Institute of Technology Delhi" 
-ZOOM = 19
-SIZE_STR = "640x640" 
-TILE_SIZE_PX = 640 
-MAPTYPE = "satellite"
-
-# --- RADIUS CONFIG ---
-# Reduced to 1.5 km. IIT Delhi is approx 1.3 sq km, so 1.5 km radius 
-# covers the campus + immediate surroundings perfectly.
-RADIUS_KM = 1.5 
-
-# --- PERFORMANCE CONFIG ---
-MAX_CONCURRENT_DOWNLOADS = 30
-REQUEST_TIMEOUT = 25
-MAX_BACKOFF_DELAY = 60 
-MAX_RETRIES = 3 
-
-# --- SAVE LOCATIONS ---
-# Updated folder name for clarity
-LOCAL_SAVE_FOLDER = "./IIT_Delhi_Tiles" 
-# ----------------------------------------
-
-async def fetch_tile(session, semaphore, args):
-    """
-    Asynchronously fetches a single tile using aiohttp with semaphore control.
-    """
-    async with semaphore: 
-        i, total_to_download_count, lat, lon, local_folder = args
-        tile_filepath = os.path.join(local_folder, f"tile_{i}.png")
-
-        # Check existence
-        if os.path.exists(tile_filepath):
-             return "skipped_local", f"Skipped tile {i+1} (already in {os.path.basename(local_folder)})"
-
-        center = f"{lat},{lon}"
-        url = (
-            f"https://maps.googleapis.com/maps/api/staticmap?"
-            f"center={center}&zoom={ZOOM}&size={SIZE_STR}&maptype={MAPTYPE}&key={API_KEY}"
-        )
-
-        for attempt in range(MAX_RETRIES):
-            error_message_for_retry = ""
-            should_retry = False
-            try:
-                async with session.get(url, timeout=REQUEST_TIMEOUT) as response:
-                    if response.status == 200:
-                        content = await response.read()
-                        # Ensure folder exists (async safe-ish)
-                        os.makedirs(local_folder, exist_ok=True)
-                        with open(tile_filepath, "wb") as f:
-                            f.write(content)
-                        return "downloaded", f"Downloaded tile {i+1}" 
-
-                    elif response.status in [403, 429, 500, 503]:
-                        error_message_for_retry = f"Status {response.status}"
-                        should_retry = True
-                    else:
-                        print(f"\r❌ Tile {i+1}: Failed with permanent status {response.status}. Giving up.")
-                        return "failed", f"Failed tile {i+1} status {response.status}" 
-            except asyncio.TimeoutError:
-                error_message_for_retry = "Timed out"
-                should_retry = True
-            except aiohttp.ClientError as e:
-                error_message_for_retry = f"Network error ({e})"
-                should_retry = True
-            except Exception as e:
-                 print(f"\r❌ Tile {i+1}: Unexpected error: {e}. Giving up.")
-                 return "failed", f"Failed tile {i+1} unexpected error: {e}" 
-
-            if should_retry:
-                wait_time = min(((2 ** attempt)) + random.random(), MAX_BACKOFF_DELAY)
-                # Simple print to show retry is happening
-                # print(f"\r⏳ Retry tile {i+1} in {wait_time:.1f}s...", end="")
-                await asyncio.sleep(wait_time)
-        
-        return "failed", f"Failed tile {i+1} after {MAX_RETRIES} attempts."
-
-
-def get_existing_indices(folder_path):
-    """Scans a folder and returns a set of indices from tile_*.png files."""
-    indices = set()
-    if not os.path.isdir(folder_path):
-        print(f"ℹ️ Directory not found or skipped checking: '{folder_path}'")
-        return indices
-    print(f"🔍 Scanning '{folder_path}' for existing tiles...")
-    search_pattern = os.path.join(folder_path, "tile_*.png")
-    existing_files = glob.glob(search_pattern)
-    tile_pattern = re.compile(r"tile_(\d+)\.png$")
-    count = 0
-    for f_path in tqdm(existing_files, desc=f"Scanning {os.path.basename(folder_path)}", leave=False, ncols=100):
-        match = tile_pattern.search(os.path.basename(f_path))
-        if match:
-            try:
-                indices.add(int(match.group(1)))
-                count += 1
-            except ValueError: pass
-    print(f"✅ Found {count} valid tiles in '{os.path.basename(folder_path)}'.")
-    return indices
-
-
-async def main():
-    os.makedirs(LOCAL_SAVE_FOLDER, exist_ok=True)
-
-    # --- CHANGED: Radius Logic Starts Here ---
-    print(f"🌍 Locating center point for: {CITY_NAME}")
-    try:
-        # 1. Get Center Point
-        center_lat, center_lon = ox.geocode(CITY_NAME)
-        print(f"✅ Found center at: {center_lat:.5f}, {center_lon:.5f}")
-    except Exception as e:
-        print(f"❌ Error locating city: {e}")
-        print("⚠️ Attempting fallback coordinates for IIT Delhi...")
-        # Fallback to hardcoded IIT Delhi coordinates if OSM fails
-        center_lat, center_lon = 28.5450, 77.1926
-        print(f"✅ Using fallback center at: {center_lat:.5f}, {center_lon:.5f}")
-
-    print(f"📐 Creating {RADIUS_KM} km radius buffer around the center...")
-    
-    # 2. Create Buffer (Circle)
-    # Create a Point in WGS84
-    df_point = gpd.GeoDataFrame(geometry=[Point(center_lon, center_lat)], crs="EPSG:4326")
-    # Project to Meters (EPSG:3857) to do distance calculation
-    df_projected = df_point.to_crs(epsg=3857)
-    # Buffer by Radius in Meters
-    circle_geometry = df_projected.buffer(RADIUS_KM * 1000)
-    # Project back to Lat/Lon (EPSG:4326)
-    gdf_boundary = gpd.GeoDataFrame(geometry=circle_geometry, crs="EPSG:3857").to_crs(epsg=4326)
-    
-    # Get the polygon from the GDF
-    polygon = gdf_boundary.geometry.iloc[0]
-    minx, miny, maxx, maxy = polygon.bounds
-    
-    print(f"✅ Created Circular Boundary covering ~{int(gdf_boundary.to_crs(epsg=3857).area.iloc[0] / 1e6)} sq km.")
-    # --- END Radius Logic ---
-
-    # --- Calculate Disjoint Step Size ---
-    print("Calculating tile step size based on latitude...")
-    avg_lat = (miny + maxy) / 2
-    avg_lat_rad = np.radians(avg_lat)
-    meters_per_pixel = (156543.03 * np.cos(avg_lat_rad)) / (2**ZOOM)
-    tile_size_meters = TILE_SIZE_PX * meters_per_pixel
-    STEP_Y_DEGREES = tile_size_meters / 111320.0
-    STEP_X_DEGREES = tile_size_meters / (111320.0 * np.cos(avg_lat_rad))
-    
-    half_step_x = STEP_X_DEGREES / 2
-    half_step_y = STEP_Y_DEGREES / 2
-
-    print(f"   Tile size: ~{tile_size_meters:.2f} meters")
-    print(f"   Calculated Step Y (Lat): {STEP_Y_DEGREES:.6f} degrees")
-    print(f"   Calculated Step X (Lon): {STEP_X_DEGREES:.6f} degrees")
-    # --- END STEP CALCALCULATION ---
-
-    # --- Generate All Potential Points ---
-    print("🔍 Calculating all potential tile locations (using INTERSECTS)...")
-    potential_points_map = {}
-    x_vals = np.arange(minx, maxx, STEP_X_DEGREES)
-    y_vals = np.arange(miny, maxy, STEP_Y_DEGREES)
-    current_index = 0
-    total_grid_points = len(x_vals) * len(y_vals)
-    
-    print(f"   Grid dimensions: {len(x_vals)} (lon) x {len(y_vals)} (lat) = {total_grid_points} total grid points")
-
-    with tqdm(total=total_grid_points, desc="Generating Points", ncols=100) as pbar_points:
-        for lat in y_vals:
-            for lon in x_vals:
-                pbar_points.update(1)
-                
-                min_lon, max_lon = lon - half_step_x, lon + half_step_x
-                min_lat, max_lat = lat - half_step_y, lat + half_step_y
-                tile_box = Polygon([
-                    (min_lon, min_lat), (min_lon, max_lat),
-                    (max_lon, max_lat), (max_lon, min_lat)
-                ])
-                
-                # Check intersection with our Circle Polygon
-                if polygon.intersects(tile_box):
-                    potential_points_map[current_index] = (lat, lon)
-                    current_index += 1
-
-    total_potential_tiles = len(potential_points_map)
-    print(f"✅ Calculated {total_potential_tiles} potential tile locations inside the {RADIUS_KM}km radius.")
-    if total_potential_tiles == 0: sys.exit()
-
-    # --- Pre-Check Existing Files ---
-    all_existing_indices = get_existing_indices(LOCAL_SAVE_FOLDER)
-    print(f"✅ Total unique existing tiles found in '{LOCAL_SAVE_FOLDER}': {len(all_existing_indices)}")
-
-    # --- Create List of Tasks ---
-    tasks_to_run = []
-    print("📝 Creating list of tiles to download...")
-    for index, (lat, lon) in potential_points_map.items():
-        if index not in all_existing_indices:
-            tasks_to_run.append((index, 0, lat, lon, LOCAL_SAVE_FOLDER))
-
-    total_to_download_count = len(tasks_to_run)
-    if total_to_download_count == 0:
-        print("\n✅ No new tiles need to be downloaded.")
-        sys.exit()
-
-    tasks_to_run = [(t[0], total_to_download_count, t[2], t[3], t[4]) for t in tasks_to_run]
-    print(f"🎯 Need to download {total_to_download_count} new tiles.")
-    print(f"💾 Downloads will be saved to local folder: '{LOCAL_SAVE_FOLDER}'")
-
-    # --- Run Async Downloads ---
-    print(f"\n🚀 Starting async download using up to {MAX_CONCURRENT_DOWNLOADS} concurrent connections...")
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
-    download_count = 0; fail_count = 0; skip_local_count = 0
-
-    async with aiohttp.ClientSession() as session:
-        coroutines = [fetch_tile(session, semaphore, task) for task in tasks_to_run]
-        for future in tqdm_asyncio(asyncio.as_completed(coroutines), total=total_to_download_count, desc="Downloading Tiles", ncols=100):
-            try:
-                result = await future
-                if isinstance(result, tuple) and len(result) == 2:
-                    status, message = result
-                    if status == "downloaded": download_count += 1
-                    elif status == "failed": fail_count += 1; print(message)
-                    elif status == "skipped_local": skip_local_count += 1
-                else: fail_count += 1; print(f"❗️ Unexpected result: {result}")
-            except Exception as exc:
-                fail_count += 1; print(f"❗️ Task processing error: {exc}")
-
-    # --- Final Summary ---
-    print("\n🎉 Async processing complete!")
-    print(f"--- Summary ---")
-    print(f"Total potential tiles for '{CITY_NAME}': {total_potential_tiles}")
-    print(f"Tiles needed: {total_to_download_count}")
-    print(f"Tiles successfully downloaded: {download_count}")
-    print(f"Tiles skipped (local): {skip_local_count}")
-    print(f"Tiles failed: {fail_count}")
-    print(f"-------------")
-    if fail_count > 0: print(f"⚠️ Note: {fail_count} tiles failed.")
-    print(f"✅ All downloaded tiles are in: '{LOCAL_SAVE_FOLDER}'")
-
-
-if __name__ == "__main__":
-    if sys.platform == 'win32':
-        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-
-    asyncio.run(main())
+import numpy as np
+import requests 
+import os
+import time
+import random
+import hashlib
+import asyncio 
+import aiohttp 
+import glob
+import re
+import sys
+from tqdm import tqdm 
+from tqdm.asyncio import tqdm_asyncio
+from tile_grid import (compute_tile_steps, grid_axes, generate_tile_grid, iter_tile_grid, xyz_cell_range, iter_xyz_grid,
+                       tile_filename, ADDRESSING_INDEX, ADDRESSING_XYZ)
+import telemetry
+from rate_control import AdaptiveRateController
+from tile_store import ShardedTileStore
+from tile_manifest import TileManifest, MANIFEST_FILENAME, STATUS_DOWNLOADED, STATUS_FAILED
+from tile_writer import TileWriter
+
+# --- CONFIGURATION ---
+API_KEY = ""  # <--- YOUR API KEY
+# Changed to specific campus name for accurate geocoding
+CITY_NAME = "Indian Institute of Technology Delhi" 
+ZOOM = 19
+SIZE_STR = "640x640" 
+TILE_SIZE_PX = 640 
+MAPTYPE = "satellite"
+# Point at mock_static_maps.py to benchmark offline without spending quota
+STATIC_MAPS_URL = "https://maps.googleapis.com/maps/api/staticmap"
+
+# --- RADIUS CONFIG ---
+# Reduced to 1.5 km. IIT Delhi is approx 1.3 sq km, so 1.5 km radius 
+# covers the campus + immediate surroundings perfectly.
+RADIUS_KM = 1.5 
+# True: never geocode over the network; the search area must already be in the
+# boundary cache (see boundary_cache.py, which also imports local shapefiles)
+OFFLINE = False
+
+# --- ADDRESSING CONFIG ---
+# "index": legacy sequential tile_{i}.png ids (depend on boundary + RADIUS_KM)
+# "xyz": stable Web-Mercator z/x/y cells (tile_{z}_{x}_{y}.png), shareable across
+#        cities and campaigns; only cells not yet in the manifest are fetched
+ADDRESSING = ADDRESSING_INDEX
+
+# --- SURVEY CONFIG ---
+# "full": every grid cell at ZOOM
+# "adaptive": fetch the area at COARSE_ZOOM first, then only the ZOOM tiles under
+#             built-up coarse tiles (see adaptive_survey.py)
+SURVEY_MODE = "full"
+COARSE_ZOOM = 17
+
+# --- PERFORMANCE CONFIG ---
+MAX_CONCURRENT_DOWNLOADS = 30
+REQUEST_TIMEOUT = 25
+MAX_BACKOFF_DELAY = 60 
+MAX_RETRIES = 3 
+# "streaming": fixed pool of MAX_CONCURRENT_DOWNLOADS workers fed lazily from the
+#              grid through a bounded queue (flat memory for multi-million-tile runs)
+# "batch": one coroutine per tile scheduled through asyncio.as_completed()
+DOWNLOAD_MODE = "streaming"
+TASK_QUEUE_SIZE = MAX_CONCURRENT_DOWNLOADS * 4
+# Shared token bucket + AIMD concurrency driven by 429/503 feedback; the
+# concurrency it settles at never exceeds MAX_CONCURRENT_DOWNLOADS
+ADAPTIVE_RATE_CONTROL = True
+INITIAL_QPS = 10
+MAX_QPS = 100
+INITIAL_CONCURRENCY = 8
+# Shared connection pool: keep-alive connections are reused across tiles (and
+# regions in a campaign, see campaign.py) instead of aiohttp's defaults
+DNS_CACHE_TTL_S = 600
+KEEPALIVE_TIMEOUT_S = 60
+
+# --- SAVE LOCATIONS ---
+# Updated folder name for clarity
+LOCAL_SAVE_FOLDER = "./IIT_Delhi_Tiles" 
+# "files": one tile_*.png per tile
+# "shards": tiles appended to large shard_*.bin files + offset index (see tile_store.py),
+#           readable in place through mmap by the plotter and inference stage
+TILE_STORAGE = "files"
+# True: tiles and manifest rows are persisted in batches by a writer thread
+# (tile_writer.py), so slow storage does not stall the downloads; False writes
+# each tile inline on the event loop
+WRITE_STAGE = True
+# "none" / "batch" / "tile": when tiles are fsynced by the writer stage
+FSYNC_POLICY = "none"
+
+# --- TELEMETRY (see telemetry.py) ---
+# JSON-lines metrics log (None = off) and local Prometheus /metrics port (None = off)
+TELEMETRY_LOG = None
+TELEMETRY_PORT = None
+# ----------------------------------------
+
+def record_tile_result(manifest, i, lat, lon, status, content=None):
+    """Writes the outcome of one tile to the manifest (no-op without a manifest)."""
+    if manifest is None:
+        return
+    if content is None:
+        manifest.record_tile(i, lat, lon, ZOOM, status)
+    else:
+        manifest.record_tile(i, lat, lon, ZOOM, status, len(content), hashlib.sha1(content).hexdigest())
+
+
+async def record_failure(manifest, tile_writer, i, lat, lon):
+    if tile_writer is not None:
+        await tile_writer.put(i, lat, lon)
+    else:
+        record_tile_result(manifest, i, lat, lon, STATUS_FAILED)
+
+
+def write_tile(local_folder, i, content, tile_store=None):
+    """Inline (event loop) write of one tile, used when there is no writer stage."""
+    write_start = time.perf_counter()
+    if tile_store is not None:
+        tile_store.put(i, content)
+    else:
+        os.makedirs(local_folder, exist_ok=True)
+        with open(os.path.join(local_folder, tile_filename(i)), "wb") as f:
+            f.write(content)
+    storage = "files" if tile_store is None else "shards"
+    telemetry.observe("fetch_write_seconds", time.perf_counter() - write_start, storage=storage)
+    telemetry.count("fetch_bytes_written_total", len(content), storage=storage)
+
+
+async def fetch_tile(session, semaphore, args, manifest=None, rate_controller=None, tile_store=None,
+                     tile_sink=None, persist=True, tile_writer=None):
+    """
+    Asynchronously fetches a single tile using aiohttp with semaphore control.
+    Outcomes are recorded in the manifest when one is given, every attempt
+    goes through the shared rate controller when one is given, and tiles are
+    appended to the sharded tile store instead of tile_*.png files when one is given.
+    With a tile_writer (tile_writer.py) the tile and its manifest row are only
+    queued, and written off the event loop.
+    When a tile_sink is given, each downloaded payload is awaited into
+    tile_sink(i, lat, lon, content) (see detection_pipeline.py); persist=False
+    then keeps the imagery in memory only.
+    """
+    async with semaphore: 
+        i, total_to_download_count, lat, lon, local_folder = args
+        # No per-tile existence check: tasks come from iter_pending_tiles, which
+        # already leaves out every tile the manifest pre-scan found
+
+        center = f"{lat},{lon}"
+        url = (
+            f"{STATIC_MAPS_URL}?"
+            f"center={center}&zoom={ZOOM}&size={SIZE_STR}&maptype={MAPTYPE}&key={API_KEY}"
+        )
+
+        for attempt in range(MAX_RETRIES):
+            error_message_for_retry = ""
+            should_retry = False
+            response_status = None
+            if rate_controller is not None:
+                await rate_controller.acquire()
+            request_start = time.perf_counter()
+            try:
+                async with session.get(url, timeout=REQUEST_TIMEOUT) as response:
+                    response_status = response.status
+                    if response.status == 200:
+                        content = await response.read()
+                        telemetry.observe("fetch_request_seconds", time.perf_counter() - request_start, status=200)
+                        break
+
+                    elif response.status in [403, 429, 500, 503]:
+                        error_message_for_retry = f"Status {response.status}"
+                        should_retry = True
+                    else:
+                        print(f"\r❌ Tile {i+1}: Failed with permanent status {response.status}. Giving up.")
+                        await record_failure(manifest, tile_writer, i, lat, lon)
+                        return "failed", f"Failed tile {i+1} status {response.status}" 
+            except asyncio.TimeoutError:
+                error_message_for_retry = "Timed out"
+                should_retry = True
+            except aiohttp.ClientError as e:
+                error_message_for_retry = f"Network error ({e})"
+                should_retry = True
+            except Exception as e:
+                 print(f"\r❌ Tile {i+1}: Unexpected error: {e}. Giving up.")
+                 await record_failure(manifest, tile_writer, i, lat, lon)
+                 return "failed", f"Failed tile {i+1} unexpected error: {e}" 
+            finally:
+                if rate_controller is not None:
+                    await rate_controller.release(response_status)
+                if response_status != 200:
+                    telemetry.observe("fetch_request_seconds", time.perf_counter() - request_start,
+                                      status=response_status or "error")
+
+            if should_retry:
+                telemetry.count("fetch_retries_total", reason=error_message_for_retry.split(" (")[0])
+                wait_time = min(((2 ** attempt)) + random.random(), MAX_BACKOFF_DELAY)
+                # Simple print to show retry is happening
+                # print(f"\r⏳ Retry tile {i+1} in {wait_time:.1f}s...", end="")
+                await asyncio.sleep(wait_time)
+        else:
+            await record_failure(manifest, tile_writer, i, lat, lon)
+            return "failed", f"Failed tile {i+1} after {MAX_RETRIES} attempts."
+
+        # Persisted outside the rate-controller slot; a full writer queue holds this worker (backpressure)
+        if tile_writer is not None and persist:
+            await tile_writer.put(i, lat, lon, content)
+        else:
+            if persist:
+                write_tile(local_folder, i, content, tile_store)
+            record_tile_result(manifest, i, lat, lon, STATUS_DOWNLOADED, content)
+        # Handed over outside the rate-controller slot; a full sink holds this worker (backpressure)
+        if tile_sink is not None:
+            await tile_sink(i, lat, lon, content)
+        return "downloaded", f"Downloaded tile {i+1}" 
+
+
+def make_session(trace_configs=None):
+    """ClientSession whose pool matches MAX_CONCURRENT_DOWNLOADS (all requests go to one host)."""
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_DOWNLOADS, limit_per_host=MAX_CONCURRENT_DOWNLOADS,
+                                     ttl_dns_cache=DNS_CACHE_TTL_S, keepalive_timeout=KEEPALIVE_TIMEOUT_S)
+    return aiohttp.ClientSession(connector=connector, trace_configs=trace_configs)
+
+
+def tally_result(counts, result):
+    """Adds one fetch_tile() result to the summary counts."""
+    if isinstance(result, tuple) and len(result) == 2:
+        status, message = result
+        telemetry.count("fetch_tiles_total", outcome=status)
+        if status == "downloaded": counts["downloaded"] += 1
+        elif status == "failed": counts["failed"] += 1; print(message)
+    else: counts["failed"] += 1; print(f"❗️ Unexpected result: {result}")
+
+
+def iter_pending_tiles(polygon, step_x, step_y, existing_sorted, desc=None):
+    """
+    Lazily yields (n_cells, indices, lats, lons) per grid chunk, where n_cells is
+    the number of intersecting cells and the arrays hold only tiles not yet in
+    existing_sorted (a sorted int64 array of downloaded indices).
+    """
+    if ADDRESSING == ADDRESSING_XYZ:
+        chunks = iter_xyz_grid(polygon, ZOOM, TILE_SIZE_PX, desc=desc)
+    else:
+        chunks = iter_tile_grid(polygon, step_x, step_y, desc=desc)
+    for indices, lats, lons in chunks:
+        if len(existing_sorted):
+            pos = np.minimum(np.searchsorted(existing_sorted, indices), len(existing_sorted) - 1)
+            pending = existing_sorted[pos] != indices
+            yield len(indices), indices[pending], lats[pending], lons[pending]
+        else:
+            yield len(indices), indices, lats, lons
+
+
+async def tile_producer(queue, pending_chunks, total_to_download_count, n_workers):
+    """Feeds download tasks from the lazy grid into the bounded queue, then one stop marker per worker."""
+    for _, indices, lats, lons in pending_chunks:
+        for index, lat, lon in zip(indices.tolist(), lats.tolist(), lons.tolist()):
+            await queue.put((index, total_to_download_count, lat, lon, LOCAL_SAVE_FOLDER))
+    for _ in range(n_workers):
+        await queue.put(None)
+
+
+async def download_worker(session, semaphore, queue, manifest, counts, pbar, rate_controller=None, tile_store=None,
+                          tile_sink=None, persist=True, tile_writer=None):
+    """Pulls tasks from the queue until a stop marker arrives."""
+    while True:
+        task = await queue.get()
+        if task is None:
+            return
+        try:
+            tally_result(counts, await fetch_tile(session, semaphore, task, manifest, rate_controller, tile_store,
+                                                    tile_sink, persist, tile_writer))
+        except Exception as exc:
+            if tile_writer is not None and tile_writer.failed:
+                raise  # Tiles can no longer be saved: stop (the gather cancels the other workers)
+            counts["failed"] += 1; print(f"❗️ Task processing error: {exc}")
+        pbar.update(1)
+
+
+async def run_streaming_downloads(session, semaphore, manifest, pending_chunks, total_to_download_count, counts,
+                                  rate_controller=None, tile_store=None, tile_sink=None, persist=True):
+    """
+    Producer/consumer download: a fixed pool of MAX_CONCURRENT_DOWNLOADS workers
+    reads from a bounded queue, so memory stays flat regardless of area size.
+    With WRITE_STAGE, tiles and manifest rows are persisted by a TileWriter.
+    """
+    queue = asyncio.Queue(maxsize=TASK_QUEUE_SIZE)
+    tile_writer = None
+    if WRITE_STAGE and persist:
+        tile_writer = TileWriter(LOCAL_SAVE_FOLDER, ZOOM, manifest, tile_store, FSYNC_POLICY)
+        tile_writer.start()
+    with tqdm(total=total_to_download_count, desc="Downloading Tiles", ncols=100) as pbar:
+        workers = [
+            asyncio.create_task(download_worker(session, semaphore, queue, manifest, counts, pbar, rate_controller, tile_store,
+                                            tile_sink, persist, tile_writer))
+            for _ in range(MAX_CONCURRENT_DOWNLOADS)
+        ]
+        producer = asyncio.create_task(tile_producer(queue, pending_chunks, total_to_download_count, len(workers)))
+        loop_monitor = asyncio.create_task(telemetry.monitor_event_loop())
+        try:
+            await asyncio.gather(producer, *workers)
+        except BaseException:
+            producer.cancel()
+            for worker in workers: worker.cancel()
+            raise
+        finally:
+            loop_monitor.cancel()
+            # Tiles already downloaded are still written (and committed) on the way out
+            if tile_writer is not None:
+                await tile_writer.close()
+
+
+def get_existing_indices(folder_path):
+    """Scans a folder and returns a set of indices from tile_*.png files."""
+    indices = set()
+    if not os.path.isdir(folder_path):
+        print(f"ℹ️ Directory not found or skipped checking: '{folder_path}'")
+        return indices
+    print(f"🔍 Scanning '{folder_path}' for existing tiles...")
+    search_pattern = os.path.join(folder_path, "tile_*.png")
+    existing_files = glob.glob(search_pattern)
+    tile_pattern = re.compile(r"tile_(\d+)\.png$")
+    count = 0
+    for f_path in tqdm(existing_files, desc=f"Scanning {os.path.basename(folder_path)}", leave=False, ncols=100):
+        match = tile_pattern.search(os.path.basename(f_path))
+        if match:
+            try:
+                indices.add(int(match.group(1)))
+                count += 1
+            except ValueError: pass
+    print(f"✅ Found {count} valid tiles in '{os.path.basename(folder_path)}'.")
+    return indices
+
+
+def build_search_area():
+    """
+    Returns the RADIUS_KM circle (WGS84 polygon) around CITY_NAME, or its
+    boundary when RADIUS_KM is None, from the boundary cache when possible.
+    """
+    from boundary_cache import resolve_boundary  # geopandas is only needed here
+    area = f"{RADIUS_KM} km search area around" if RADIUS_KM else "boundary of"
+    print(f"🌍 Resolving {area}: {CITY_NAME}")
+    try:
+        gdf_boundary = resolve_boundary(CITY_NAME, RADIUS_KM, offline=OFFLINE)
+    except LookupError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    polygon = gdf_boundary.geometry.iloc[0]
+    center = polygon.centroid
+    print(f"✅ Search area centred at {center.y:.5f}, {center.x:.5f} "
+          f"covering ~{int(gdf_boundary.to_crs(epsg=3857).area.iloc[0] / 1e6)} sq km.")
+    return polygon
+
+
+async def main():
+    os.makedirs(LOCAL_SAVE_FOLDER, exist_ok=True)
+    telemetry.start(TELEMETRY_LOG, TELEMETRY_PORT)
+
+    polygon = build_search_area()
+    minx, miny, maxx, maxy = polygon.bounds
+
+    # --- Calculate Disjoint Step Size ---
+    print("Calculating tile step size based on latitude...")
+    STEP_X_DEGREES, STEP_Y_DEGREES, tile_size_meters, meters_per_pixel = compute_tile_steps(miny, maxy, ZOOM, TILE_SIZE_PX)
+
+    print(f"   Tile size: ~{tile_size_meters:.2f} meters")
+    print(f"   Calculated Step Y (Lat): {STEP_Y_DEGREES:.6f} degrees")
+    print(f"   Calculated Step X (Lon): {STEP_X_DEGREES:.6f} degrees")
+    # --- END STEP CALCALCULATION ---
+
+    # --- Generate All Potential Points ---
+    print("🔍 Calculating all potential tile locations (using INTERSECTS)...")
+    if ADDRESSING == ADDRESSING_XYZ:
+        x_vals, y_vals = xyz_cell_range(polygon, ZOOM, TILE_SIZE_PX)
+    else:
+        x_vals, y_vals = grid_axes(polygon, STEP_X_DEGREES, STEP_Y_DEGREES)
+    total_grid_points = len(x_vals) * len(y_vals)
+
+    print(f"   Grid dimensions: {len(x_vals)} (lon) x {len(y_vals)} (lat) = {total_grid_points} total grid points")
+    # --- Pre-Check Existing Files ---
+    manifest = TileManifest(LOCAL_SAVE_FOLDER)
+    if len(manifest) == 0 and ADDRESSING == ADDRESSING_INDEX:
+        # Folders fetched before the manifest existed are scanned once and imported
+        legacy_indices = get_existing_indices(LOCAL_SAVE_FOLDER)
+        if legacy_indices:
+            tile_indices, tile_lats, tile_lons = generate_tile_grid(polygon, STEP_X_DEGREES, STEP_Y_DEGREES)
+            imported = manifest.import_legacy_folder(LOCAL_SAVE_FOLDER, legacy_indices, tile_indices, tile_lats, tile_lons, ZOOM)
+            print(f"🗂️ Imported {imported} existing tiles into manifest '{manifest.path}'")
+    all_existing_indices = manifest.indices(STATUS_DOWNLOADED)
+    print(f"✅ Total unique existing tiles found in '{LOCAL_SAVE_FOLDER}': {len(all_existing_indices)}")
+    existing_sorted = np.sort(np.fromiter(all_existing_indices, dtype=np.int64, count=len(all_existing_indices)))
+
+    # --- Coarse Pass (adaptive survey) ---
+    screen = None
+    coarse_requests = 0
+    if SURVEY_MODE == "adaptive":
+        from adaptive_survey import build_coarse_screen  # OpenCV is only needed here
+        screen, coarse_requests = await build_coarse_screen(polygon, LOCAL_SAVE_FOLDER, ZOOM, COARSE_ZOOM)
+
+    # --- Count Tiles to Download ---
+    # Lazy bulk INTERSECTS pass against our Circle Polygon; no per-tile lists are kept
+    print("📝 Counting tiles to download...")
+    total_potential_tiles = 0
+    total_planned_count = 0
+    total_to_download_count = 0
+    for n_cells, indices, lats, lons in iter_pending_tiles(polygon, STEP_X_DEGREES, STEP_Y_DEGREES, existing_sorted, desc="Generating Points"):
+        total_potential_tiles += n_cells
+        total_planned_count += len(indices)
+        total_to_download_count += len(indices) if screen is None else int(screen.overlay(indices, lats, lons).sum())
+
+    print(f"✅ Calculated {total_potential_tiles} potential tile locations inside the search area.")
+    if screen is not None:
+        skipped = total_planned_count - total_to_download_count
+        print(f"🪜 Adaptive survey: {total_to_download_count} of {total_planned_count} planned zoom-{ZOOM} tiles to fetch "
+              f"({skipped / max(1, total_planned_count):.0%} skipped) after {coarse_requests} zoom-{COARSE_ZOOM} requests")
+    if total_potential_tiles == 0:
+        manifest.close()
+        sys.exit()
+    if total_to_download_count == 0:
+        manifest.close()
+        print("\n✅ No new tiles need to be downloaded.")
+        sys.exit()
+
+    print(f"🎯 Need to download {total_to_download_count} new tiles.")
+    print(f"💾 Downloads will be saved to local folder: '{LOCAL_SAVE_FOLDER}' ({TILE_STORAGE})")
+
+    # --- Run Async Downloads ---
+    print(f"\n🚀 Starting {DOWNLOAD_MODE} async download using up to {MAX_CONCURRENT_DOWNLOADS} concurrent connections...")
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    rate_controller = None
+    if ADAPTIVE_RATE_CONTROL:
+        rate_controller = AdaptiveRateController(INITIAL_QPS, MAX_QPS, INITIAL_CONCURRENCY, MAX_CONCURRENT_DOWNLOADS)
+        print(f"   Adaptive rate control: starting at {INITIAL_QPS} QPS / {INITIAL_CONCURRENCY} concurrent (max {MAX_QPS} QPS)")
+    counts = {"downloaded": 0, "failed": 0}
+    tile_store = ShardedTileStore(LOCAL_SAVE_FOLDER) if TILE_STORAGE == "shards" else None
+    pending_chunks = iter_pending_tiles(polygon, STEP_X_DEGREES, STEP_Y_DEGREES, existing_sorted)
+    if screen is not None:
+        pending_chunks = screen.screen_chunks(pending_chunks)
+
+    async with make_session() as session:
+        if DOWNLOAD_MODE == "streaming":
+            await run_streaming_downloads(session, semaphore, manifest, pending_chunks, total_to_download_count, counts,
+                                          rate_controller, tile_store)
+        else:
+            tasks_to_run = [
+                (index, total_to_download_count, lat, lon, LOCAL_SAVE_FOLDER)
+                for _, indices, lats, lons in pending_chunks
+                for index, lat, lon in zip(indices.tolist(), lats.tolist(), lons.tolist())
+            ]
+            tile_writer = TileWriter(LOCAL_SAVE_FOLDER, ZOOM, manifest, tile_store, FSYNC_POLICY) if WRITE_STAGE else None
+            if tile_writer is not None: tile_writer.start()
+            fetches = [asyncio.ensure_future(fetch_tile(session, semaphore, task, manifest, rate_controller, tile_store,
+                                                        tile_writer=tile_writer))
+                       for task in tasks_to_run]
+            try:
+                for future in tqdm_asyncio(asyncio.as_completed(fetches), total=total_to_download_count, desc="Downloading Tiles", ncols=100):
+                    try:
+                        tally_result(counts, await future)
+                    except Exception as exc:
+                        if tile_writer is not None and tile_writer.failed:
+                            raise  # Tiles can no longer be saved: stop downloading
+                        counts["failed"] += 1; print(f"❗️ Task processing error: {exc}")
+            finally:
+                for fetch in fetches: fetch.cancel()
+                if tile_writer is not None: await tile_writer.close()
+    download_count, fail_count = counts["downloaded"], counts["failed"]
+
+    if tile_store is not None: tile_store.close()
+    status_counts = manifest.status_counts()
+    manifest.close()
+
+    telemetry.event("fetch_summary", city=CITY_NAME, tiles=total_potential_tiles, needed=total_to_download_count,
+                    planned=total_planned_count, coarse_requests=coarse_requests,
+                    downloaded=download_count, failed=fail_count,
+                    rate=rate_controller.summary() if rate_controller is not None else None)
+
+    # --- Final Summary ---
+    print("\n🎉 Async processing complete!")
+    print(f"--- Summary ---")
+    print(f"Total potential tiles for '{CITY_NAME}': {total_potential_tiles}")
+    print(f"Tiles needed: {total_to_download_count}")
+    if screen is not None:
+        print(f"Adaptive survey: {total_planned_count} zoom-{ZOOM} tiles planned, {total_to_download_count} under built-up "
+              f"coarse tiles, {total_planned_count - total_to_download_count} skipped; "
+              f"{coarse_requests} coarse requests made this run (retries included)")
+    print(f"Tiles successfully downloaded: {download_count}")
+    print(f"Tiles failed: {fail_count}")
+    if rate_controller is not None:
+        rate = rate_controller.summary()
+        print(f"Rate control: settled at {rate['qps']:.1f} QPS / {rate['concurrency']} concurrent "
+              f"(achieved {rate['achieved_qps']:.1f} QPS, peak {rate['peak_qps']:.1f} QPS / {rate['peak_concurrency']} concurrent, "
+              f"{rate['congestion_events']} throttled responses, {rate['decreases']} backoffs)")
+    print(f"Manifest '{MANIFEST_FILENAME}': {status_counts.get(STATUS_DOWNLOADED, 0)} downloaded, {status_counts.get(STATUS_FAILED, 0)} failed")
+    print(f"-------------")
+    if fail_count > 0: print(f"⚠️ Note: {fail_count} tiles failed.")
+    print(f"✅ All downloaded tiles are in: '{LOCAL_SAVE_FOLDER}'")
+
+
+if __name__ == "__main__":
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    try:
+        asyncio.run(main())
+    finally:
+        telemetry.stop()
@@ -1,18 +1,25 @@
 import geopandas as gpd
-from shapely.geometry import Point, Polygon # <-- Added Polygon
 import numpy as np
-import osmnx as ox
 import matplotlib.pyplot as plt
 import contextily as ctx # For adding the map background
 import sys
 import os # Added for path joining
 import glob # For listing files
 import re # For extracting numbers from filenames
+from matplotlib.colors import ListedColormap
 from tqdm import tqdm # For progress bars
+from tile_grid import compute_tile_steps, generate_tile_grid, latlon_to_pixel, MERCATOR_BASE_TILE_PX
+from tile_store import ShardedTileStore, store_exists
+from tile_manifest import TileManifest, manifest_exists, STATUS_DOWNLOADED, STATUS_FAILED
+from boundary_cache import resolve_boundary
 
 # --- Configuration ---
 # --- NEW: Use the Municipal Corporation boundary ---
 CITY_NAME = "Jaipur Municipal Corporation, India"
+# None: CITY_NAME's boundary; km: the same circle city_tile_fetcher.py searches
+RADIUS_KM = None
+# True: never geocode over the network (boundary must be in the cache, see boundary_cache.py)
+OFFLINE = False
 # ---------------------
 # Configs must match the download script
 ZOOM = 19
@@ -36,8 +43,23 @@ POINT_ALPHA = 0.5 # Semi-transparent
 FIGURE_SIZE = (12, 12)
 DPI = 300
 BASEMAP_SOURCE = ctx.providers.OpenStreetMap.Mapnik
+# "raster" bins tiles into one image (fast at any tile count); "points" scatter-plots every tile
+RENDER_MODE = "raster"
+# Raster cells are one tile wide, coarsened by an integer factor past this many cells per side
+MAX_RASTER_CELLS = 4096
+# Cell colours by status: failed, downloaded (empty cells are transparent)
+STATUS_COLORS = ['black', POINT_COLOR]
+RASTER_ALPHA = 0.6
+# Basemap tiles are cached here (by tile URL); re-renders only fetch tiles not seen before
+BASEMAP_CACHE_DIR = "./basemap_cache"
+# The basemap covers the boundary plus this margin (and the plot, if larger), so its
+# extent and zoom stay the same as tiles are added and offline re-renders hit the cache
+BASEMAP_MARGIN_M = 1000
 # ---------------------
 
+# Web-Mercator (EPSG:3857) half-extent in meters
+MERCATOR_HALF_EXTENT_M = 20037508.342789244
+
 # --- Helper Function to Scan Folders ---
 def get_existing_indices(folder_path):
     """Scans a folder and returns a set of indices from tile_*.png files."""
@@ -62,136 +84,188 @@ def get_existing_indices(folder_path):
                 pass # Ignore files with non-integer numbers
     print(f"✅ Found {count} tiles in '{os.path.basename(folder_path)}'.")
     return indices
+
+
+def locate_tiles_by_scan(polygon):
+    """
+    Fallback for folders without a manifest: regenerates the grid and maps the
+    indices of tile_*.png files in the folder back to (lats, lons).
+    """
+    minx, miny, maxx, maxy = polygon.bounds
+
+    # --- Calculate Disjoint Step Size (Same as download script) ---
+    print("Calculating tile step size based on latitude...")
+    STEP_X_DEGREES, STEP_Y_DEGREES, tile_size_meters, meters_per_pixel = compute_tile_steps(miny, maxy, ZOOM, TILE_SIZE_PX)
+    print(f"   Calculated Step Y (Lat): {STEP_Y_DEGREES:.6f} degrees")
+    print(f"   Calculated Step X (Lon): {STEP_X_DEGREES:.6f} degrees")
+    # --- END STEP CALCULATION ---
+
+    print("🔍 Calculating all potential tile locations (using INTERSECTS)...")
+    # Indices are contiguous (0..N-1), so tile_lats/tile_lons[index] is the tile CENTER
+    tile_indices, tile_lats, tile_lons = generate_tile_grid(polygon, STEP_X_DEGREES, STEP_Y_DEGREES, desc="Generating Potential Points")
+
+    total_potential_tiles = len(tile_indices)
+    if total_potential_tiles == 0:
+        print(f"❌ No potential points found inside the boundary for '{CITY_NAME}'.")
+        sys.exit()
+    print(f"✅ Calculated {total_potential_tiles} total potential tile locations.")
+    # --- END POINT GENERATION ---
+
+    # --- Scan ONLY the new local download folder ---
+    if store_exists(DOWNLOADED_TILES_FOLDER):
+        with ShardedTileStore(DOWNLOADED_TILES_FOLDER) as tile_store:
+            drive_indices = tile_store.ids()
+        print(f"✅ Found {len(drive_indices)} tiles in the shard store index.")
+    else:
+        drive_indices = get_existing_indices(DOWNLOADED_TILES_FOLDER)
+
+    if drive_indices is None: sys.exit() # Folder not found
+    if not drive_indices:
+        print(f"❌ No downloaded tiles found in '{DOWNLOADED_TILES_FOLDER}'. Cannot create plot.")
+        sys.exit()
+
+    num_total_downloaded = len(drive_indices)
+    print(f"\n✅ Plotting based on {num_total_downloaded} tiles found in the folder.")
+
+    # --- Filter potential points based ONLY on folder contents ---
+    print(" Filtering points to match downloaded files...")
+    downloaded_indices = np.fromiter(drive_indices, dtype=np.int64, count=len(drive_indices))
+    in_grid = (downloaded_indices >= 0) & (downloaded_indices < total_potential_tiles)
+    if not in_grid.all():
+        print(f"⚠️ Warning: Found {int((~in_grid).sum())} files whose index was not in the calculated grid. Check STEP/CITY_NAME.")
+    downloaded_indices = downloaded_indices[in_grid]
+    return tile_lats[downloaded_indices], tile_lons[downloaded_indices]
+
+
+def rasterize_tiles(layers, zoom=ZOOM, tile_size_px=TILE_SIZE_PX, max_cells=MAX_RASTER_CELLS):
+    """
+    Bins tile centres into a Web-Mercator raster of one cell per tile. layers is
+    a list of (lats, lons) arrays; cells take the 1-based number of the last
+    layer that hit them (0 = no tile). Returns (raster, extent) with extent as
+    (left, right, bottom, top) in EPSG:3857 meters for imshow.
+    """
+    cells = []
+    for code, (lats, lons) in enumerate(layers, start=1):
+        px, py = latlon_to_pixel(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64), zoom)
+        cells.append((code, np.floor(px / tile_size_px).astype(np.int64), np.floor(py / tile_size_px).astype(np.int64)))
+    all_x = np.concatenate([cx for _, cx, _ in cells])
+    all_y = np.concatenate([cy for _, _, cy in cells])
+    x0, y0 = all_x.min(), all_y.min()
+    factor = max(1, -(-max(all_x.max() - x0 + 1, all_y.max() - y0 + 1) // max_cells))
+    width = (all_x.max() - x0) // factor + 1
+    height = (all_y.max() - y0) // factor + 1
+    raster = np.zeros((height, width), dtype=np.uint8)
+    for code, cx, cy in cells:
+        raster[(cy - y0) // factor, (cx - x0) // factor] = code
+
+    meters_per_px = 2 * MERCATOR_HALF_EXTENT_M / (MERCATOR_BASE_TILE_PX * 2.0**zoom)
+    cell_m = tile_size_px * factor * meters_per_px
+    left = x0 * tile_size_px * meters_per_px - MERCATOR_HALF_EXTENT_M
+    top = MERCATOR_HALF_EXTENT_M - y0 * tile_size_px * meters_per_px
+    return raster, (left, left + width * cell_m, top - height * cell_m, top)
+
+
+def load_basemap(bounds, source=BASEMAP_SOURCE, cache_dir=BASEMAP_CACHE_DIR):
+    """
+    Basemap (image, extent) covering EPSG:3857 bounds (minx, miny, maxx, maxy).
+    The provider's tiles are cached in cache_dir (contextily's tile cache), so
+    an extent that moves (new tiles, failed-tile layer) only downloads the
+    basemap tiles not fetched before, and offline re-renders are assembled
+    from the cache. Returns None when a needed tile is neither cached nor
+    downloadable.
+    """
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        ctx.set_cache_dir(cache_dir)
+    try:
+        return ctx.bounds2img(*bounds, zoom='auto', source=source)
+    except Exception as e:
+        print(f"⚠️ Warning: Could not load basemap ({e}).")
+        return None
 # ----------------------------------------
 
-# --- Regenerate the full list of potential points (MATCHING DOWNLOAD SCRIPT) ---
-print(f"🌍 Downloading boundary for: {CITY_NAME}")
-try:
-    gdf_city = ox.geocode_to_gdf(CITY_NAME)
-except Exception as e:
-    print(f"❌ Error downloading boundary: {e}")
-    sys.exit()
-
-if gdf_city.crs is None or 'epsg:4326' not in str(gdf_city.crs).lower():
-    gdf_city = gdf_city.to_crs(epsg=4326)
-
-polygon = gdf_city.union_all() if not gdf_city.empty else None
-if polygon is None:
-    print("❌ Could not create city polygon."); sys.exit()
-minx, miny, maxx, maxy = polygon.bounds
-
-# --- Calculate Disjoint Step Size (Same as download script) ---
-print("Calculating tile step size based on latitude...")
-avg_lat = (miny + maxy) / 2
-avg_lat_rad = np.radians(avg_lat)
-meters_per_pixel = (156543.03 * np.cos(avg_lat_rad)) / (2**ZOOM)
-tile_size_meters = TILE_SIZE_PX * meters_per_pixel
-STEP_Y_DEGREES = tile_size_meters / 111320.0
-STEP_X_DEGREES = tile_size_meters / (111320.0 * np.cos(avg_lat_rad))
-half_step_x = STEP_X_DEGREES / 2
-half_step_y = STEP_Y_DEGREES / 2
-print(f"   Calculated Step Y (Lat): {STEP_Y_DEGREES:.6f} degrees")
-print(f"   Calculated Step X (Lon): {STEP_X_DEGREES:.6f} degrees")
-# --- END STEP CALCULATION ---
-
-print("🔍 Calculating all potential tile locations (using INTERSECTS)...")
-potential_points_map = {}
-x_vals = np.arange(minx, maxx, STEP_X_DEGREES)
-y_vals = np.arange(miny, maxy, STEP_Y_DEGREES)
-current_index = 0
-total_grid_points = len(x_vals) * len(y_vals)
-
-with tqdm(total=total_grid_points, desc="Generating Potential Points") as pbar_points:
-    for lat in y_vals:
-        for lon in x_vals:
-            pbar_points.update(1)
-            # --- Create the bounding box for this tile ---
-            min_lon, max_lon = lon - half_step_x, lon + half_step_x
-            min_lat, max_lat = lat - half_step_y, lat + half_step_y
-            tile_box = Polygon([
-                (min_lon, min_lat), (min_lon, max_lat),
-                (max_lon, max_lat), (max_lon, min_lat)
-            ])
-            # --- Check for INTERSECTION ---
-            if polygon.intersects(tile_box):
-                potential_points_map[current_index] = Point(lon, lat) # Map index to CENTER point
-                current_index += 1
-
-total_potential_tiles = len(potential_points_map)
-if total_potential_tiles == 0:
-    print(f"❌ No potential points found inside the boundary for '{CITY_NAME}'.")
-    sys.exit()
-print(f"✅ Calculated {total_potential_tiles} total potential tile locations.")
-# --- END POINT GENERATION ---
-
-
-# --- Scan ONLY the new local download folder ---
-drive_indices = get_existing_indices(DOWNLOADED_TILES_FOLDER)
-
-if drive_indices is None: sys.exit() # Folder not found
-if not drive_indices:
-    print(f"❌ No downloaded tiles found in '{DOWNLOADED_TILES_FOLDER}'. Cannot create plot.")
-    sys.exit()
-
-num_total_downloaded = len(drive_indices)
-print(f"\n✅ Plotting based on {num_total_downloaded} tiles found in the folder.")
-
-
-# --- Filter potential points based ONLY on folder contents ---
-print(" Filtering points to match downloaded files...")
-downloaded_points_geom = []
-for index in drive_indices:
-    if index in potential_points_map:
-        downloaded_points_geom.append(potential_points_map[index])
+
+def main():
+    """Plots the downloaded tiles of DOWNLOADED_TILES_FOLDER over the CITY_NAME boundary to OUTPUT_IMAGE_FILE."""
+    # --- Load the city boundary (MATCHING DOWNLOAD SCRIPT; cached after the first lookup) ---
+    print(f"🌍 Resolving boundary for: {CITY_NAME}")
+    try:
+        gdf_city = resolve_boundary(CITY_NAME, RADIUS_KM, offline=OFFLINE)
+    except LookupError as e:
+        print(f"❌ Error resolving boundary: {e}")
+        sys.exit()
+
+    if gdf_city.crs is None or 'epsg:4326' not in str(gdf_city.crs).lower():
+        gdf_city = gdf_city.to_crs(epsg=4326)
+
+    polygon = gdf_city.union_all() if not gdf_city.empty else None
+    if polygon is None:
+        print("❌ Could not create city polygon."); sys.exit()
+
+    # --- Locate downloaded tiles: one indexed manifest read, or a folder scan + grid rebuild ---
+    failed_lats = failed_lons = np.empty(0)
+    if manifest_exists(DOWNLOADED_TILES_FOLDER):
+        print(f"🗂️ Reading tile manifest in '{DOWNLOADED_TILES_FOLDER}'...")
+        with TileManifest(DOWNLOADED_TILES_FOLDER) as manifest:
+            _, downloaded_lats, downloaded_lons = manifest.tiles(STATUS_DOWNLOADED)
+            _, failed_lats, failed_lons = manifest.tiles(STATUS_FAILED)
+        print(f"✅ Found {len(downloaded_lats)} downloaded and {len(failed_lats)} failed tiles in the manifest.")
+    else:
+        downloaded_lats, downloaded_lons = locate_tiles_by_scan(polygon)
+    num_downloaded = len(downloaded_lats)
+
+    if num_downloaded == 0:
+        print("❌ No matching coordinates found for the downloaded files. Check config.")
+        sys.exit()
+
+    print(f"✅ Matched {num_downloaded} downloaded tiles to coordinates.")
+
+    # --- Reproject the boundary to Web Mercator (EPSG:3857) ---
+    gdf_city_proj = gdf_city.to_crs(epsg=3857)
+
+    # --- Create the Plot ---
+    print(f"📈 Generating {RENDER_MODE} plot with basemap for {num_downloaded} downloaded tiles...")
+    fig, ax = plt.subplots(1, 1, figsize=FIGURE_SIZE)
+
+    gdf_city_proj.plot(ax=ax, facecolor='none', edgecolor=BOUNDARY_EDGE_COLOR, linewidth=BOUNDARY_LINE_WIDTH, zorder=2)
+    if RENDER_MODE == "raster":
+        raster, extent = rasterize_tiles([(failed_lats, failed_lons), (downloaded_lats, downloaded_lons)], ZOOM, TILE_SIZE_PX)
+        print(f"   Binned tiles into a {raster.shape[1]}x{raster.shape[0]} raster.")
+        ax.imshow(raster, extent=extent, cmap=ListedColormap(['none'] + STATUS_COLORS), vmin=0, vmax=len(STATUS_COLORS),
+                  alpha=RASTER_ALPHA, interpolation='nearest', zorder=3)
+    else:
+        # Vectorized reprojection; no per-tile Point objects
+        print("🌐 Reprojecting tiles to Web Mercator (EPSG:3857)...")
+        points_proj = gpd.GeoSeries(gpd.points_from_xy(downloaded_lons, downloaded_lats), crs="EPSG:4326").to_crs(epsg=3857)
+        ax.scatter(points_proj.x, points_proj.y, marker='o', color=POINT_COLOR, s=POINT_SIZE, alpha=POINT_ALPHA, zorder=3)
+
+    print(f"   Adding basemap from {BASEMAP_SOURCE.name}...")
+    bounds = ax.get_xlim()[0], ax.get_ylim()[0], ax.get_xlim()[1], ax.get_ylim()[1]
+    minx, miny, maxx, maxy = gdf_city_proj.total_bounds
+    basemap = load_basemap((min(bounds[0], minx - BASEMAP_MARGIN_M), min(bounds[1], miny - BASEMAP_MARGIN_M),
+                            max(bounds[2], maxx + BASEMAP_MARGIN_M), max(bounds[3], maxy + BASEMAP_MARGIN_M)))
+    if basemap is not None:
+        image, basemap_extent = basemap
+        ax.imshow(image, extent=basemap_extent, interpolation='bilinear', zorder=1)
+        ax.set_xlim(bounds[0], bounds[2])
+        ax.set_ylim(bounds[1], bounds[3])
+        print("   Basemap added.")
     else:
-        print(f"⚠️ Warning: Found file for index {index}, but it was not in the calculated grid. Check STEP/CITY_NAME.")
-
-
-if not downloaded_points_geom:
-    print("❌ No matching coordinates found for the downloaded files. Check config.")
-    sys.exit()
-
-print(f"✅ Matched {len(downloaded_points_geom)} downloaded tiles to coordinates.")
-
-# --- Create GeoDataFrames for plotting ---
-print("📊 Creating GeoDataFrames...")
-gdf_points_downloaded = gpd.GeoDataFrame(geometry=downloaded_points_geom, crs="EPSG:4326")
-
-# --- Reproject to Web Mercator (EPSG:3857) ---
-print("🌐 Reprojecting data to Web Mercator (EPSG:3857)...")
-gdf_city_proj = gdf_city.to_crs(epsg=3857)
-gdf_points_proj = gdf_points_downloaded.to_crs(epsg=3857)
-
-# --- Create the Plot ---
-print(f"📈 Generating plot with basemap for {len(downloaded_points_geom)} downloaded tiles...")
-fig, ax = plt.subplots(1, 1, figsize=FIGURE_SIZE)
-
-gdf_city_proj.plot(ax=ax, facecolor='none', edgecolor=BOUNDARY_EDGE_COLOR, linewidth=BOUNDARY_LINE_WIDTH, zorder=2)
-gdf_points_proj.plot(
-    ax=ax,
-    marker='o',
-    color=POINT_COLOR,
-    markersize=POINT_SIZE,
-    alpha=POINT_ALPHA,
-    zorder=3
-)
-
-print(f"   Adding basemap from {BASEMAP_SOURCE.name}...")
-try:
-    ctx.add_basemap(ax, source=BASEMAP_SOURCE, zoom='auto')
-    print("   Basemap added.")
-except Exception as e:
-    print(f"⚠️ Warning: Could not add basemap. Plotting without it. Error: {e}")
-
-ax.set_title(f'Downloaded Tile Locations ({len(downloaded_points_geom)} points) for "{CITY_NAME}"')
-ax.set_axis_off()
-plt.tight_layout(pad=0)
-
-# --- Save the Plot ---
-try:
-    plt.savefig(OUTPUT_IMAGE_FILE, dpi=DPI, bbox_inches='tight', pad_inches=0)
-    print(f"\n✅ Plot successfully saved as '{OUTPUT_IMAGE_FILE}' in the current directory.")
-except Exception as e:
-    print(f"\n❌ Error saving plot: {e}")
-
-# plt.show()
+        print("⚠️ Warning: Plotting without basemap.")
+
+    ax.set_title(f'Downloaded Tile Locations ({num_downloaded} tiles) for "{CITY_NAME}"')
+    ax.set_axis_off()
+    plt.tight_layout(pad=0)
+
+    # --- Save the Plot ---
+    try:
+        plt.savefig(OUTPUT_IMAGE_FILE, dpi=DPI, bbox_inches='tight', pad_inches=0)
+        print(f"\n✅ Plot successfully saved as '{OUTPUT_IMAGE_FILE}' in the current directory.")
+    except Exception as e:
+        print(f"\n❌ Error saving plot: {e}")
+
+    # plt.show()
+
+
+if __name__ == "__main__":
+    main()
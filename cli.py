@@ -0,0 +1,287 @@
+"""
+Single command-line entry point for a city survey.
+
+    python cli.py grid   --city "Jaipur, India" [--radius-km 5] [--zoom 19]
+    python cli.py fetch  --city "Jaipur, India" --radius-km 5 --folder ./Jaipur_Tiles
+    python cli.py fetch  --folder ./Jaipur_Tiles          # warm resume
+    python cli.py fetch  --folder ./Jaipur_Tiles --survey adaptive   # coarse pass first, see adaptive_survey.py
+    python cli.py status --folder ./Jaipur_Tiles
+    python cli.py plot   --folder ./Jaipur_Tiles --output jaipur.png
+    python cli.py infer  --folder ./Jaipur_Tiles --results jaipur_tiles.csv [--footprints jaipur_panels.parquet]
+    python cli.py export --output model_cpu.ts [--input-size 640] [--no-quantize]   # see model_export.py
+    python cli.py infer  --folder ./Jaipur_Tiles --results jaipur_tiles.csv --exported-model model_cpu.ts
+    python cli.py campaign campaign.json                 # several regions, see campaign.py
+
+Every subcommand imports only what it needs: status reads the manifest and
+run.json with SQLite alone, while the geo (geopandas/osmnx/shapely), plotting
+(matplotlib/contextily) and model (torch/detectron2) stacks are imported
+inside the subcommands that use them. Settings are applied to the module
+constants of city_tile_fetcher.py / city_tile_plotter.py (as
+benchmark_fetcher.py does), and fetch records them in <folder>/run.json, so
+later fetch/status/plot/infer calls on the folder need no other arguments.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# --- CONFIGURATION ---
+RUN_FILENAME = "run.json"
+# Settings recorded per survey folder (and restored on resume)
+RUN_SETTINGS = ("city", "radius_km", "zoom", "addressing", "storage")
+DEFAULT_ZOOM = 19
+# ----------------------------------------
+
+
+def load_run(folder):
+    """Settings recorded by a previous fetch into folder ({} when none)."""
+    path = os.path.join(folder, RUN_FILENAME)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_run(folder, settings):
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, RUN_FILENAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump({**settings, "updated_at": time.time()}, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def resolve_settings(args):
+    """Command-line values over those recorded in the folder's run.json; exits when no city is known."""
+    recorded = load_run(args.folder) if args.folder else {}
+    settings = {name: getattr(args, name, None) for name in RUN_SETTINGS}
+    for name, value in recorded.items():
+        if settings.get(name) is None:
+            settings[name] = value
+    if settings["zoom"] is None:
+        settings["zoom"] = DEFAULT_ZOOM
+    if not settings["city"]:
+        sys.exit(f"❌ --city is required (no {RUN_FILENAME} in '{args.folder}' to resume from)")
+    return settings
+
+
+def configure_fetcher(settings, args):
+    import city_tile_fetcher as fetcher
+    fetcher.CITY_NAME = settings["city"]
+    fetcher.RADIUS_KM = settings["radius_km"]
+    fetcher.ZOOM = settings["zoom"]
+    fetcher.OFFLINE = args.offline
+    if settings["addressing"]:
+        fetcher.ADDRESSING = settings["addressing"]
+    if settings["storage"]:
+        fetcher.TILE_STORAGE = settings["storage"]
+    if args.folder:
+        fetcher.LOCAL_SAVE_FOLDER = args.folder
+    return fetcher
+
+
+def cmd_grid(args):
+    """Counts the tiles covering the search area and how many are still to fetch."""
+    import numpy as np
+    from tile_grid import compute_tile_steps
+    from tile_manifest import TileManifest, manifest_exists, STATUS_DOWNLOADED
+    settings = resolve_settings(args)
+    fetcher = configure_fetcher(settings, args)
+    polygon = fetcher.build_search_area()
+    minx, miny, maxx, maxy = polygon.bounds
+    step_x, step_y, tile_size_meters, _ = compute_tile_steps(miny, maxy, fetcher.ZOOM, fetcher.TILE_SIZE_PX)
+    existing = set()
+    if args.folder and manifest_exists(args.folder):
+        with TileManifest(args.folder) as manifest:
+            existing = manifest.indices(STATUS_DOWNLOADED)
+    existing_sorted = np.sort(np.fromiter(existing, dtype=np.int64, count=len(existing)))
+    total = pending = 0
+    for n_cells, indices, _, _ in fetcher.iter_pending_tiles(polygon, step_x, step_y, existing_sorted, desc="Counting tiles"):
+        total += n_cells
+        pending += len(indices)
+    print(f"🧮 {settings['city']} at zoom {fetcher.ZOOM} ({fetcher.ADDRESSING} addressing, ~{tile_size_meters:.0f} m tiles): "
+          f"{total} tiles, {pending} still to fetch")
+
+
+def cmd_fetch(args):
+    import asyncio
+    settings = resolve_settings(args)
+    fetcher = configure_fetcher(settings, args)
+    if args.workers:
+        fetcher.MAX_CONCURRENT_DOWNLOADS = args.workers
+        fetcher.TASK_QUEUE_SIZE = args.workers * 4
+    if args.survey:
+        fetcher.SURVEY_MODE = args.survey
+    if args.coarse_zoom:
+        fetcher.COARSE_ZOOM = args.coarse_zoom
+    settings["addressing"] = fetcher.ADDRESSING
+    settings["storage"] = fetcher.TILE_STORAGE
+    save_run(fetcher.LOCAL_SAVE_FOLDER, settings)
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(fetcher.main())
+
+
+def cmd_status(args):
+    """Manifest / results summary of a survey folder (SQLite reads only, no geo stack)."""
+    from tile_manifest import TileManifest, manifest_exists, STATUS_DOWNLOADED, STATUS_FAILED
+    run = load_run(args.folder)
+    if run:
+        radius = f", {run['radius_km']} km radius" if run.get("radius_km") else ""
+        print(f"📍 {run['city']}{radius}, zoom {run['zoom']}, {run.get('addressing')} addressing, "
+              f"{run.get('storage')} storage (last fetch {time.strftime('%Y-%m-%d %H:%M', time.localtime(run['updated_at']))})")
+    if not manifest_exists(args.folder):
+        sys.exit(f"❌ No tile manifest in '{args.folder}'")
+    with TileManifest(args.folder) as manifest:
+        counts = manifest.status_counts()
+        total_bytes, last_updated = manifest.summary(STATUS_DOWNLOADED)
+    print(f"🗂️ {counts.get(STATUS_DOWNLOADED, 0)} downloaded ({total_bytes / 1e6:.0f} MB), {counts.get(STATUS_FAILED, 0)} failed")
+    if last_updated:
+        print(f"   last tile stored {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_updated))}")
+    if args.results and os.path.isfile(args.results):
+        with open(args.results) as f:
+            done = sum(1 for _ in f) - 1
+        print(f"🔎 {max(done, 0)} tiles with results in '{args.results}'")
+
+
+def cmd_plot(args):
+    settings = resolve_settings(args)
+    import city_tile_plotter as plotter
+    plotter.CITY_NAME = settings["city"]
+    plotter.RADIUS_KM = settings["radius_km"]
+    plotter.ZOOM = settings["zoom"]
+    plotter.OFFLINE = args.offline
+    plotter.DOWNLOADED_TILES_FOLDER = args.folder
+    if args.output:
+        plotter.OUTPUT_IMAGE_FILE = args.output
+    if args.render_mode:
+        plotter.RENDER_MODE = args.render_mode
+    plotter.main()
+
+
+def cmd_infer(args):
+    """Runs the detector over the downloaded tiles of a folder (resumable, cached; see heatmap_inference.py)."""
+    from tile_grid import tile_filename
+    from tile_manifest import TileManifest, manifest_exists, STATUS_DOWNLOADED
+    from tile_store import store_exists
+    if not manifest_exists(args.folder):
+        sys.exit(f"❌ No tile manifest in '{args.folder}'")
+    with TileManifest(args.folder) as manifest:
+        tile_ids, tile_lats, tile_lons = manifest.tiles(STATUS_DOWNLOADED)
+    tile_store_dir = args.folder if store_exists(args.folder) else None
+    tiles = [(i, None if tile_store_dir else os.path.join(args.folder, tile_filename(i))) for i in tile_ids.tolist()]
+
+    from detection_pipeline import build_model_cfg, DETECTION_CACHE
+    from heatmap_inference import run_inference
+    cfg = build_model_cfg(args.weights) if args.weights else build_model_cfg()
+    footprint_log = os.path.splitext(args.footprints)[0] + "_footprints.sqlite" if args.footprints else None
+    stats = run_inference(cfg, tiles, args.results, tile_store_dir=tile_store_dir, batch_size=args.batch_size,
+                          num_workers=args.workers or 1, cache_path=None if args.no_cache else DETECTION_CACHE,
+                          footprints_path=footprint_log, exported_model=args.exported_model)
+    print(f"⚡ Inferred {stats['processed']} tiles in {stats['elapsed']:.1f}s ({stats['tiles_per_s']:.2f} tiles/s), "
+          f"{stats['cached']} from cache, {stats['already_done']} already done, {stats['unreadable']} unreadable")
+    print(f"💾 Per-tile results: '{args.results}'")
+    if footprint_log:
+        from panel_footprints import build_footprints
+        centers = dict(zip(tile_ids.tolist(), zip(tile_lats.tolist(), tile_lons.tolist())))
+        panels = build_footprints(footprint_log, centers, args.footprints, load_run(args.folder).get("zoom", DEFAULT_ZOOM),
+                                  cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST)
+        print(f"💾 Panel polygons: '{args.footprints}' ({len(panels)} panels, {panels['area_m2'].sum():.0f} m² of PV)")
+
+
+def cmd_export(args):
+    """Writes a CPU TorchScript model (optionally int8) for infer --exported-model (see model_export.py)."""
+    from detection_pipeline import build_model_cfg
+    from model_export import export_model
+    cfg = build_model_cfg(args.weights) if args.weights else build_model_cfg()
+    export_model(cfg, args.output, input_size=args.input_size, quantize=not args.no_quantize,
+                 sample_tile=args.sample_tile)
+
+
+def cmd_campaign(args):
+    import asyncio
+    from campaign import run_campaign
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(run_campaign(args.campaign, offline=args.offline))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Rooftop solar PV city survey")
+    parser.add_argument("--telemetry-log", help="Append JSON-lines stage metrics here (see telemetry.py)")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on 127.0.0.1:<port>/metrics")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def area(p):
+        p.add_argument("--city", help="Geocoding query (or a name imported with boundary_cache.py)")
+        p.add_argument("--radius-km", type=float, help="Circle around the city centre instead of its boundary")
+        p.add_argument("--zoom", type=int)
+        p.add_argument("--offline", action="store_true", help="Never geocode over the network")
+
+    p = sub.add_parser("grid", help="Count tiles for an area")
+    area(p)
+    p.add_argument("--folder", help="Survey folder whose manifest is subtracted")
+    p.add_argument("--addressing", choices=("index", "xyz"))
+    p.set_defaults(func=cmd_grid, storage=None)
+
+    p = sub.add_parser("fetch", help="Download (or resume downloading) tiles into a folder")
+    area(p)
+    p.add_argument("--folder", required=True)
+    p.add_argument("--addressing", choices=("index", "xyz"))
+    p.add_argument("--storage", choices=("files", "shards"))
+    p.add_argument("--workers", type=int, help="Max concurrent downloads")
+    p.add_argument("--survey", choices=("full", "adaptive"), help="adaptive: only fetch tiles under built-up coarse tiles")
+    p.add_argument("--coarse-zoom", type=int, help="Zoom of the adaptive survey's coarse pass")
+    p.set_defaults(func=cmd_fetch)
+
+    p = sub.add_parser("status", help="Summarize a survey folder")
+    p.add_argument("--folder", required=True)
+    p.add_argument("--results", help="Per-tile results CSV to count")
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser("plot", help="Plot downloaded tile coverage")
+    area(p)
+    p.add_argument("--folder", required=True)
+    p.add_argument("--output")
+    p.add_argument("--render-mode", choices=("raster", "points"))
+    p.set_defaults(func=cmd_plot, addressing=None, storage=None)
+
+    p = sub.add_parser("infer", help="Run the detector over a folder's downloaded tiles")
+    p.add_argument("--folder", required=True)
+    p.add_argument("--results", required=True, help="Per-tile results CSV (tile_id,num_panels)")
+    p.add_argument("--weights")
+    p.add_argument("--batch-size", type=int, default=4)
+    p.add_argument("--workers", type=int, help="Inference processes")
+    p.add_argument("--no-cache", action="store_true", help="Do not use the detection cache")
+    p.add_argument("--footprints", help="Also write panel polygons to this GeoParquet file (see panel_footprints.py)")
+    p.add_argument("--exported-model", help="Run this TorchScript file from 'export' instead of the weights")
+    p.set_defaults(func=cmd_infer)
+
+    p = sub.add_parser("export", help="Export the detector to TorchScript for CPU inference")
+    p.add_argument("--output", default="./model_cpu.ts")
+    p.add_argument("--weights")
+    p.add_argument("--input-size", type=int, default=640, help="Square input side the model is traced at")
+    p.add_argument("--no-quantize", action="store_true", help="Keep fp32 Linear layers (no dynamic int8)")
+    p.add_argument("--sample-tile", default="./test/1.png", help="Tile the model is traced on")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("campaign", help="Fetch several regions through one pool and daily quota")
+    p.add_argument("campaign", help="Campaign JSON file (see campaign.py)")
+    p.add_argument("--offline", action="store_true", help="Never geocode over the network")
+    p.set_defaults(func=cmd_campaign)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Standard library only, so cheap even for status
+    import telemetry
+    telemetry.start(args.telemetry_log, args.metrics_port)
+    try:
+        args.func(args)
+    finally:
+        telemetry.stop()
+
+
+if __name__ == "__main__":
+    main()
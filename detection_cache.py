@@ -0,0 +1,134 @@
+"""
+Persistent detection cache (SQLite) keyed by tile content and model.
+
+One row per (content_hash, model_key): the SHA-1 of the tile bytes (same hash
+the fetch manifest records) and a hash of the weights file plus the inference
+config. Raw scores and boxes are stored down to CACHE_SCORE_FLOOR, so panel
+counts for any SCORE_THRESH_TEST above the floor are recomputed from the
+cache; only new or changed tiles (or a new model) go through Mask R-CNN.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+import numpy as np
+
+# --- CONFIGURATION ---
+# The model runs at this score threshold while caching; counts use the real one
+CACHE_SCORE_FLOOR = 0.05
+# Rows buffered before a commit
+COMMIT_EVERY = 200
+# ----------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    content_hash TEXT NOT NULL,
+    model_key    TEXT NOT NULL,
+    scores       BLOB NOT NULL,
+    boxes        BLOB NOT NULL,
+    created_at   REAL NOT NULL,
+    PRIMARY KEY (content_hash, model_key)
+);
+"""
+
+
+def content_hash(payload):
+    return hashlib.sha1(payload).hexdigest()
+
+
+def _file_sha1(path, chunk_bytes=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def caching_cfg(cfg):
+    """Copy of cfg that keeps every detection down to CACHE_SCORE_FLOOR."""
+    cfg = cfg.clone()
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = min(CACHE_SCORE_FLOOR, cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST)
+    return cfg
+
+
+def model_key(cfg, exported_model=None):
+    """
+    Hash of the weights file contents and the MODEL/INPUT config sections
+    (the weights path itself is left out, so moving best_model.pth is free).
+    With exported_model (see model_export.py), that file is hashed instead of
+    the weights, as it also fixes the input size and quantization.
+    """
+    weights = exported_model or cfg.MODEL.WEIGHTS
+    weights_hash = _file_sha1(weights) if os.path.isfile(weights) else weights
+    keyed = cfg.clone()
+    keyed.MODEL.WEIGHTS = ""
+    keyed.MODEL.DEVICE = ""
+    digest = hashlib.sha1(weights_hash.encode())
+    digest.update(keyed.MODEL.dump().encode())
+    digest.update(keyed.INPUT.dump().encode())
+    return digest.hexdigest()
+
+
+def count_detections(scores, score_thresh):
+    """Number of cached detections at or above score_thresh."""
+    return int(np.count_nonzero(scores >= score_thresh))
+
+
+class DetectionCache:
+    """SQLite-backed (content_hash, model_key) -> raw scores/boxes store."""
+
+    def __init__(self, path, key):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.key = key
+        # Worker processes share the file; wait for each other's commits
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+    # --- Writes ---
+    def put(self, content_hash, scores, boxes):
+        """Stores the raw detections of one tile; commits every COMMIT_EVERY rows."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?)",
+            (content_hash, self.key, np.asarray(scores, np.float32).tobytes(),
+             np.asarray(boxes, np.float32).tobytes(), time.time()),
+        )
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self._conn.commit()
+        self._pending = 0
+
+    # --- Reads ---
+    def hashes(self):
+        """Set of content hashes already cached for this model (one indexed read)."""
+        cur = self._conn.execute("SELECT content_hash FROM detections WHERE model_key = ?", (self.key,))
+        return {row[0] for row in cur}
+
+    def get(self, content_hash):
+        """Returns (scores, boxes) NumPy arrays for one tile, or None if not cached."""
+        row = self._conn.execute(
+            "SELECT scores, boxes FROM detections WHERE content_hash = ? AND model_key = ?", (content_hash, self.key)
+        ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], np.float32), np.frombuffer(row[1], np.float32).reshape(-1, 4)
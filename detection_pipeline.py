@@ -0,0 +1,388 @@
+"""
+Fused download-to-detection pipeline for a new city.
+
+Instead of city_tile_fetcher.py writing PNGs, zipping them to Drive and
+generate_city_heatmap unzipping and re-reading every file, tiles go from
+fetch_tile straight into the Mask R-CNN model in memory:
+- each downloaded payload is handed to a bounded sink and decoded +
+  pre-processed on a thread pool as soon as it arrives,
+- the detector groups decoded tiles into batches of BATCH_SIZE and runs
+  BatchPredictor on its own thread while downloads keep flowing (a full
+  sink pauses the fetch workers),
+- tile_id,lat,lon,num_panels rows are appended to RESULTS_CSV after every
+  batch, so a re-run only fetches tiles that have no result yet,
+- raw imagery is only kept (files or shards + manifest) when PERSIST_TILES is set,
+- with DETECTION_CACHE set, tiles whose bytes were already seen by the same
+  model (see detection_cache.py) skip decoding and the model entirely,
+- with PREFILTER set (see tile_prefilter.py), tiles off every building
+  footprint are never fetched and decoded tiles without rooftops skip the model,
+- the finished city is aggregated into the multi-city OUTPUT_PYRAMID
+  (see output_pyramid.py) for map views and queries,
+- with FOOTPRINT_LOG set, every mask is kept as a polygon and the city's
+  panels are written to PANELS_PARQUET as lat/lon polygons with a spatial
+  index (see panel_footprints.py),
+- with EXPORTED_MODEL set, the TorchScript (optionally int8) model written by
+  model_export.py runs instead of the eager fp32 one.
+City, radius, zoom, storage and rate-control settings come from city_tile_fetcher.py.
+"""
+import asyncio
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from tqdm import tqdm
+from detectron2 import model_zoo
+from detectron2.config import get_cfg
+
+import city_tile_fetcher as fetcher
+import telemetry
+from detection_cache import DetectionCache, caching_cfg, content_hash, count_detections, model_key
+from heatmap_inference import (make_predictor, decode_tile, load_results, PREFILTERED,
+                               BATCH_SIZE, DECODE_THREADS, PREFETCH_BATCHES)
+from output_pyramid import OutputPyramid
+from panel_footprints import FootprintLog, build_footprints
+from tile_prefilter import build_prefilter, RECALL_TARGET
+from tile_grid import compute_tile_steps
+from tile_manifest import TileManifest
+from tile_store import ShardedTileStore
+
+# --- CONFIGURATION ---
+MODEL_CONFIG = "COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml"
+MODEL_WEIGHTS = "model_final.pth"
+SCORE_THRESH_TEST = 0.5
+# TorchScript file from model_export.py used instead of MODEL_WEIGHTS (None = eager fp32 model)
+EXPORTED_MODEL = None
+# False: imagery only lives in memory; True: also saved to LOCAL_SAVE_FOLDER as TILE_STORAGE
+PERSIST_TILES = False
+RESULTS_CSV = "./IIT_Delhi_detections.csv"
+# lat,lon,count rows of tiles with panels (same format as generate_city_heatmap)
+HEATMAP_CSV = "./IIT_Delhi_heatmap.csv"
+# Per-cell counts at several zoom levels, shared across cities (None disables it)
+OUTPUT_PYRAMID = "./detection_pyramid.sqlite"
+# Shared across runs and cities (None disables caching)
+DETECTION_CACHE = "./detection_cache.sqlite"
+# Pixel-space mask polygons per tile (None disables panel footprints)
+FOOTPRINT_LOG = "./IIT_Delhi_footprints.sqlite"
+# Geo-referenced, merged panel polygons (GeoParquet, see panel_footprints.py)
+PANELS_PARQUET = "./IIT_Delhi_panels.parquet"
+# None, "image", "footprints" or "both" (see tile_prefilter.py)
+PREFILTER = None
+PREFILTER_RECALL_TARGET = RECALL_TARGET
+# Annotated tiles the image screen is calibrated on
+PREFILTER_ANNOTATIONS = "./train/_annotations.coco.json"
+# Decoded tiles waiting for the model before fetch workers are paused
+SINK_QUEUE_SIZE = BATCH_SIZE * PREFETCH_BATCHES
+# Longest wait for a full batch before a partial one is run
+BATCH_WAIT_S = 0.5
+DETECTION_FIELDS = ["tile_id", "lat", "lon", "num_panels"]
+# ----------------------------------------
+
+
+def build_model_cfg(weights=MODEL_WEIGHTS):
+    """Inference config matching the training notebook (1 class, fine-tuned weights)."""
+    cfg = get_cfg()
+    cfg.merge_from_file(model_zoo.get_config_file(MODEL_CONFIG))
+    cfg.MODEL.ROI_HEADS.NUM_CLASSES = 1
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = SCORE_THRESH_TEST
+    cfg.MODEL.WEIGHTS = weights
+    cfg.MODEL.DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+    return cfg
+
+
+def load_detections(results_path):
+    """Returns {tile_id: (lat, lon, num_panels)} from a detections CSV (tolerates a torn last line)."""
+    detections = {}
+    if not os.path.isfile(results_path):
+        return detections
+    with open(results_path, newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                detections[int(row["tile_id"])] = (float(row["lat"]), float(row["lon"]), int(row["num_panels"]))
+            except (TypeError, ValueError):
+                continue
+    return detections
+
+
+class DetectionSink:
+    """
+    tile_sink for fetch_tile: starts decoding each payload and queues it for the
+    detector as (tile_id, lat, lon, hash, decode future, payload). Payloads whose
+    hash is in cached_hashes are queued without a decode (future None); only
+    those keep their payload, in case the detector needs the model after all.
+    """
+
+    def __init__(self, preprocess, decode_pool, maxsize=SINK_QUEUE_SIZE, cached_hashes=None, prefilter=None):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self._preprocess = preprocess
+        self._decode_pool = decode_pool
+        self._cached_hashes = cached_hashes
+        self._prefilter = prefilter
+
+    async def __call__(self, tile_id, lat, lon, content):
+        tile_hash = content_hash(content) if self._cached_hashes is not None else None
+        if tile_hash is not None and tile_hash in self._cached_hashes:
+            await self.queue.put((tile_id, lat, lon, tile_hash, None, content))
+        else:
+            await self.queue.put((tile_id, lat, lon, tile_hash, self.decode(tile_id, content), None))
+
+    def decode(self, tile_id, content):
+        """Starts decoding + pre-processing one payload on the decode pool."""
+        return asyncio.wrap_future(self._decode_pool.submit(decode_tile, self._preprocess, None, content,
+                                                            self._prefilter, tile_id))
+
+    async def close(self):
+        """Tells the detector no more tiles are coming."""
+        await self.queue.put(None)
+
+
+async def next_batch(queue, batch_size=BATCH_SIZE, batch_wait_s=BATCH_WAIT_S):
+    """
+    Returns (items, finished): up to batch_size queued tiles, waiting at most
+    batch_wait_s after the first one; finished is True once the stop marker is seen.
+    """
+    item = await queue.get()
+    if item is None:
+        return [], True
+    items = [item]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + batch_wait_s
+    while len(items) < batch_size:
+        try:
+            item = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            break
+        if item is None:
+            return items, True
+        items.append(item)
+    return items, False
+
+
+async def run_detector(sink, predictor, model_pool, writer, f, counts, pbar, cache=None, score_thresh=None,
+                       footprints=None):
+    """
+    Runs the model over tiles from the sink and streams one CSV row per tile.
+    With a cache, hits are answered from it and new raw detections are stored.
+    With a FootprintLog, mask polygons are logged per tile.
+    """
+    loop = asyncio.get_running_loop()
+    finished = False
+    while not finished:
+        items, finished = await next_batch(sink.queue)
+        if not items:
+            continue
+        rows = []
+        for k, (tile_id, lat, lon, tile_hash, future, payload) in enumerate(items):
+            if future is not None:
+                continue
+            if footprints is not None and not footprints.reuse(tile_id, tile_hash):
+                # No polygons logged for this content: the tile goes through the model after all
+                items[k] = (tile_id, lat, lon, tile_hash, sink.decode(tile_id, payload), None)
+                continue
+            scores, _ = cache.get(tile_hash)
+            rows.append((tile_id, lat, lon, count_detections(scores, score_thresh)))
+        to_decode = [item for item in items if item[4] is not None]
+        decoded = await asyncio.gather(*(item[4] for item in to_decode))
+        prefiltered = [item for item, model_input in zip(to_decode, decoded) if model_input is PREFILTERED]
+        rows.extend((tile_id, lat, lon, 0) for tile_id, lat, lon, *_ in prefiltered)
+        batch = [(item[:4], model_input) for item, model_input in zip(to_decode, decoded)
+                 if model_input is not None and model_input is not PREFILTERED]
+        if batch:
+            model_start = time.perf_counter()
+            outputs = await loop.run_in_executor(model_pool, predictor, [model_input for _, model_input in batch])
+            model_s = time.perf_counter() - model_start
+            counts["model_s"] += model_s
+            telemetry.observe("inference_batch_seconds", model_s)
+            telemetry.observe("inference_tile_seconds", model_s / len(batch))
+            for (tile_id, lat, lon, tile_hash), output in zip((item for item, _ in batch), outputs):
+                instances = output["instances"]
+                if footprints is not None:
+                    footprints.put(tile_id, tile_hash, instances)
+                if cache is None:
+                    rows.append((tile_id, lat, lon, len(instances)))
+                    continue
+                scores = instances.scores.cpu().numpy()
+                cache.put(tile_hash, scores, instances.pred_boxes.tensor.cpu().numpy())
+                rows.append((tile_id, lat, lon, count_detections(scores, score_thresh)))
+        if batch and cache is not None:
+            cache.commit()
+        if footprints is not None:
+            footprints.commit()
+        if rows:
+            writer.writerows(rows)
+            f.flush()
+        counts["detected"] += len(batch)
+        counts["cached"] += len(items) - len(to_decode)
+        counts["prefiltered"] += len(prefiltered)
+        counts["unreadable"] += len(to_decode) - len(batch) - len(prefiltered)
+        telemetry.count("inference_tiles_total", len(batch), source="model")
+        telemetry.count("inference_tiles_total", len(items) - len(to_decode), source="cached")
+        telemetry.count("inference_tiles_total", len(prefiltered), source="prefiltered")
+        telemetry.count("inference_tiles_total", len(to_decode) - len(batch) - len(prefiltered), source="unreadable")
+        pbar.update(len(items))
+
+
+def _open_detections(results_path):
+    is_new = not os.path.isfile(results_path) or os.path.getsize(results_path) == 0
+    f = open(results_path, "a", newline="")
+    writer = csv.writer(f)
+    if is_new:
+        writer.writerow(DETECTION_FIELDS)
+    return f, writer
+
+
+def write_heatmap_csv(detections, heatmap_path):
+    """Writes lat,lon,count rows for tiles with at least one panel; returns the row count."""
+    rows = [(lat, lon, n) for lat, lon, n in detections.values() if n > 0]
+    with open(heatmap_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["lat", "lon", "count"])
+        writer.writerows(rows)
+    return len(rows)
+
+
+def screen_chunks(pending_chunks, prefilter):
+    """Drops tiles the prefilter's footprint overlay rules out before they are fetched."""
+    for n_cells, indices, lats, lons in pending_chunks:
+        needed = prefilter.overlay(indices, lats, lons)
+        yield n_cells, indices[needed], lats[needed], lons[needed]
+
+
+async def run_pipeline(polygon, cfg, results_path=RESULTS_CSV, persist=PERSIST_TILES, cache_path=DETECTION_CACHE,
+                       prefilter=None, footprints_path=FOOTPRINT_LOG, exported_model=EXPORTED_MODEL):
+    """
+    Fetches every tile of `polygon` without a row in results_path and runs
+    detection on it in memory. Returns a summary dict including tiles/s.
+    """
+    minx, miny, maxx, maxy = polygon.bounds
+    step_x, step_y, _, _ = compute_tile_steps(miny, maxy, fetcher.ZOOM, fetcher.TILE_SIZE_PX)
+    done = load_results(results_path)
+    done_sorted = np.sort(np.fromiter(done, dtype=np.int64, count=len(done)))
+
+    def pending_chunks():
+        chunks = fetcher.iter_pending_tiles(polygon, step_x, step_y, done_sorted)
+        return chunks if prefilter is None else screen_chunks(chunks, prefilter)
+
+    unscreened = sum(len(indices) for _, indices, _, _ in fetcher.iter_pending_tiles(polygon, step_x, step_y, done_sorted))
+    total = sum(len(indices) for _, indices, _, _ in pending_chunks()) if prefilter is not None else unscreened
+    counts = {"downloaded": 0, "failed": 0, "detected": 0, "cached": 0, "prefiltered": 0,
+              "unreadable": 0, "model_s": 0.0}
+    summary = {"tiles": total, "already_done": len(done), "footprint_skipped": unscreened - total,
+               "elapsed": 0.0, "tiles_per_s": 0.0, "prefilter_saved_s": 0.0}
+    if total == 0:
+        return {**summary, **counts}
+
+    manifest = TileManifest(fetcher.LOCAL_SAVE_FOLDER) if persist else None
+    tile_store = ShardedTileStore(fetcher.LOCAL_SAVE_FOLDER) if persist and fetcher.TILE_STORAGE == "shards" else None
+    rate_controller = None
+    if fetcher.ADAPTIVE_RATE_CONTROL:
+        rate_controller = fetcher.AdaptiveRateController(fetcher.INITIAL_QPS, fetcher.MAX_QPS,
+                                                         fetcher.INITIAL_CONCURRENCY, fetcher.MAX_CONCURRENT_DOWNLOADS)
+    semaphore = asyncio.Semaphore(fetcher.MAX_CONCURRENT_DOWNLOADS)
+    cache = score_thresh = None
+    if cache_path:
+        score_thresh = cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST
+        cfg = caching_cfg(cfg)
+        cache = DetectionCache(cache_path, model_key(cfg, exported_model))
+    footprints = FootprintLog(footprints_path) if footprints_path else None
+    cached_hashes = cache.hashes() if cache is not None else None
+    if cached_hashes is not None and footprints is not None:
+        # Cached tiles without logged polygons go through the model again
+        cached_hashes &= footprints.hashes()
+    predictor = make_predictor(cfg, exported_model)
+    f, writer = _open_detections(results_path)
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(DECODE_THREADS) as decode_pool, ThreadPoolExecutor(1) as model_pool:
+            sink = DetectionSink(predictor.preprocess, decode_pool,
+                                 cached_hashes=cached_hashes, prefilter=prefilter)
+            async with fetcher.make_session() as session:
+                with tqdm(total=total, desc="Detecting", position=1, ncols=100) as pbar:
+                    pending = pending_chunks()
+                    detector = asyncio.create_task(run_detector(sink, predictor, model_pool, writer, f, counts, pbar,
+                                                                cache, score_thresh, footprints))
+                    downloads = asyncio.create_task(fetcher.run_streaming_downloads(
+                        session, semaphore, manifest, pending, total, counts, rate_controller, tile_store,
+                        tile_sink=sink, persist=persist))
+                    try:
+                        finished, _ = await asyncio.wait({detector, downloads}, return_when=asyncio.FIRST_EXCEPTION)
+                        if detector in finished:
+                            detector.result()  # Re-raises the failure; workers would otherwise block on a full sink
+                        await downloads
+                        await sink.close()
+                        await detector
+                    except BaseException:
+                        downloads.cancel()
+                        detector.cancel()
+                        raise
+    finally:
+        f.close()
+        if tile_store is not None: tile_store.close()
+        if manifest is not None: manifest.close()
+        if cache is not None: cache.close()
+        if footprints is not None: footprints.close()
+
+    elapsed = time.perf_counter() - start
+    summary["elapsed"] = elapsed
+    summary["tiles_per_s"] = (counts["detected"] + counts["cached"]) / elapsed if elapsed > 0 else 0.0
+    # Model time the screened-out tiles would have cost (footprint-skipped ones also saved their download)
+    model_s_per_tile = counts["model_s"] / counts["detected"] if counts["detected"] else 0.0
+    summary["prefilter_saved_s"] = (counts["prefiltered"] + summary["footprint_skipped"]) * model_s_per_tile
+    if rate_controller is not None:
+        summary["rate"] = rate_controller.summary()
+    return {**summary, **counts}
+
+
+async def main():
+    telemetry.start(fetcher.TELEMETRY_LOG, fetcher.TELEMETRY_PORT)
+    polygon = fetcher.build_search_area()
+    cfg = build_model_cfg()
+    prefilter = build_prefilter(PREFILTER, PREFILTER_ANNOTATIONS, polygon, PREFILTER_RECALL_TARGET,
+                                fetcher.ZOOM, fetcher.TILE_SIZE_PX)
+    storage = f"'{fetcher.LOCAL_SAVE_FOLDER}' ({fetcher.TILE_STORAGE})" if PERSIST_TILES else "memory only"
+    print(f"\n🚀 Fused download + detection for {fetcher.CITY_NAME}: batch {BATCH_SIZE}, "
+          f"up to {fetcher.MAX_CONCURRENT_DOWNLOADS} connections, imagery kept in {storage}")
+    stats = await run_pipeline(polygon, cfg, prefilter=prefilter)
+
+    telemetry.event("pipeline_summary", city=fetcher.CITY_NAME, **stats)
+    detections = load_detections(RESULTS_CSV)
+    with_panels = write_heatmap_csv(detections, HEATMAP_CSV)
+    if OUTPUT_PYRAMID and detections:
+        lats, lons, panels = np.array(list(detections.values())).T
+        with OutputPyramid(OUTPUT_PYRAMID) as pyramid:
+            pyramid_cells = pyramid.write_city(fetcher.CITY_NAME, lats, lons, panels, fetcher.ZOOM, fetcher.TILE_SIZE_PX)
+    panel_polygons = None
+    if FOOTPRINT_LOG and PANELS_PARQUET and detections:
+        centers = {tile_id: (lat, lon) for tile_id, (lat, lon, _) in detections.items()}
+        panel_polygons = build_footprints(FOOTPRINT_LOG, centers, PANELS_PARQUET, fetcher.ZOOM, SCORE_THRESH_TEST)
+
+    print("\n🎉 Pipeline complete!")
+    print(f"--- Summary ---")
+    print(f"Tiles needed: {stats['tiles']} ({stats['already_done']} already detected)")
+    print(f"Tiles downloaded: {stats['downloaded']}, failed: {stats['failed']}")
+    print(f"Tiles detected: {stats['detected']} in {stats['elapsed']:.1f}s ({stats['tiles_per_s']:.2f} tiles/s), "
+          f"{stats['cached']} from cache, {stats['unreadable']} unreadable")
+    if prefilter is not None:
+        print(f"Prefilter ({PREFILTER}): {stats['footprint_skipped']} tiles off building footprints not fetched, "
+              f"{stats['prefiltered']} screened out after decoding, ~{stats['prefilter_saved_s']:.0f}s of model time saved")
+    if "rate" in stats:
+        print(f"Rate control: settled at {stats['rate']['qps']:.1f} QPS / {stats['rate']['concurrency']} concurrent")
+    print(f"-------------")
+    print(f"💾 Per-tile results: '{RESULTS_CSV}' ({len(detections)} tiles)")
+    print(f"💾 Heatmap CSV: '{HEATMAP_CSV}' ({with_panels} tiles with panels)")
+    if OUTPUT_PYRAMID and detections:
+        print(f"💾 Output pyramid: '{OUTPUT_PYRAMID}' ({pyramid_cells} cells for {fetcher.CITY_NAME})")
+    if panel_polygons is not None:
+        print(f"💾 Panel polygons: '{PANELS_PARQUET}' ({len(panel_polygons)} panels, "
+              f"{panel_polygons['area_m2'].sum():.0f} m² of PV)")
+
+
+if __name__ == "__main__":
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    try:
+        asyncio.run(main())
+    finally:
+        telemetry.stop()
@@ -0,0 +1,376 @@
+"""
+Batched, prefetching CPU inference runner for generate_city_heatmap.
+
+Replaces the serial `cv2.imread -> predictor(img) -> .to("cpu")` loop:
+- background threads read/decode/resize tiles ahead of the model,
+- the Detectron2 model runs on batches of BATCH_SIZE images,
+- the tile list can be sharded across worker processes on multi-core boxes,
+- per-tile results are appended to a CSV as they are produced, so a crash
+  loses at most one batch and a re-run resumes where it stopped,
+- with a detection cache (see detection_cache.py) tiles whose bytes and model
+  are unchanged skip the model; the results CSV is resumed as usual while the
+  model and SCORE_THRESH_TEST it was written with (kept in <results>.key)
+  stay the same, and rebuilt from the cached raw detections when they change,
+- with a prefilter (see tile_prefilter.py) decoded tiles that cannot contain
+  rooftops are recorded with 0 panels instead of going through the model,
+- with a footprint log (see panel_footprints.py) every mask is also kept as
+  a polygon, for geo-referenced panel output,
+- with an exported model (see model_export.py) the TorchScript / int8 file
+  runs instead of the eager fp32 model.
+"""
+import collections
+import csv
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+import torch
+from tqdm import tqdm
+from detectron2.checkpoint import DetectionCheckpointer
+from detectron2.config import CfgNode
+from detectron2.modeling import build_model
+import detectron2.data.transforms as T
+
+import telemetry
+from detection_cache import DetectionCache, caching_cfg, content_hash, count_detections, model_key
+from model_export import ExportedPredictor
+from panel_footprints import FootprintLog
+from tile_store import ShardedTileStore
+
+# --- CONFIGURATION ---
+BATCH_SIZE = 4
+DECODE_THREADS = 4
+# Batches decoded ahead of the model
+PREFETCH_BATCHES = 4
+RESULTS_FIELDS = ["tile_id", "num_panels"]
+# ----------------------------------------
+
+
+class BatchPredictor:
+    """DefaultPredictor equivalent that runs a list of pre-processed images as one batch."""
+
+    def __init__(self, cfg):
+        self.cfg = cfg.clone()
+        self.model = build_model(self.cfg)
+        self.model.eval()
+        DetectionCheckpointer(self.model).load(cfg.MODEL.WEIGHTS)
+        self.aug = T.ResizeShortestEdge([cfg.INPUT.MIN_SIZE_TEST, cfg.INPUT.MIN_SIZE_TEST], cfg.INPUT.MAX_SIZE_TEST)
+        self.input_format = cfg.INPUT.FORMAT
+
+    def preprocess(self, bgr_image):
+        """Same transform as DefaultPredictor; safe to call from decode threads."""
+        image = bgr_image[:, :, ::-1] if self.input_format == "RGB" else bgr_image
+        height, width = image.shape[:2]
+        image = self.aug.get_transform(image).apply_image(image)
+        tensor = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+        return {"image": tensor, "height": height, "width": width}
+
+    def __call__(self, inputs):
+        with torch.no_grad():
+            return self.model(inputs)
+
+
+def make_predictor(cfg, exported_model=None):
+    """BatchPredictor for cfg, or an ExportedPredictor at cfg's score threshold."""
+    if exported_model:
+        return ExportedPredictor(exported_model, cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST)
+    return BatchPredictor(cfg)
+
+
+# Stand in for the model input of tiles whose detections are already cached /
+# that the prefilter rejected
+CACHED = object()
+PREFILTERED = object()
+
+
+def decode_tile(preprocess, img_path, payload, prefilter=None, tile_id=None):
+    """
+    Reads + decodes + pre-processes one tile; returns None if unreadable and
+    PREFILTERED if the prefilter rules out rooftops (nothing pre-processed).
+    """
+    with telemetry.timer("decode_seconds"):
+        if payload is not None:
+            img = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+        else:
+            img = cv2.imread(img_path)
+        if img is None:
+            return None
+        if prefilter is not None and not prefilter.keep(tile_id, img):
+            return PREFILTERED
+        return preprocess(img)
+
+
+def _decode_unhashed(preprocess, img_path, payload, prefilter, tile_id):
+    return None, decode_tile(preprocess, img_path, payload, prefilter, tile_id)
+
+
+def _hash_and_decode(preprocess, img_path, payload, prefilter, tile_id, cached_hashes):
+    """
+    Returns (content_hash, model_input); model_input is CACHED when the hash is
+    in cached_hashes (nothing decoded) and None if the tile is unreadable.
+    """
+    if payload is None:
+        try:
+            with open(img_path, "rb") as f:
+                payload = f.read()
+        except OSError:
+            return None, None
+    tile_hash = content_hash(payload)
+    if tile_hash in cached_hashes:
+        return tile_hash, CACHED
+    return tile_hash, decode_tile(preprocess, None, payload, prefilter, tile_id)
+
+
+def iter_batches(tiles, preprocess, tile_store=None, batch_size=BATCH_SIZE,
+                 decode_threads=DECODE_THREADS, prefetch_batches=PREFETCH_BATCHES, cached_hashes=None,
+                 prefilter=None):
+    """
+    Yields (batch, unreadable, cached, prefiltered) lists: batch holds (tile_id,
+    content_hash, model_input) tuples, decoded by a thread pool that stays up
+    to prefetch_batches batches ahead. With cached_hashes, tiles are hashed
+    first and those already cached are returned in cached as (tile_id,
+    content_hash) without being decoded; otherwise content_hash is None.
+    Tile ids rejected by the prefilter are returned in prefiltered.
+    Store payloads are looked up on this thread (SQLite handles are per-thread).
+    """
+    tiles = iter(tiles)
+    window = collections.deque()
+    with ThreadPoolExecutor(decode_threads) as pool:
+        def submit_next():
+            for tile_id, img_path in tiles:
+                payload = tile_store.get(tile_id) if tile_store is not None else None
+                if cached_hashes is None:
+                    future = pool.submit(_decode_unhashed, preprocess, img_path, payload, prefilter, tile_id)
+                else:
+                    future = pool.submit(_hash_and_decode, preprocess, img_path, payload, prefilter, tile_id, cached_hashes)
+                window.append((tile_id, future))
+                return
+
+        for _ in range(batch_size * prefetch_batches):
+            submit_next()
+        while window:
+            batch, unreadable, cached, prefiltered = [], [], [], []
+            while window and len(batch) < batch_size and len(cached) + len(prefiltered) < batch_size * prefetch_batches:
+                tile_id, future = window.popleft()
+                submit_next()
+                tile_hash, model_input = future.result()
+                if model_input is None:
+                    unreadable.append(tile_id)
+                elif model_input is CACHED:
+                    cached.append((tile_id, tile_hash))
+                elif model_input is PREFILTERED:
+                    prefiltered.append(tile_id)
+                else:
+                    batch.append((tile_id, tile_hash, model_input))
+            yield batch, unreadable, cached, prefiltered
+
+
+def load_results(results_path):
+    """Returns {tile_id: num_panels} from a results CSV (tolerates a torn last line)."""
+    results = {}
+    if not os.path.isfile(results_path):
+        return results
+    with open(results_path, newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                results[int(row["tile_id"])] = int(row["num_panels"])
+            except (TypeError, ValueError):
+                continue
+    return results
+
+
+def _open_results(results_path):
+    is_new = not os.path.isfile(results_path) or os.path.getsize(results_path) == 0
+    f = open(results_path, "a", newline="")
+    writer = csv.writer(f)
+    if is_new:
+        writer.writerow(RESULTS_FIELDS)
+    return f, writer
+
+
+def _results_key_matches(results_path, results_key):
+    """Whether results_path was written with results_key (model key + score threshold)."""
+    try:
+        with open(results_path + ".key") as f:
+            return json.load(f) == results_key
+    except (OSError, ValueError):
+        return False
+
+
+def _write_results_key(results_path, results_key):
+    with open(results_path + ".key.tmp", "w") as f:
+        json.dump(results_key, f)
+    os.replace(results_path + ".key.tmp", results_path + ".key")
+
+
+def run_shard(cfg_yaml, tiles, results_path, tile_store_dir=None, batch_size=BATCH_SIZE,
+              decode_threads=DECODE_THREADS, prefetch_batches=PREFETCH_BATCHES, torch_threads=None, position=0,
+              cache_path=None, cache_key=None, score_thresh=None, prefilter=None, footprints_path=None,
+              exported_model=None):
+    """
+    Runs inference over one list of (tile_id, img_path) and appends rows to results_path.
+    Tiles already in results_path are skipped. With cache_path, counts use
+    score_thresh on the cached raw detections, and the cache is committed
+    before each batch's rows so every row's detections survive a crash.
+    Tiles rejected by the prefilter are written with 0 panels.
+    With footprints_path, mask polygons are logged per tile; cached tiles
+    without logged polygons go through the model again.
+    With exported_model, that file (see model_export.py) runs instead of cfg's model.
+    Returns a dict of tile counts plus the seconds spent in the model.
+    """
+    if torch_threads:
+        torch.set_num_threads(torch_threads)
+    telemetry.autostart()
+    cfg = CfgNode.load_cfg(cfg_yaml)
+    done = load_results(results_path)
+    tiles = [(tile_id, img_path) for tile_id, img_path in tiles if tile_id not in done]
+    stats = {"processed": 0, "unreadable": 0, "cached": 0, "prefiltered": 0, "model_s": 0.0}
+    if not tiles:
+        return stats
+
+    predictor = make_predictor(cfg, exported_model)
+    tile_store = ShardedTileStore(tile_store_dir) if tile_store_dir else None
+    cache = DetectionCache(cache_path, cache_key) if cache_path else None
+    footprints = FootprintLog(footprints_path) if footprints_path else None
+    cached_hashes = cache.hashes() if cache is not None else None
+    if cached_hashes is not None and footprints is not None:
+        cached_hashes &= footprints.hashes()
+    f, writer = _open_results(results_path)
+    try:
+        with tqdm(total=len(tiles), desc=f"Inference[{position}]", position=position, ncols=100) as pbar:
+            for batch, unreadable, cached, prefiltered in iter_batches(tiles, predictor.preprocess, tile_store,
+                                                                       batch_size, decode_threads, prefetch_batches,
+                                                                       cached_hashes, prefilter):
+                rows = [(tile_id, 0) for tile_id in prefiltered]
+                if batch:
+                    model_start = time.perf_counter()
+                    outputs = predictor([model_input for _, _, model_input in batch])
+                    model_s = time.perf_counter() - model_start
+                    stats["model_s"] += model_s
+                    telemetry.observe("inference_batch_seconds", model_s)
+                    telemetry.observe("inference_tile_seconds", model_s / len(batch))
+                    for (tile_id, tile_hash, _), output in zip(batch, outputs):
+                        instances = output["instances"]
+                        if footprints is not None:
+                            footprints.put(tile_id, tile_hash, instances)
+                        if cache is None:
+                            rows.append((tile_id, len(instances)))
+                            continue
+                        scores = instances.scores.cpu().numpy()
+                        cache.put(tile_hash, scores, instances.pred_boxes.tensor.cpu().numpy())
+                        rows.append((tile_id, count_detections(scores, score_thresh)))
+                for tile_id, tile_hash in cached:
+                    if footprints is not None:
+                        footprints.reuse(tile_id, tile_hash)
+                    scores, _ = cache.get(tile_hash)
+                    rows.append((tile_id, count_detections(scores, score_thresh)))
+                if batch and cache is not None:
+                    cache.commit()
+                if footprints is not None:
+                    footprints.commit()
+                if rows:
+                    writer.writerows(rows)
+                    f.flush()
+                stats["processed"] += len(batch)
+                stats["unreadable"] += len(unreadable)
+                stats["cached"] += len(cached)
+                stats["prefiltered"] += len(prefiltered)
+                pbar.update(len(batch) + len(unreadable) + len(cached) + len(prefiltered))
+    finally:
+        for source in ("processed", "unreadable", "cached", "prefiltered"):
+            telemetry.count("inference_tiles_total", stats[source], source="model" if source == "processed" else source)
+        telemetry.flush()
+        f.close()
+        if tile_store is not None:
+            tile_store.close()
+        if cache is not None:
+            cache.close()
+        if footprints is not None:
+            footprints.close()
+    return stats
+
+
+def _merge_parts(results_path, num_workers):
+    """Folds per-worker part files into results_path (also recovers parts left by a crash)."""
+    merged = load_results(results_path)
+    parts = [f"{results_path}.part{k}" for k in range(num_workers)]
+    for part in parts:
+        merged.update(load_results(part))
+    with open(results_path + ".tmp", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULTS_FIELDS)
+        writer.writerows(sorted(merged.items()))
+    os.replace(results_path + ".tmp", results_path)
+    for part in parts:
+        if os.path.exists(part):
+            os.remove(part)
+
+
+def run_inference(cfg, tiles, results_path, tile_store_dir=None, batch_size=BATCH_SIZE,
+                  decode_threads=DECODE_THREADS, prefetch_batches=PREFETCH_BATCHES, num_workers=1, cache_path=None,
+                  prefilter=None, footprints_path=None, exported_model=None):
+    """
+    Runs the model over `tiles` ((tile_id, img_path) pairs; img_path is ignored
+    when reading from tile_store_dir) and writes tile_id,num_panels rows to
+    results_path incrementally. With num_workers > 1 the list is sharded across
+    processes, each using cpu_count / num_workers torch threads.
+    With cache_path, raw detections are cached per tile content + model
+    (see detection_cache.py); results_path is resumed while the model key and
+    SCORE_THRESH_TEST match the ones it was written with, and otherwise
+    rebuilt (cheaply, from the cache).
+    With a prefilter (see tile_prefilter.py), screened-out tiles skip the model;
+    the summary estimates the model time that saved.
+    With footprints_path, mask polygons are logged for build_footprints().
+    With exported_model, the TorchScript file written by model_export.py is
+    used in place of cfg's eager model (and keys the cache).
+    Returns a summary dict including tiles/s.
+    """
+    tiles = list(tiles)
+    cache_key = score_thresh = None
+    if cache_path:
+        score_thresh = cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST
+        cfg = caching_cfg(cfg)
+        cache_key = model_key(cfg, exported_model)
+        results_key = {"model_key": cache_key, "score_thresh": score_thresh}
+        if not _results_key_matches(results_path, results_key):
+            for stale in [results_path] + [f"{results_path}.part{k}" for k in range(num_workers)]:
+                if os.path.exists(stale):
+                    os.remove(stale)
+            _write_results_key(results_path, results_key)
+    already_done = len(load_results(results_path))
+    cfg_yaml = cfg.dump()
+    start = time.perf_counter()
+
+    if num_workers <= 1:
+        stats = run_shard(cfg_yaml, tiles, results_path, tile_store_dir, batch_size, decode_threads, prefetch_batches,
+                          cache_path=cache_path, cache_key=cache_key, score_thresh=score_thresh, prefilter=prefilter,
+                          footprints_path=footprints_path, exported_model=exported_model)
+    else:
+        _merge_parts(results_path, num_workers)
+        done = load_results(results_path)
+        todo = [tile for tile in tiles if tile[0] not in done]
+        torch_threads = max(1, (os.cpu_count() or 1) // num_workers)
+        jobs = [(cfg_yaml, todo[k::num_workers], f"{results_path}.part{k}", tile_store_dir, batch_size,
+                 max(1, decode_threads // num_workers), prefetch_batches, torch_threads, k,
+                 cache_path, cache_key, score_thresh, prefilter, footprints_path, exported_model)
+                for k in range(num_workers)]
+        with mp.get_context("spawn").Pool(num_workers) as pool:
+            shard_results = pool.starmap(run_shard, jobs)
+        _merge_parts(results_path, num_workers)
+        stats = {key: sum(shard[key] for shard in shard_results) for key in shard_results[0]}
+
+    elapsed = time.perf_counter() - start
+    model_s_per_tile = stats["model_s"] / stats["processed"] if stats["processed"] else 0.0
+    telemetry.event("inference_summary", tiles=len(tiles), num_workers=num_workers, elapsed=elapsed, **stats)
+    return {
+        "tiles": len(tiles),
+        "already_done": already_done,
+        **stats,
+        # Wall-clock the prefiltered tiles would have cost at this run's per-tile model rate
+        "prefilter_saved_s": stats["prefiltered"] * model_s_per_tile / max(1, num_workers),
+        "elapsed": elapsed,
+        "tiles_per_s": stats["processed"] / elapsed if elapsed > 0 else 0.0,
+    }
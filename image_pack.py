@@ -0,0 +1,183 @@
+"""
+Pre-decoded, memory-mapped image pack for Detectron2 training and testing.
+
+Every image of a split produced by script.py is decoded once and stored as
+raw BGR uint8 in a single images.u8 file with a JSON offset index, instead of
+data-loader workers decoding the same 640x640 PNGs on every iteration.
+Workers slice images straight out of a np.memmap; startup is one index read.
+The pack is rebuilt only when the split's _annotations.coco.json or image
+files change.
+
+Layout of a pack folder:
+    images.u8         H x W x 3 BGR pixels of every image, concatenated
+    images_index.json {"source_hash", "images": {file_name: [offset, height, width]}}
+
+register_packed_coco() registers a split like register_coco_instances() (same
+metadata, so COCOEvaluator works) and PackedDatasetMapper reads its records.
+"""
+import copy
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+import torch
+from tqdm import tqdm
+from detectron2.data import DatasetCatalog, DatasetMapper, MetadataCatalog
+from detectron2.data import detection_utils as utils
+from detectron2.data import transforms as T
+from detectron2.data.datasets import load_coco_json
+from PIL import Image
+
+# --- CONFIGURATION ---
+PIXELS_FILENAME = "images.u8"
+PACK_INDEX_FILENAME = "images_index.json"
+DECODE_THREADS = 8
+# ----------------------------------------
+
+
+def _source_hash(annotations_path, image_dir, file_names):
+    """Hash of the annotation file plus the name and size of every image."""
+    digest = hashlib.sha1()
+    with open(annotations_path, "rb") as f:
+        digest.update(f.read())
+    for name in sorted(file_names):
+        path = os.path.join(image_dir, name)
+        digest.update(f"{name}:{os.path.getsize(path) if os.path.exists(path) else -1}".encode())
+    return digest.hexdigest()
+
+
+def build_image_pack(annotations_path, image_dir, pack_dir, threads=DECODE_THREADS, force=False):
+    """
+    Decodes every image listed in a COCO file into pack_dir (skipped when the
+    pack already matches the split). Unreadable images are left out.
+    Returns the opened ImagePack.
+    """
+    with open(annotations_path) as f:
+        images = json.load(f)["images"]
+    source_hash = _source_hash(annotations_path, image_dir, [img["file_name"] for img in images])
+    index_path = os.path.join(pack_dir, PACK_INDEX_FILENAME)
+    if not force and os.path.isfile(index_path):
+        with open(index_path) as f:
+            if json.load(f).get("source_hash") == source_hash:
+                return ImagePack(pack_dir)
+
+    os.makedirs(pack_dir, exist_ok=True)
+    entries = {}
+    offset = 0
+    with ThreadPoolExecutor(threads) as pool, open(os.path.join(pack_dir, PIXELS_FILENAME), "wb") as out:
+        decoded = pool.map(lambda img: cv2.imread(os.path.join(image_dir, img["file_name"]), cv2.IMREAD_COLOR), images)
+        for img, pixels in tqdm(zip(images, decoded), total=len(images), desc="Packing images", ncols=100):
+            if pixels is None:
+                continue
+            out.write(np.ascontiguousarray(pixels).tobytes())
+            entries[img["file_name"]] = [offset, pixels.shape[0], pixels.shape[1]]
+            offset += pixels.nbytes
+    # Index last: a crash mid-build leaves a stale hash, so the next call rebuilds
+    with open(index_path + ".tmp", "w") as f:
+        json.dump({"source_hash": source_hash, "images": entries}, f, separators=(",", ":"))
+    os.replace(index_path + ".tmp", index_path)
+    return ImagePack(pack_dir)
+
+
+class ImagePack:
+    """Read-only view of a pack folder through np.memmap."""
+
+    def __init__(self, pack_dir):
+        self.pack_dir = pack_dir
+        with open(os.path.join(pack_dir, PACK_INDEX_FILENAME)) as f:
+            self._index = json.load(f)["images"]
+        self._data = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, file_name):
+        return file_name in self._index
+
+    def __getstate__(self):
+        # Data-loader workers re-open the memmap lazily
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def get(self, file_name):
+        """(height, width, 3) BGR uint8 view of one image (no copy, read-only)."""
+        if self._data is None:
+            path = os.path.join(self.pack_dir, PIXELS_FILENAME)
+            self._data = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.empty(0, np.uint8)
+        offset, height, width = self._index[file_name]
+        return self._data[offset:offset + height * width * 3].reshape(height, width, 3)
+
+
+def register_packed_coco(name, annotations_path, image_dir, pack_dir):
+    """
+    register_coco_instances() equivalent whose records carry an "image_pack"
+    folder; the pack is built (or validated) here. Images missing from the
+    pack are dropped from the dataset.
+    """
+    pack = build_image_pack(annotations_path, image_dir, pack_dir)
+
+    def load():
+        records = load_coco_json(annotations_path, image_dir, name)
+        for record in records:
+            record["image_pack"] = pack_dir
+        return [record for record in records if os.path.basename(record["file_name"]) in pack]
+
+    DatasetCatalog.register(name, load)
+    MetadataCatalog.get(name).set(json_file=annotations_path, image_root=image_dir, evaluator_type="coco")
+    return pack
+
+
+class PackedDatasetMapper(DatasetMapper):
+    """
+    DatasetMapper that takes images from the record's "image_pack" instead of
+    decoding file_name (records without one are read from disk as usual).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._packs = {}
+
+    def _read_image(self, dataset_dict):
+        pack_dir = dataset_dict.get("image_pack")
+        if pack_dir is None:
+            return utils.read_image(dataset_dict["file_name"], format=self.image_format)
+        pack = self._packs.get(pack_dir)
+        if pack is None:
+            pack = self._packs[pack_dir] = ImagePack(pack_dir)
+        image = pack.get(os.path.basename(dataset_dict["file_name"]))
+        if self.image_format == "RGB":
+            return image[:, :, ::-1]
+        if self.image_format != "BGR":
+            return utils.convert_PIL_to_numpy(Image.fromarray(image[:, :, ::-1]), self.image_format)
+        return image
+
+    def __call__(self, dataset_dict):
+        # Same steps as DatasetMapper.__call__, with the image read from the pack
+        dataset_dict = copy.deepcopy(dataset_dict)
+        image = self._read_image(dataset_dict)
+        utils.check_image_size(dataset_dict, image)
+        if "sem_seg_file_name" in dataset_dict:
+            sem_seg_gt = utils.read_image(dataset_dict.pop("sem_seg_file_name"), "L").squeeze(2)
+        else:
+            sem_seg_gt = None
+
+        aug_input = T.AugInput(image, sem_seg=sem_seg_gt)
+        transforms = self.augmentations(aug_input)
+        image, sem_seg_gt = aug_input.image, aug_input.sem_seg
+        image_shape = image.shape[:2]
+        dataset_dict["image"] = torch.as_tensor(np.ascontiguousarray(image.transpose(2, 0, 1)))
+        if sem_seg_gt is not None:
+            dataset_dict["sem_seg"] = torch.as_tensor(sem_seg_gt.astype("long"))
+        if self.proposal_topk is not None:
+            utils.transform_proposals(dataset_dict, image_shape, transforms, proposal_topk=self.proposal_topk)
+
+        if not self.is_train:
+            dataset_dict.pop("annotations", None)
+            dataset_dict.pop("sem_seg_file_name", None)
+            return dataset_dict
+        if "annotations" in dataset_dict:
+            self._transform_annotations(dataset_dict, transforms, image_shape)
+        return dataset_dict
@@ -0,0 +1,155 @@
+"""
+Batched IoU evaluation for the training notebooks.
+
+IOUEvaluator compares the union of predicted instance masks with the mask
+store ground truth entirely on the model's device: masks are resized with
+F.interpolate (no PIL round-trip), and per-image intersection/union counts
+are kept as tensors and synced once in evaluate(). IOUHook runs it every
+EVAL_PERIOD on the validation set and on a stratified subsample of the
+training set, loaded in batches, and reports the share of wall-clock the
+evaluation pauses take.
+"""
+import os
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+from detectron2.data import build_detection_test_loader
+from detectron2.engine import HookBase
+from detectron2.evaluation import DatasetEvaluator, inference_on_dataset
+from image_pack import PackedDatasetMapper
+
+# --- CONFIGURATION ---
+EVAL_BATCH_SIZE = 8
+# Share of the training set scored at each evaluation
+TRAIN_EVAL_FRACTION = 0.1
+# Panel-coverage strata the training subsample is drawn from (plus one for empty masks)
+TRAIN_EVAL_STRATA = 4
+TRAIN_EVAL_SEED = 0
+# ----------------------------------------
+
+
+def _mask_name(dataset_record):
+    return os.path.basename(dataset_record["file_name"])
+
+
+def stratified_sample(dataset_dicts, mask_store, fraction=TRAIN_EVAL_FRACTION, n_strata=TRAIN_EVAL_STRATA,
+                      seed=TRAIN_EVAL_SEED):
+    """
+    Fixed subsample of dataset_dicts keeping the mix of panel coverage: images
+    are binned into empty masks + n_strata coverage quantiles, and `fraction`
+    of every bin (at least one image) is drawn with a seeded RNG.
+    """
+    if fraction >= 1:
+        return list(dataset_dicts)
+    coverage = np.array([np.unpackbits(mask_store.packed(_mask_name(d))).mean() for d in dataset_dicts])
+    strata = np.zeros(len(dataset_dicts), dtype=np.int64)
+    covered = coverage > 0
+    if covered.any():
+        edges = np.quantile(coverage[covered], np.linspace(0, 1, n_strata + 1)[1:-1])
+        strata[covered] = 1 + np.searchsorted(edges, coverage[covered], side="right")
+    rng = np.random.default_rng(seed)
+    picked = []
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        size = max(1, int(round(len(members) * fraction)))
+        picked.extend(rng.choice(members, size=min(size, len(members)), replace=False).tolist())
+    return [dataset_dicts[i] for i in sorted(picked)]
+
+
+def build_iou_loader(cfg, dataset_dicts, batch_size=EVAL_BATCH_SIZE):
+    """
+    Test-time loader over dataset_dicts that yields batch_size images per step
+    (records with an "image_pack" are read from it, see image_pack.py).
+    """
+    return build_detection_test_loader(dataset=dataset_dicts, mapper=PackedDatasetMapper(cfg, is_train=False),
+                                       batch_size=batch_size, num_workers=cfg.DATALOADER.NUM_WORKERS)
+
+
+class IOUEvaluator(DatasetEvaluator):
+    """
+    Mean per-image IoU of the predicted panel union against the mask store;
+    images where both masks are empty score empty_iou. Also reports the
+    pooled IoU (total intersection / total union).
+    """
+
+    def __init__(self, dataset_name, mask_store, empty_iou=1.0):
+        self._dataset_name = dataset_name
+        self._mask_store = mask_store
+        self._empty_iou = empty_iou
+        self.reset()
+
+    def reset(self):
+        self._intersections = []
+        self._unions = []
+
+    def process(self, inputs, outputs):
+        for input_data, output in zip(inputs, outputs):
+            instances = output["instances"]
+            gt_mask = torch.from_numpy(self._mask_store.get(_mask_name(input_data)))
+            gt_mask = gt_mask.to(instances.pred_masks.device, non_blocking=True)
+            if len(instances):
+                pred_mask = instances.pred_masks.any(dim=0)
+            else:
+                pred_mask = torch.zeros_like(gt_mask)
+            if pred_mask.shape != gt_mask.shape:
+                pred_mask = F.interpolate(pred_mask[None, None].float(), size=gt_mask.shape, mode="nearest")[0, 0] > 0.5
+            self._intersections.append((pred_mask & gt_mask).sum())
+            self._unions.append((pred_mask | gt_mask).sum())
+
+    def evaluate(self):
+        if not self._intersections:
+            return {}
+        intersections = torch.stack(self._intersections).double().cpu()
+        unions = torch.stack(self._unions).double().cpu()
+        per_image = torch.where(unions > 0, intersections / unions.clamp(min=1), torch.full_like(unions, self._empty_iou))
+        pooled = (intersections.sum() / unions.sum()).item() if unions.sum() > 0 else self._empty_iou
+        return {"sem_seg": {"IoU": per_image.mean().item(), "pooled_IoU": pooled}}
+
+
+class IOUHook(HookBase):
+    """
+    Every EVAL_PERIOD (and at the last iteration) scores the validation loader
+    and, when given, the training subsample loader; saves best_model.pth on a
+    new best validation IoU.
+    """
+
+    def __init__(self, trainer, val_loader, val_mask_store, tr_loader=None, tr_mask_store=None, empty_iou=1.0):
+        self.best_metric = -1
+        self.trainer = trainer
+        self._val_loader = val_loader
+        self._val_mask_store = val_mask_store
+        self._tr_loader = tr_loader
+        self._tr_mask_store = tr_mask_store
+        self._empty_iou = empty_iou
+        self._eval_seconds = 0.0
+        self._started_at = None
+
+    def before_train(self):
+        self._started_at = time.perf_counter()
+
+    def after_step(self):
+        next_iter = self.trainer.iter + 1
+        if next_iter % self.trainer.cfg.TEST.EVAL_PERIOD != 0 and next_iter != self.trainer.max_iter:
+            return
+
+        eval_start = time.perf_counter()
+        val_iou = inference_on_dataset(self.trainer.model, self._val_loader,
+                                       IOUEvaluator("validsemseg", self._val_mask_store, self._empty_iou))["sem_seg"]["IoU"]
+        self.trainer.storage.put_scalar("val_iou", val_iou)
+        print(f"[Iter {self.trainer.iter}] VAL IOU = {val_iou:.4f}")
+        if self._tr_loader is not None:
+            train_iou = inference_on_dataset(self.trainer.model, self._tr_loader,
+                                             IOUEvaluator("trainsemseg", self._tr_mask_store, self._empty_iou))["sem_seg"]["IoU"]
+            self.trainer.storage.put_scalar("train_iou", train_iou)
+            print(f"[Iter {self.trainer.iter}] TRAIN IOU = {train_iou:.4f}")
+
+        if val_iou > self.best_metric:
+            self.best_metric = val_iou
+            torch.save(self.trainer.model.state_dict(), os.path.join(self.trainer.cfg.OUTPUT_DIR, "best_model.pth"))
+
+        eval_seconds = time.perf_counter() - eval_start
+        self._eval_seconds += eval_seconds
+        elapsed = time.perf_counter() - self._started_at
+        print(f"[Iter {self.trainer.iter}] IoU eval took {eval_seconds:.1f}s "
+              f"({self._eval_seconds / elapsed:.1%} of wall-clock so far)")
@@ -0,0 +1,129 @@
+"""
+Precomputed semantic-mask store for training and IoU evaluation.
+
+The union of every annotation of an image is rasterized once (in parallel,
+one pycocotools merge + decode per image) and bit-packed into a single
+masks.bin file with a small JSON index, instead of one mask PNG per image
+that has to be re-encoded every session and decoded again by the evaluator.
+The store is rebuilt only when the source _annotations.coco.json changes;
+reads are zero-copy slices of a np.memmap.
+
+Layout of a store folder:
+    masks.bin          np.packbits(mask, axis=-1) rows of every image, concatenated
+    masks_index.json   {"source_hash", "images": {file_name: [offset, height, width]}}
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pycocotools import mask as mask_utils
+from tqdm import tqdm
+
+# --- CONFIGURATION ---
+MASKS_FILENAME = "masks.bin"
+MASK_INDEX_FILENAME = "masks_index.json"
+RASTERIZE_THREADS = 8
+# ----------------------------------------
+
+
+def _file_sha1(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _segmentation_rles(segmentation, height, width):
+    """Same conversion as COCO.annToRLE: polygons, uncompressed or compressed RLE."""
+    if isinstance(segmentation, list):
+        return mask_utils.frPyObjects(segmentation, height, width)
+    if isinstance(segmentation["counts"], list):
+        return [mask_utils.frPyObjects(segmentation, height, width)]
+    return [segmentation]
+
+
+def rasterize(annotations, height, width):
+    """Union of all annotation masks of one image as a (height, width) bool array."""
+    rles = [rle for ann in annotations for rle in _segmentation_rles(ann["segmentation"], height, width)]
+    if not rles:
+        return np.zeros((height, width), dtype=bool)
+    return mask_utils.decode(mask_utils.merge(rles)).astype(bool)
+
+
+def build_mask_store(annotations_path, store_dir, image_dir=None, threads=RASTERIZE_THREADS, force=False):
+    """
+    Rasterizes every image of a COCO file into store_dir, skipping the work
+    when the store was built from identical annotations. Images missing from
+    image_dir (when given) are left out. Returns the opened MaskStore.
+    """
+    source_hash = _file_sha1(annotations_path)
+    index_path = os.path.join(store_dir, MASK_INDEX_FILENAME)
+    if not force and os.path.isfile(index_path):
+        with open(index_path) as f:
+            if json.load(f).get("source_hash") == source_hash:
+                return MaskStore(store_dir)
+
+    with open(annotations_path) as f:
+        coco = json.load(f)
+    by_image = {}
+    for ann in coco.get("annotations", []):
+        by_image.setdefault(ann["image_id"], []).append(ann)
+    images = [img for img in coco["images"]
+              if image_dir is None or os.path.exists(os.path.join(image_dir, img["file_name"]))]
+
+    def pack(img):
+        mask = rasterize(by_image.get(img["id"], []), img["height"], img["width"])
+        return np.packbits(mask, axis=-1)
+
+    os.makedirs(store_dir, exist_ok=True)
+    entries = {}
+    offset = 0
+    with ThreadPoolExecutor(threads) as pool, open(os.path.join(store_dir, MASKS_FILENAME), "wb") as out:
+        packed_masks = pool.map(pack, images)
+        for img, packed in tqdm(zip(images, packed_masks), total=len(images), desc="Rasterizing masks", ncols=100):
+            out.write(packed.tobytes())
+            entries[img["file_name"]] = [offset, img["height"], img["width"]]
+            offset += packed.nbytes
+    # Index last: a crash mid-build leaves a stale hash, so the next call rebuilds
+    with open(index_path + ".tmp", "w") as f:
+        json.dump({"source_hash": source_hash, "images": entries}, f, separators=(",", ":"))
+    os.replace(index_path + ".tmp", index_path)
+    return MaskStore(store_dir)
+
+
+class MaskStore:
+    """Read-only view of a mask store folder through np.memmap."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, MASK_INDEX_FILENAME)) as f:
+            self._index = json.load(f)["images"]
+        self._data = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, file_name):
+        return file_name in self._index
+
+    def __getstate__(self):
+        # Data-loader workers re-open the memmap lazily
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def names(self):
+        return list(self._index)
+
+    def packed(self, file_name):
+        """Packed (height, ceil(width / 8)) uint8 rows of one mask (a memmap view, no copy)."""
+        if self._data is None:
+            path = os.path.join(self.store_dir, MASKS_FILENAME)
+            self._data = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.empty(0, np.uint8)
+        offset, height, width = self._index[file_name]
+        row_bytes = (width + 7) // 8
+        return self._data[offset:offset + height * row_bytes].reshape(height, row_bytes)
+
+    def get(self, file_name):
+        """(height, width) bool mask of one image."""
+        width = self._index[file_name][2]
+        return np.unpackbits(self.packed(file_name), axis=-1, count=width).astype(bool)
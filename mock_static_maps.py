@@ -0,0 +1,143 @@
+"""
+Local stand-in for the Google Static Maps `staticmap` endpoint.
+
+Serves a valid 640x640 PNG of configurable size with configurable latency,
+random 500/503 errors, a server-side QPS limit and periodic 429 bursts, so the
+fetcher can be benchmarked offline without an API key or quota:
+
+    python mock_static_maps.py
+    # then in city_tile_fetcher.py:
+    STATIC_MAPS_URL = "http://127.0.0.1:8765/maps/api/staticmap"
+"""
+import asyncio
+import random
+import struct
+import time
+import zlib
+from collections import Counter
+from aiohttp import web
+
+# --- CONFIGURATION ---
+HOST = "127.0.0.1"
+PORT = 8765
+LATENCY_MS = 80            # Mean response latency
+LATENCY_JITTER_MS = 40     # Uniform +/- jitter around LATENCY_MS
+ERROR_RATE = 0.01          # Fraction of requests answered with a random 500/503
+THROTTLE_QPS = None        # Requests above this rate get 429 (None = unlimited)
+BURST_429_EVERY_S = 0      # Every N seconds ...
+BURST_429_DURATION_S = 0   # ... answer everything with 429 for this long (0 = off)
+PAYLOAD_BYTES = 450_000    # Approximate PNG size (real satellite tiles are ~300-600 KB)
+TILE_SIZE_PX = 640
+# ----------------------------------------
+
+
+def make_png(width=TILE_SIZE_PX, height=TILE_SIZE_PX, target_bytes=PAYLOAD_BYTES, seed=0):
+    """Builds a valid RGB PNG of roughly target_bytes (noise rows + flat rows)."""
+    rng = random.Random(seed)
+    row_bytes = width * 3
+    # Noise rows are incompressible, flat rows compress to almost nothing
+    noise_rows = min(height, max(1, target_bytes // row_bytes))
+    raw = bytearray()
+    for y in range(height):
+        raw.append(0)  # filter type: None
+        raw += rng.randbytes(row_bytes) if y < noise_rows else bytes([90, 110, 80]) * width
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(bytes(raw), 1)) + chunk(b"IEND", b""))
+
+
+class MockStaticMapsServer:
+    """aiohttp server emulating the staticmap endpoint; counts what it served."""
+
+    def __init__(self, host=HOST, port=PORT, latency_ms=LATENCY_MS, latency_jitter_ms=LATENCY_JITTER_MS,
+                 error_rate=ERROR_RATE, throttle_qps=THROTTLE_QPS, burst_429_every_s=BURST_429_EVERY_S,
+                 burst_429_duration_s=BURST_429_DURATION_S, payload_bytes=PAYLOAD_BYTES, seed=0):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.throttle_qps = throttle_qps
+        self.burst_429_every_s = burst_429_every_s
+        self.burst_429_duration_s = burst_429_duration_s
+        self.payload = make_png(target_bytes=payload_bytes, seed=seed)
+        self.status_counts = Counter()
+        self._rng = random.Random(seed)
+        self._runner = None
+        self._started_at = None
+        self._tokens = 0.0
+        self._last_refill = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/maps/api/staticmap"
+
+    def _throttled(self, now):
+        if self.burst_429_every_s and self.burst_429_duration_s:
+            if (now - self._started_at) % self.burst_429_every_s < self.burst_429_duration_s:
+                return True
+        if self.throttle_qps:
+            self._tokens = min(self.throttle_qps, self._tokens + (now - self._last_refill) * self.throttle_qps)
+            self._last_refill = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+        return False
+
+    async def handle(self, request):
+        if "center" not in request.query:
+            self.status_counts[400] += 1
+            return web.Response(status=400, text="Missing center")
+        if self._throttled(time.monotonic()):
+            self.status_counts[429] += 1
+            return web.Response(status=429, text="Too Many Requests")
+
+        jitter = self._rng.uniform(-self.latency_jitter_ms, self.latency_jitter_ms)
+        await asyncio.sleep(max(0.0, self.latency_ms + jitter) / 1000)
+        if self._rng.random() < self.error_rate:
+            status = self._rng.choice((500, 503))
+            self.status_counts[status] += 1
+            return web.Response(status=status)
+        self.status_counts[200] += 1
+        return web.Response(body=self.payload, content_type="image/png")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/maps/api/staticmap", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._started_at = self._last_refill = time.monotonic()
+        self._tokens = float(self.throttle_qps or 0)
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+
+async def serve_forever():
+    async with MockStaticMapsServer() as server:
+        print(f"🛰️ Mock Static Maps serving {len(server.payload)} byte tiles at {server.url}")
+        print(f"   latency {LATENCY_MS}±{LATENCY_JITTER_MS} ms, error rate {ERROR_RATE}, "
+              f"throttle {THROTTLE_QPS} QPS, 429 bursts {BURST_429_DURATION_S}s every {BURST_429_EVERY_S}s")
+        while True:
+            await asyncio.sleep(3600)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,127 @@
+"""
+CPU deployment export of the fine-tuned Mask R-CNN for the heatmap stage.
+
+export_model() turns MODEL_WEIGHTS into one TorchScript file:
+- the model is built on CPU, optionally with every nn.Linear (the box head
+  fc layers and predictors, most of the ROI-head FLOPs) replaced by a
+  dynamic int8 version (torch.ao.quantization.quantize_dynamic); convolutions
+  stay fp32,
+- it is traced with detectron2's TracingAdapter on one real tile resized to
+  INPUT_SIZE x INPUT_SIZE (tiles are 640 px, the training config upsamples
+  them to 800), so the graph is specialised to that input size,
+- detections are kept down to CACHE_SCORE_FLOOR so the same file serves
+  cached and uncached runs,
+- input size, format, score floor and output field order are stored inside
+  the file (_extra_files), so loading needs nothing but the path.
+
+ExportedPredictor loads such a file and has BatchPredictor's interface
+(preprocess + __call__), so run_inference / the fused pipeline can use it in
+place of the eager model; benchmark_inference.py compares the variants on
+the test split.
+"""
+import json
+import os
+import torch
+import cv2
+from detectron2.checkpoint import DetectionCheckpointer
+from detectron2.export import TracingAdapter
+from detectron2.modeling import build_model
+from detectron2.modeling.postprocessing import detector_postprocess
+from detectron2.structures import Boxes, Instances
+import detectron2.data.transforms as T
+
+from detection_cache import caching_cfg
+
+# --- CONFIGURATION ---
+EXPORT_PATH = "./model_cpu.ts"
+# Square input side the model is traced (and run) at
+INPUT_SIZE = 640
+# Dynamic int8 quantization of the Linear layers
+QUANTIZE = True
+# Tile the model is traced on (should contain panels so every head runs)
+SAMPLE_TILE = "./test/1.png"
+META_FILE = "export.json"
+# ----------------------------------------
+
+
+def export_model(cfg, out_path=EXPORT_PATH, input_size=INPUT_SIZE, quantize=QUANTIZE, sample_tile=SAMPLE_TILE):
+    """Traces cfg's model (see module docstring) to out_path; returns the stored metadata."""
+    cfg = caching_cfg(cfg)
+    cfg.MODEL.DEVICE = "cpu"
+    model = build_model(cfg)
+    DetectionCheckpointer(model).load(cfg.MODEL.WEIGHTS)
+    model.eval()
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    bgr_image = cv2.imread(sample_tile)
+    if bgr_image is None:
+        raise FileNotFoundError(f"Cannot read sample tile '{sample_tile}'")
+    image = _to_tensor(bgr_image, T.Resize((input_size, input_size)), cfg.INPUT.FORMAT)
+
+    def inference(model, inputs):
+        # do_postprocess=False keeps ROI-sized masks; ExportedPredictor pastes them
+        return [{"instances": model.inference(inputs, do_postprocess=False)[0]}]
+
+    adapter = TracingAdapter(model, [{"image": image}], inference)
+    with torch.no_grad():
+        sample = inference(model, [{"image": image}])[0]["instances"]
+        traced = torch.jit.trace(adapter, (image,))
+    meta = {
+        "input_size": input_size,
+        "input_format": cfg.INPUT.FORMAT,
+        "quantized": bool(quantize),
+        "score_floor": cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST,
+        # TracingAdapter flattens Instances fields in sorted order, then image_size
+        "fields": sorted(sample.get_fields()),
+    }
+    out_dir = os.path.dirname(out_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    torch.jit.save(traced, out_path, _extra_files={META_FILE: json.dumps(meta)})
+    print(f"📦 Exported {'int8' if quantize else 'fp32'} model at {input_size} px to '{out_path}' "
+          f"({os.path.getsize(out_path) / 1e6:.0f} MB)")
+    return meta
+
+
+def _to_tensor(bgr_image, resize, input_format):
+    image = bgr_image[:, :, ::-1] if input_format == "RGB" else bgr_image
+    image = resize.get_transform(image).apply_image(image)
+    return torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+
+
+class ExportedPredictor:
+    """BatchPredictor stand-in running a file written by export_model() on CPU."""
+
+    def __init__(self, path, score_thresh=None):
+        extra_files = {META_FILE: ""}
+        self.model = torch.jit.load(path, map_location="cpu", _extra_files=extra_files)
+        self.meta = json.loads(extra_files[META_FILE])
+        self.input_format = self.meta["input_format"]
+        self.aug = T.Resize((self.meta["input_size"], self.meta["input_size"]))
+        self.score_thresh = score_thresh
+        if score_thresh is not None and score_thresh < self.meta["score_floor"]:
+            print(f"⚠️ '{path}' keeps detections down to {self.meta['score_floor']}, "
+                  f"above the requested threshold {score_thresh}")
+
+    def preprocess(self, bgr_image):
+        """Resizes to the traced input size; safe to call from decode threads."""
+        height, width = bgr_image.shape[:2]
+        return {"image": _to_tensor(bgr_image, self.aug, self.input_format), "height": height, "width": width}
+
+    def __call__(self, inputs):
+        outputs = []
+        with torch.no_grad():
+            for model_input in inputs:
+                flat = self.model(model_input["image"])
+                outputs.append({"instances": self._instances(flat, model_input["height"], model_input["width"])})
+        return outputs
+
+    def _instances(self, flat, height, width):
+        """Rebuilds Instances from the traced outputs and pastes masks at the tile's size."""
+        instances = Instances(tuple(int(v) for v in flat[-1]))
+        for name, value in zip(self.meta["fields"], flat[:-1]):
+            instances.set(name, Boxes(value) if name == "pred_boxes" else value)
+        if self.score_thresh is not None:
+            instances = instances[instances.scores >= self.score_thresh]
+        return detector_postprocess(instances, height, width)
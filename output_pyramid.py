@@ -0,0 +1,180 @@
+"""
+Multi-resolution detection output shared by every surveyed city.
+
+Per-tile detections are aggregated into Web-Mercator z/x/y cells at every
+level of PYRAMID_ZOOMS (256 px slippy-map cells, so they line up with any web
+basemap) and stored in one SQLite file, one row per (city, z, x, y):
+    tiles      detection tiles surveyed in the cell
+    positive   tiles with at least one panel
+    panels     panels detected
+    area_km2   ground area surveyed (tiles x tile footprint)
+A viewer or downstream query reads one level over the visible bounds instead
+of every tile point; several cities are summed on read.
+"""
+import os
+import sqlite3
+import time
+import numpy as np
+from tile_grid import latlon_to_pixel, pixel_to_latlon, MERCATOR_BASE_TILE_PX, DEFAULT_ZOOM, DEFAULT_TILE_SIZE_PX
+
+# --- CONFIGURATION ---
+PYRAMID_ZOOMS = tuple(range(8, 18))
+# Most cells a map view asks for; view_level() picks the finest level under it
+MAX_VIEW_CELLS = 5000
+# ----------------------------------------
+
+# Web-Mercator world width in meters
+_WORLD_M = 2 * 20037508.342789244
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cells (
+    city     TEXT NOT NULL,
+    z        INTEGER NOT NULL,
+    x        INTEGER NOT NULL,
+    y        INTEGER NOT NULL,
+    tiles    INTEGER NOT NULL,
+    positive INTEGER NOT NULL,
+    panels   INTEGER NOT NULL,
+    area_km2 REAL NOT NULL,
+    PRIMARY KEY (city, z, x, y)
+);
+CREATE INDEX IF NOT EXISTS idx_cells_zxy ON cells (z, x, y);
+CREATE TABLE IF NOT EXISTS cities (
+    city       TEXT PRIMARY KEY,
+    tiles      INTEGER NOT NULL,
+    panels     INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def tile_area_km2(lats, zoom=DEFAULT_ZOOM, tile_size_px=DEFAULT_TILE_SIZE_PX):
+    """Ground area of detection tiles centred at lats (Web-Mercator scale shrinks with cos(lat))."""
+    meters_per_px = _WORLD_M / (MERCATOR_BASE_TILE_PX * 2.0**zoom) * np.cos(np.radians(lats))
+    return (tile_size_px * meters_per_px) ** 2 / 1e6
+
+
+def aggregate_level(lats, lons, panels, areas, z):
+    """
+    Sums tiles into the z/x/y cells of one level (vectorized). Returns
+    (x, y, tiles, positive, panels, area_km2) arrays, one entry per occupied cell.
+    """
+    px, py = latlon_to_pixel(lats, lons, z)
+    x = np.floor(px / MERCATOR_BASE_TILE_PX).astype(np.int64)
+    y = np.floor(py / MERCATOR_BASE_TILE_PX).astype(np.int64)
+    keys, inverse = np.unique((x << 32) | y, return_inverse=True)
+    return (keys >> 32, keys & 0xFFFFFFFF,
+            np.bincount(inverse, minlength=len(keys)),
+            np.bincount(inverse, weights=panels > 0, minlength=len(keys)).astype(np.int64),
+            np.bincount(inverse, weights=panels, minlength=len(keys)).astype(np.int64),
+            np.bincount(inverse, weights=areas, minlength=len(keys)))
+
+
+def cell_bounds(z, x, y):
+    """(south, west, north, east) of z/x/y cells (vectorized)."""
+    north, west = pixel_to_latlon(np.asarray(x) * MERCATOR_BASE_TILE_PX, np.asarray(y) * MERCATOR_BASE_TILE_PX, z)
+    south, east = pixel_to_latlon((np.asarray(x) + 1) * MERCATOR_BASE_TILE_PX, (np.asarray(y) + 1) * MERCATOR_BASE_TILE_PX, z)
+    return south, west, north, east
+
+
+def view_level(bounds, max_cells=MAX_VIEW_CELLS, zooms=PYRAMID_ZOOMS):
+    """Finest pyramid level at which (south, west, north, east) spans at most max_cells cells."""
+    south, west, north, east = bounds
+    for z in sorted(zooms, reverse=True):
+        x0, y0 = latlon_to_pixel(north, west, z)
+        x1, y1 = latlon_to_pixel(south, east, z)
+        span = ((x1 - x0) // MERCATOR_BASE_TILE_PX + 1) * ((y1 - y0) // MERCATOR_BASE_TILE_PX + 1)
+        if span <= max_cells:
+            return z
+    return min(zooms)
+
+
+class OutputPyramid:
+    """SQLite-backed per-city cell pyramid (see module docstring)."""
+
+    def __init__(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def write_city(self, city, lats, lons, panels, zoom=DEFAULT_ZOOM, tile_size_px=DEFAULT_TILE_SIZE_PX,
+                   zooms=PYRAMID_ZOOMS):
+        """Replaces every level of one city with the given per-tile panel counts; returns the cell count."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        panels = np.asarray(panels, dtype=np.int64)
+        areas = tile_area_km2(lats, zoom, tile_size_px)
+        rows = []
+        for z in zooms:
+            x, y, tiles, positive, counts, area = aggregate_level(lats, lons, panels, areas, z)
+            rows.extend(zip([city] * len(x), [z] * len(x), x.tolist(), y.tolist(), tiles.tolist(),
+                            positive.tolist(), counts.tolist(), area.tolist()))
+        with self._conn:
+            self._conn.execute("DELETE FROM cells WHERE city = ?", (city,))
+            self._conn.executemany("INSERT INTO cells VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.execute("INSERT OR REPLACE INTO cities VALUES (?, ?, ?, ?)",
+                               (city, len(lats), int(panels.sum()), time.time()))
+        return len(rows)
+
+    def cities(self):
+        """Returns {city: (tiles, panels)}."""
+        return {city: (tiles, panels) for city, tiles, panels in
+                self._conn.execute("SELECT city, tiles, panels FROM cities ORDER BY city")}
+
+    def query(self, z, bounds=None, cities=None):
+        """
+        Cells of level z inside (south, west, north, east) bounds, summed over
+        cities (all of them by default). Returns a dict of NumPy arrays
+        x, y, tiles, positive, panels, area_km2 (one indexed range read).
+        """
+        sql = "SELECT x, y, SUM(tiles), SUM(positive), SUM(panels), SUM(area_km2) FROM cells WHERE z = ?"
+        params = [z]
+        if bounds is not None:
+            south, west, north, east = bounds
+            x0, y0 = latlon_to_pixel(north, west, z)
+            x1, y1 = latlon_to_pixel(south, east, z)
+            sql += " AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?"
+            params += [int(x0 // MERCATOR_BASE_TILE_PX), int(x1 // MERCATOR_BASE_TILE_PX),
+                       int(y0 // MERCATOR_BASE_TILE_PX), int(y1 // MERCATOR_BASE_TILE_PX)]
+        if cities is not None:
+            sql += f" AND city IN ({','.join('?' * len(cities))})"
+            params += list(cities)
+        rows = self._conn.execute(sql + " GROUP BY x, y", params).fetchall()
+        arr = np.asarray(rows, dtype=np.float64).reshape(-1, 6)
+        return {"x": arr[:, 0].astype(np.int64), "y": arr[:, 1].astype(np.int64),
+                "tiles": arr[:, 2].astype(np.int64), "positive": arr[:, 3].astype(np.int64),
+                "panels": arr[:, 4].astype(np.int64), "area_km2": arr[:, 5]}
+
+    def geojson(self, z, bounds=None, cities=None, min_panels=1):
+        """Cells of one level as a GeoJSON FeatureCollection of boxes (e.g. for folium.GeoJson)."""
+        cells = self.query(z, bounds, cities)
+        keep = cells["panels"] >= min_panels
+        cells = {name: values[keep] for name, values in cells.items()}
+        south, west, north, east = cell_bounds(z, cells["x"], cells["y"])
+        features = []
+        for i in range(len(cells["x"])):
+            ring = [[west[i], south[i]], [east[i], south[i]], [east[i], north[i]], [west[i], north[i]], [west[i], south[i]]]
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Polygon", "coordinates": [ring]},
+                "properties": {"z": z, "x": int(cells["x"][i]), "y": int(cells["y"][i]),
+                               "tiles": int(cells["tiles"][i]), "positive": int(cells["positive"][i]),
+                               "panels": int(cells["panels"][i]), "area_km2": round(float(cells["area_km2"][i]), 4),
+                               "panels_per_km2": round(float(cells["panels"][i] / cells["area_km2"][i]), 2)},
+            })
+        return {"type": "FeatureCollection", "features": features}
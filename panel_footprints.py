@@ -0,0 +1,285 @@
+"""
+Geo-referenced panel footprints: detection masks kept as lat/lon polygons.
+
+Per-tile counts answer "how many panels near this tile centre", but not "how
+much PV area is in ward X" or "which buildings have panels". Here every
+predicted mask is kept as a polygon:
+- during inference, FootprintLog stores each tile's mask contours in pixel
+  coordinates (SQLite shared by worker processes; the inference loops
+  commit it before writing each batch's result rows, so every tile in the
+  results CSV has its polygons and a crash or re-run resumes like the CSV).
+  Contours are kept down to the model's score threshold (CACHE_SCORE_FLOOR
+  while caching) and tagged with the tile's content hash, so cached tiles
+  reuse them,
+- build_footprints() geo-references them: a Static Maps tile is centred on
+  its lat/lon and one image pixel is one Web-Mercator pixel at ZOOM (the
+  meters_per_pixel of compute_tile_steps), so pixel offsets from the centre
+  map exactly through latlon_to_pixel / pixel_to_latlon. Pieces of one panel
+  cut by a tile border (or seen twice where index-grid tiles overlap) are
+  merged, areas are measured in the local UTM zone, and the panels are
+  written to GeoParquet in Hilbert order with bbox covering columns,
+- PanelFootprints loads the file (optionally only the row groups inside a
+  bbox) with an STRtree, so polygon-in-region queries and sums over a whole
+  city take milliseconds.
+"""
+import os
+import sqlite3
+import time
+import numpy as np
+import cv2
+import shapely
+from tile_grid import latlon_to_pixel, pixel_to_latlon, DEFAULT_ZOOM
+
+# --- CONFIGURATION ---
+# Douglas-Peucker tolerance applied to mask contours
+SIMPLIFY_PX = 1.0
+# Mask pieces smaller than this are noise
+MIN_PANEL_PX = 12
+# Pieces from different tiles closer than this are one panel
+MERGE_GAP_M = 0.3
+# Panels per GeoParquet row group (the unit a bbox read skips)
+ROW_GROUP_ROWS = 20_000
+# Tiles buffered before a commit (callers also commit per batch of result rows)
+COMMIT_EVERY = 200
+# ----------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    tile_id      INTEGER PRIMARY KEY,
+    content_hash TEXT,
+    width        INTEGER NOT NULL,
+    height       INTEGER NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tiles_hash ON tiles (content_hash);
+CREATE TABLE IF NOT EXISTS panels (
+    tile_id INTEGER NOT NULL,
+    score   REAL NOT NULL,
+    polygon BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_panels_tile ON panels (tile_id);
+"""
+
+
+def mask_polygons(mask, simplify_px=SIMPLIFY_PX, min_area_px=MIN_PANEL_PX):
+    """Outer contours of a binary mask as shapely polygons in pixel coordinates."""
+    contours, _ = cv2.findContours(np.ascontiguousarray(mask, dtype=np.uint8), cv2.RETR_EXTERNAL,
+                                   cv2.CHAIN_APPROX_SIMPLE)
+    polygons = []
+    for contour in contours:
+        if cv2.contourArea(contour) < min_area_px:
+            continue
+        ring = cv2.approxPolyDP(contour, simplify_px, True).reshape(-1, 2)
+        if len(ring) >= 3:
+            polygons.append(shapely.Polygon(ring))
+    return polygons
+
+
+class FootprintLog:
+    """SQLite-backed tile_id -> pixel-space mask polygons written during inference."""
+
+    def __init__(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        # Worker processes share the file; wait for each other's commits
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+    # --- Writes ---
+    def put(self, tile_id, content_hash, instances):
+        """Replaces the polygons of one tile with those of a Detectron2 Instances (masks + scores)."""
+        height, width = instances.image_size
+        rows = []
+        if len(instances):
+            masks = instances.pred_masks.cpu().numpy()
+            for score, mask in zip(instances.scores.cpu().numpy().tolist(), masks):
+                rows.extend((int(tile_id), score, shapely.to_wkb(polygon)) for polygon in mask_polygons(mask))
+        self._conn.execute("DELETE FROM panels WHERE tile_id = ?", (int(tile_id),))
+        self._conn.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?)",
+                           (int(tile_id), content_hash, width, height, time.time()))
+        self._conn.executemany("INSERT INTO panels VALUES (?, ?, ?)", rows)
+        self._tick()
+
+    def reuse(self, tile_id, content_hash):
+        """
+        Gives a cached tile the polygons logged for the same content; returns
+        False when nothing was logged for it (the tile then needs the model).
+        """
+        row = self._conn.execute("SELECT tile_id FROM tiles WHERE content_hash = ? ORDER BY tile_id != ? LIMIT 1",
+                                 (content_hash, int(tile_id))).fetchone()
+        if row is None:
+            return False
+        if row[0] != int(tile_id):
+            self._conn.execute("DELETE FROM panels WHERE tile_id = ?", (int(tile_id),))
+            self._conn.execute("INSERT OR REPLACE INTO tiles SELECT ?, content_hash, width, height, ? FROM tiles "
+                               "WHERE tile_id = ?", (int(tile_id), time.time(), row[0]))
+            self._conn.execute("INSERT INTO panels SELECT ?, score, polygon FROM panels WHERE tile_id = ?",
+                               (int(tile_id), row[0]))
+            self._tick()
+        return True
+
+    def _tick(self):
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        """Makes the logged polygons durable; call before writing the matching result rows."""
+        self._conn.commit()
+        self._pending = 0
+
+    # --- Reads ---
+    def hashes(self):
+        """Set of content hashes with logged polygons (one indexed read)."""
+        cur = self._conn.execute("SELECT DISTINCT content_hash FROM tiles WHERE content_hash IS NOT NULL")
+        return {row[0] for row in cur}
+
+    def panels(self, score_thresh=0.0):
+        """Returns (tile_ids, scores, pixel polygons, widths, heights) arrays of panels at or above score_thresh."""
+        rows = self._conn.execute(
+            "SELECT p.tile_id, p.score, p.polygon, t.width, t.height FROM panels p JOIN tiles t USING (tile_id) "
+            "WHERE p.score >= ?", (score_thresh,)
+        ).fetchall()
+        if not rows:
+            return np.empty(0, np.int64), np.empty(0), np.empty(0, object), np.empty(0), np.empty(0)
+        tile_ids, scores, blobs, widths, heights = zip(*rows)
+        return (np.asarray(tile_ids, np.int64), np.asarray(scores), shapely.from_wkb(list(blobs)),
+                np.asarray(widths, np.float64), np.asarray(heights, np.float64))
+
+
+def georeference(polygons, lats, lons, widths, heights, zoom=DEFAULT_ZOOM):
+    """Pixel polygons of tiles centred at lats/lons -> lon/lat polygons (vectorized over all vertices)."""
+    coords, owner = shapely.get_coordinates(polygons, return_index=True)
+    cx, cy = latlon_to_pixel(lats, lons, zoom)
+    px = cx[owner] - widths[owner] / 2 + coords[:, 0]
+    py = cy[owner] - heights[owner] / 2 + coords[:, 1]
+    lat, lon = pixel_to_latlon(px, py, zoom)
+    return shapely.set_coordinates(np.array(polygons, dtype=object), np.column_stack([lon, lat]))
+
+
+def _components(n, left, right):
+    """Connected-component label per item from (left, right) pairs (union-find)."""
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in zip(left.tolist(), right.tolist()):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+    return np.array([find(i) for i in range(n)])
+
+
+def merge_across_tiles(gdf, gap_m=MERGE_GAP_M):
+    """
+    Unions pieces from different tiles that touch or overlap (within gap_m);
+    pieces of the same tile are separate instances and stay apart. Returns a
+    GeoDataFrame in gdf's metric CRS with score (max), tiles and area_m2.
+    """
+    import geopandas as gpd
+    geoms = shapely.make_valid(gdf.geometry.values)
+    left, right = gpd.GeoSeries(geoms, crs=gdf.crs).sindex.query(shapely.buffer(geoms, gap_m), predicate="intersects")
+    tile_ids = gdf["tile_id"].to_numpy()
+    across = (left < right) & (tile_ids[left] != tile_ids[right])
+    labels = _components(len(gdf), left[across], right[across])
+
+    all_scores = gdf["score"].to_numpy()
+    order = np.argsort(labels, kind="stable")
+    starts = np.flatnonzero(np.r_[True, labels[order][1:] != labels[order][:-1]])
+    merged, scores, tiles, first_tile = [], [], [], []
+    for group in np.split(order, starts[1:]):
+        if len(group) == 1:
+            merged.append(geoms[group[0]])
+        else:
+            # Closing by the gap bridges the seam left between the two tiles
+            merged.append(shapely.union_all(geoms[group]).buffer(gap_m, join_style="mitre").buffer(-gap_m, join_style="mitre"))
+        scores.append(all_scores[group].max())
+        tiles.append(len(np.unique(tile_ids[group])))
+        first_tile.append(tile_ids[group].min())
+    merged = np.array(merged, dtype=object)
+    return gpd.GeoDataFrame({"tile_id": first_tile, "score": scores, "tiles": tiles, "area_m2": shapely.area(merged)},
+                            geometry=merged, crs=gdf.crs)
+
+
+def build_footprints(log_path, centers, out_path, zoom=DEFAULT_ZOOM, score_thresh=0.5, merge_gap_m=MERGE_GAP_M):
+    """
+    Geo-references the logged panels of the tiles in centers ({tile_id: (lat,
+    lon)}), merges pieces split across tiles and writes them to out_path as
+    GeoParquet (EPSG:4326, Hilbert-ordered, bbox covering columns).
+    Returns the GeoDataFrame.
+    """
+    import geopandas as gpd
+    with FootprintLog(log_path) as log:
+        tile_ids, scores, polygons, widths, heights = log.panels(score_thresh)
+    known = np.array([tile_id in centers for tile_id in tile_ids.tolist()], dtype=bool)
+    tile_ids, scores, polygons, widths, heights = (a[known] for a in (tile_ids, scores, polygons, widths, heights))
+    lats, lons = np.array([centers[tile_id] for tile_id in tile_ids.tolist()], dtype=np.float64).reshape(-1, 2).T
+    geoms = georeference(polygons, lats, lons, widths, heights, zoom)
+    gdf = gpd.GeoDataFrame({"tile_id": tile_ids, "score": scores}, geometry=geoms, crs="EPSG:4326")
+    if len(gdf):
+        gdf = merge_across_tiles(gdf.to_crs(gdf.estimate_utm_crs()), merge_gap_m).to_crs("EPSG:4326")
+        gdf = gdf.iloc[np.argsort(gdf.hilbert_distance().to_numpy(), kind="stable")].reset_index(drop=True)
+    else:
+        gdf["tiles"], gdf["area_m2"] = np.empty(0, np.int64), np.empty(0)
+    folder = os.path.dirname(out_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    gdf.to_parquet(out_path, write_covering_bbox=True, row_group_size=ROW_GROUP_ROWS)
+    return gdf
+
+
+class PanelFootprints:
+    """Panel polygons from a build_footprints() GeoParquet file, with an STRtree for region queries."""
+
+    def __init__(self, path, bounds=None):
+        """bounds=(minx, miny, maxx, maxy) in lon/lat only reads the row groups overlapping it."""
+        import geopandas as gpd
+        self.gdf = gpd.read_parquet(path, bbox=bounds) if bounds is not None else gpd.read_parquet(path)
+        # Built now, so the first query does not pay for it
+        self.sindex = self.gdf.sindex
+
+    def __len__(self):
+        return len(self.gdf)
+
+    def query(self, region):
+        """Panels intersecting a lon/lat shapely geometry."""
+        return self.gdf.iloc[np.sort(self.sindex.query(region, predicate="intersects"))]
+
+    def area_m2(self, region):
+        """Panel area inside region; panels crossing its edge count with their inside share."""
+        panels = self.query(region)
+        geoms = panels.geometry.values
+        shapely.prepare(region)
+        inside = shapely.contains(region, geoms)
+        areas = panels["area_m2"].to_numpy()
+        partial = ~inside
+        share = shapely.area(shapely.intersection(geoms[partial], region)) / np.maximum(shapely.area(geoms[partial]), 1e-18)
+        return float(areas[inside].sum() + (areas[partial] * share).sum())
+
+    def buildings(self, buildings):
+        """Rows of a buildings GeoDataFrame that carry panels, with panel count and area."""
+        import geopandas as gpd
+        joined = gpd.sjoin(buildings.to_crs(self.gdf.crs), self.gdf[["area_m2", "geometry"]], predicate="intersects")
+        stats = joined.groupby(level=0).agg(panels=("area_m2", "size"), panel_area_m2=("area_m2", "sum"))
+        return buildings.join(stats, how="inner")
@@ -0,0 +1,132 @@
+"""
+Shared adaptive rate / concurrency controller for the async tile fetcher.
+
+A token bucket caps the global request rate (QPS) and an AIMD loop tunes both
+the rate and the number of in-flight requests from server feedback: every 200
+nudges them up additively, and a 429/503 (or a timeout) halves them for all
+workers at once, instead of each task backing off on its own while the rest
+keep hitting the API. Growth starts TCP-style (slow start) until the first
+throttle, then stays additive.
+"""
+import asyncio
+import time
+
+# --- CONFIGURATION ---
+# Statuses that mean "slow down" for everyone
+CONGESTION_STATUSES = (429, 503)
+# Additive increase per second of successful traffic
+QPS_INCREASE = 1.0
+CONCURRENCY_INCREASE = 1.0
+# Multiplicative decrease on congestion
+DECREASE_FACTOR = 0.5
+# Minimum seconds between two decreases (one throttle burst = one decrease)
+DECREASE_COOLDOWN = 1.0
+# ----------------------------------------
+
+
+class AdaptiveRateController:
+    """Token bucket + AIMD concurrency limit shared by every download task."""
+
+    def __init__(self, initial_qps, max_qps, initial_concurrency, max_concurrency,
+                 min_qps=0.5, min_concurrency=1, burst=None):
+        self.qps = float(initial_qps)
+        self.max_qps = float(max_qps)
+        self.min_qps = float(min_qps)
+        self.concurrency = float(initial_concurrency)
+        self.max_concurrency = float(max_concurrency)
+        self.min_concurrency = float(min_concurrency)
+        self.burst = burst if burst is not None else max(1, int(initial_concurrency))
+
+        self._slots = asyncio.Condition()
+        self._in_flight = 0
+        self._next_slot = 0.0        # Earliest start time of the next request
+        self._last_decrease = 0.0
+        self._started_at = None
+
+        self.requests = 0
+        self.successes = 0
+        self.congestion_events = 0
+        self.decreases = 0
+        self.peak_qps = self.qps
+        self.peak_concurrency = self.concurrency
+
+    def _limit(self):
+        return max(1, int(self.concurrency))
+
+    async def acquire(self):
+        """Waits for an in-flight slot under the current limit and for the next token."""
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_flight < self._limit())
+            self._in_flight += 1
+
+        now = time.monotonic()
+        if self._started_at is None:
+            self._started_at = now
+        # Reserve the next token; idle time accrues up to `burst` tokens
+        start = max(self._next_slot, now - (self.burst - 1) / self.qps)
+        self._next_slot = start + 1.0 / self.qps
+        self.requests += 1
+        if start > now:
+            try:
+                await asyncio.sleep(start - now)
+            except asyncio.CancelledError:
+                # Cancelled before sending (shutdown, quota stop): the slot must not stay taken
+                self.requests -= 1
+                await asyncio.shield(self._free_slot())
+                raise
+
+    async def release(self, status):
+        """
+        Frees the slot and feeds back the outcome: an HTTP status, or None when
+        no response arrived (timeout / connection error).
+        """
+        if status is None or status in CONGESTION_STATUSES:
+            self._on_congestion()
+        elif status == 200:
+            self._on_success()
+        await self._free_slot()
+
+    async def _free_slot(self):
+        async with self._slots:
+            self._in_flight -= 1
+            self._slots.notify_all()
+
+    def _on_success(self):
+        self.successes += 1
+        if self.decreases == 0:
+            # Slow start: until the first throttle, grow by one unit per success
+            # (rate roughly doubles every second)
+            self.qps = min(self.max_qps, self.qps + QPS_INCREASE)
+            self.concurrency = min(self.max_concurrency, self.concurrency + CONCURRENCY_INCREASE)
+        else:
+            # +QPS_INCREASE per ~qps successes, i.e. roughly per second of traffic
+            self.qps = min(self.max_qps, self.qps + QPS_INCREASE / self.qps)
+            self.concurrency = min(self.max_concurrency, self.concurrency + CONCURRENCY_INCREASE / self.concurrency)
+        self.peak_qps = max(self.peak_qps, self.qps)
+        self.peak_concurrency = max(self.peak_concurrency, self.concurrency)
+
+    def _on_congestion(self):
+        self.congestion_events += 1
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.qps = max(self.min_qps, self.qps * DECREASE_FACTOR)
+        self.concurrency = max(self.min_concurrency, self.concurrency * DECREASE_FACTOR)
+        # Push back the shared schedule so already-queued tasks slow down too
+        self._next_slot = max(self._next_slot, now + 1.0 / self.qps)
+
+    def summary(self):
+        """Returns the settled rate/concurrency and feedback counters."""
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "qps": self.qps,
+            "concurrency": self._limit(),
+            "achieved_qps": self.requests / elapsed if elapsed > 0 else 0.0,
+            "peak_qps": self.peak_qps,
+            "peak_concurrency": int(self.peak_concurrency),
+            "requests": self.requests,
+            "congestion_events": self.congestion_events,
+            "decreases": self.decreases,
+        }
@@ -1,199 +1,178 @@
-import os
-import pathlib
+"""
+Builds the train / valid / test COCO splits from the labelled source folders
+next to this script (every folder with a COCO *.json, except the outputs).
+
+- annotations are indexed by image_id once per source instead of rescanning
+  the whole list for every image,
+- each source image is assigned to a split by a seeded hash of its path, so
+  the assignment does not depend on folder order and never changes when new
+  folders are added; assignments and output ids are kept in SPLIT_INDEX,
+- re-runs only link/copy images that are not in the outputs yet (hardlinks
+  where possible, in parallel), drop images whose source disappeared, and
+  rewrite the compact COCO JSON files.
+PNGs without an entry in their folder's JSON are added as unlabelled images.
+"""
+import hashlib
 import json
+import os
 import shutil
-import random
-import sys
-random.seed(42)
-rootdir = os.path.dirname(__file__)
-l = os.listdir(rootdir)
-dirlist = []
-tspth = os.path.join(rootdir, 'test')
-trpth = os.path.join(rootdir, 'train')
-vldpth = os.path.join(rootdir, 'valid')
-try:
-    shutil.rmtree(trpth)
-except Exception as e:
-    print(e)
-try:
-    shutil.rmtree(tspth)
-except Exception as e:
-    print(e)
-try:
-    shutil.rmtree(vldpth)
-except Exception as e:
-    print(e)
-for i in l:
-    if(os.path.isdir(os.path.join(rootdir, i))):
-        dirlist.append(os.path.join(rootdir, i))
-try:
-    os.mkdir(trpth)
-except Exception as e:
-    print(e)
-try:
-    os.mkdir(tspth)
-except Exception as e:
-    print(e)
-try:
-    os.mkdir(vldpth)
-except Exception as e:
-    print(e)
-annodic = {}
-imgdic = {}
-tsglcount = 1
-tsglcount2 = 0
-trglcount = 1
-trglcount2 = 0
-vldglcount = 1
-vldglcount2 = 0
-tsout = {
-    'info' : {
-         "description": "my-project-name"
-    },
-    "categories": [
-        {
-            "id": 1,
-            "name": "solarpv"
-        }
-    ],
-    'images' : [
-
-    ],
-    'annotations':[
-
-    ]
-}
-trout = {
-    'info' : {
-         "description": "my-project-name"
-    },
-    "categories": [
-        {
-            "id": 1,
-            "name": "solarpv"
-        }
-    ],
-    'images' : [
-
-    ],
-    'annotations':[
-
-    ]
-}
-vldout = {
-    'info' : {
-         "description": "my-project-name"
-    },
-    "categories": [
-        {
-            "id": 1,
-            "name": "solarpv"
-        }
-    ],
-    'images' : [
-
-    ],
-    'annotations':[
-
-    ]
-}
-for i in dirlist:
-    if i[-4:] == '.git':
-        continue
-    for subdir, dirs, files in os.walk(i):
-        for file in files:
-            if file[-4:] == 'json':
-                annodic[i] = os.path.join(i, file)
-    f = open(annodic[i])
-    data = json.load(f)
-    f.close()
-    imgdic[i] = {}
-    count = 1
-    added = []
-    for j in data['images']:
-        imgdic[i][j['id']] = os.path.join(i, j['file_name'])
-        added.append(j['file_name'])
-        count += 1
-    for subdir, dirs, files in os.walk(i):
-        for file in files:
-            if file[-3:] == 'png':
-                if file in added:
-                    continue
-                imgdic[i][count] = os.path.join(i, file)
-                count += 1
-    for i, j in imgdic[i].items():
-        ch = random.choices(population=['tr', 'vld', 'ts'], weights= [0.8, 0.1,0.1])[0]
-        if ch == 'ts':
-            img = {
-                "id": tsglcount,
-                "width": 640,
-                "height": 640,
-                "file_name": str(tsglcount) + '.png'
-            }
-            shutil.copy(j, os.path.join(tspth, str(tsglcount) + '.png'))
-            for k in data['annotations']:
-                if k['image_id'] == i:
-                    ann = k.copy()
-                    ann['id'] = tsglcount2
-                    tsglcount2 += 1
-                    ann['image_id'] = tsglcount
-                    tsout['annotations'].append(ann.copy())
-            tsout['images'].append(img)
-            tsglcount += 1
-        elif ch == 'tr':
-            img = {
-                "id": trglcount,
-                "width": 640,
-                "height": 640,
-                "file_name": str(trglcount) + '.png'
-            }
-            
-            shutil.copy(j, os.path.join(trpth, str(trglcount) + '.png'))
-            for k in data['annotations']:
-                if k['image_id'] == i:
-                    ann = k.copy()
-                    ann['id'] = trglcount2
-                    trglcount2 += 1
-                    ann['image_id'] = trglcount
-                    trout['annotations'].append(ann.copy())
-            trout['images'].append(img)
-            # if(trglcount == 662):
-            #     print(j)
-            #     sys.exit()
-            trglcount += 1
-        elif ch == 'vld':
-            img = {
-                "id": vldglcount,
-                "width": 640,
-                "height": 640,
-                "file_name": str(vldglcount) + '.png'
-            }
-            shutil.copy(j, os.path.join(vldpth, str(vldglcount) + '.png'))
-            for k in data['annotations']:
-                if k['image_id'] == i:
-                    ann = k.copy()
-                    ann['id'] = vldglcount2
-                    vldglcount2 += 1
-                    ann['image_id'] = vldglcount
-                    vldout['annotations'].append(ann.copy())
-            vldout['images'].append(img)
-            vldglcount += 1
-            
-with open(os.path.join(trpth, '_annotations.coco.json'), 'w') as f:
-    f.write(json.dumps(trout, indent = 6))
-with open(os.path.join(tspth, '_annotations.coco.json'), 'w') as f:
-    f.write(json.dumps(tsout, indent = 6))
-with open(os.path.join(vldpth, '_annotations.coco.json'), 'w') as f:
-    f.write(json.dumps(vldout, indent = 6))
-
-
-
-
-        
-
-
-    
-
-    
-    
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+# --- CONFIGURATION ---
+SEED = 42
+SPLITS = {"train": 0.8, "valid": 0.1, "test": 0.1}
+ANNOTATIONS_FILENAME = "_annotations.coco.json"
+SPLIT_INDEX = "split_index.json"
+LINK_WORKERS = 16
+SKIP_DIRS = {".git", "__pycache__"}
+CATEGORIES = [{"id": 1, "name": "solarpv"}]
+DEFAULT_SIZE_PX = 640
+# ----------------------------------------
+
+ROOTDIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def split_for(key, seed=SEED, splits=SPLITS):
+    """Seeded, order-independent split of one source image (stable as sources are added)."""
+    u = int(hashlib.sha1(f"{seed}:{key}".encode()).hexdigest(), 16) / 16**40
+    total = sum(splits.values())
+    cumulative = 0.0
+    for name, weight in splits.items():
+        cumulative += weight / total
+        if u < cumulative:
+            return name
+    return name
+
+
+def find_sources(rootdir):
+    """Returns {source_dir: coco_json_path} for every labelled top-level folder."""
+    sources = {}
+    for name in sorted(os.listdir(rootdir)):
+        path = os.path.join(rootdir, name)
+        if not os.path.isdir(path) or name in SKIP_DIRS or name in SPLITS:
+            continue
+        for subdir, dirs, files in os.walk(path):
+            for file in sorted(files):
+                if file.endswith(".json"):
+                    sources[path] = os.path.join(subdir, file)
+    return sources
+
+
+def index_source(source_dir, json_path, rootdir):
+    """
+    Yields (key, image_path, width, height, annotations) for every image of one
+    source: its COCO images (annotations grouped by image_id in one pass) and
+    unlabelled PNGs anywhere under the folder.
+    """
+    with open(json_path) as f:
+        data = json.load(f)
+    by_image = defaultdict(list)
+    for ann in data.get("annotations", []):
+        by_image[ann["image_id"]].append(ann)
+
+    json_dir = os.path.dirname(json_path)
+    labelled = set()
+    for img in data.get("images", []):
+        image_path = os.path.join(json_dir, img["file_name"])
+        labelled.add(os.path.normpath(image_path))
+        yield (os.path.relpath(image_path, rootdir).replace(os.sep, "/"), image_path,
+               img.get("width", DEFAULT_SIZE_PX), img.get("height", DEFAULT_SIZE_PX), by_image.get(img["id"], []))
+    for subdir, dirs, files in os.walk(source_dir):
+        for file in sorted(files):
+            image_path = os.path.join(subdir, file)
+            if file.endswith(".png") and os.path.normpath(image_path) not in labelled:
+                yield os.path.relpath(image_path, rootdir).replace(os.sep, "/"), image_path, DEFAULT_SIZE_PX, DEFAULT_SIZE_PX, []
+
+
+def load_split_index(path):
+    if not os.path.isfile(path):
+        return {"seed": SEED, "next_id": {name: 1 for name in SPLITS}, "images": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def clear_split_images(rootdir):
+    """Removes images left by a build without SPLIT_INDEX (their numbering is unknown)."""
+    for name in SPLITS:
+        folder = os.path.join(rootdir, name)
+        if os.path.isdir(folder):
+            for file in os.listdir(folder):
+                if file.endswith(".png"):
+                    os.remove(os.path.join(folder, file))
+
+
+def place_file(src, dst):
+    """Hardlinks src to dst (copies across filesystems); returns False if dst was already there."""
+    if os.path.exists(dst):
+        return False
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return True
+
+
+def build_splits(rootdir=ROOTDIR):
+    index_path = os.path.join(rootdir, SPLIT_INDEX)
+    if not os.path.isfile(index_path):
+        clear_split_images(rootdir)
+    split_index = load_split_index(index_path)
+    if split_index["seed"] != SEED:
+        raise ValueError(f"{SPLIT_INDEX} was built with seed {split_index['seed']}; delete it to re-split with seed {SEED}")
+    assigned = split_index["images"]
+    next_id = split_index["next_id"]
+
+    outputs = {name: {"info": {"description": "my-project-name"}, "categories": CATEGORIES, "images": [], "annotations": []}
+               for name in SPLITS}
+    ann_ids = {name: 0 for name in SPLITS}
+    to_place = []
+    seen = set()
+    for source_dir, json_path in find_sources(rootdir).items():
+        for key, image_path, width, height, annotations in index_source(source_dir, json_path, rootdir):
+            if key in seen:
+                continue
+            seen.add(key)
+            entry = assigned.get(key)
+            if entry is None:
+                split = split_for(key)
+                entry = assigned[key] = {"split": split, "id": next_id[split]}
+                next_id[split] += 1
+            split, image_id = entry["split"], entry["id"]
+            file_name = f"{image_id}.png"
+            out = outputs[split]
+            out["images"].append({"id": image_id, "width": width, "height": height, "file_name": file_name})
+            for ann in annotations:
+                out["annotations"].append({**ann, "id": ann_ids[split], "image_id": image_id})
+                ann_ids[split] += 1
+            to_place.append((image_path, os.path.join(rootdir, split, file_name)))
+
+    # Sources that disappeared are dropped from the outputs (their ids are not reused)
+    removed = [key for key in assigned if key not in seen]
+    for key in removed:
+        entry = assigned.pop(key)
+        stale = os.path.join(rootdir, entry["split"], f"{entry['id']}.png")
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    for name in SPLITS:
+        os.makedirs(os.path.join(rootdir, name), exist_ok=True)
+    with ThreadPoolExecutor(LINK_WORKERS) as pool:
+        placed = sum(tqdm(pool.map(lambda job: place_file(*job), to_place), total=len(to_place),
+                          desc="Linking images", ncols=100))
+
+    for name, out in outputs.items():
+        out["images"].sort(key=lambda img: img["id"])
+        with open(os.path.join(rootdir, name, ANNOTATIONS_FILENAME), "w") as f:
+            json.dump(out, f, separators=(",", ":"))
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(split_index, f, separators=(",", ":"))
+    os.replace(index_path + ".tmp", index_path)
+
+    print(f"✅ {len(seen)} images: " + ", ".join(f"{name} {len(out['images'])}" for name, out in outputs.items()))
+    print(f"   {placed} new files linked, {len(seen) - placed} already in place, {len(removed)} removed")
+
 
+if __name__ == "__main__":
+    build_splits()
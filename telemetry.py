@@ -0,0 +1,202 @@
+"""
+Lightweight performance telemetry for the fetch, grid and inference stages.
+
+Counters and fixed-bucket histograms live in one in-process registry; a
+record is a dict update (plus a bisect for histograms) under a lock, so the
+fetch_tile hot path pays well under a microsecond per call. Nothing is
+written until start() is called:
+- every TELEMETRY_INTERVAL_S (and at stop()) a snapshot of all metrics is
+  appended as one JSON line to the log, next to any event() records,
+- with a port, the same metrics are served as Prometheus text on
+  http://127.0.0.1:<port>/metrics.
+start() exports the log path through TELEMETRY_ENV, so inference worker
+processes (spawned by heatmap_inference.py) call autostart() and append
+their own snapshots, tagged with their pid, to the same file.
+
+Metric names used across the repo:
+    grid_cells_total{addressing}                 cells tested against the boundary
+    grid_seconds_total{addressing}               time spent generating them
+    fetch_request_seconds{status}                per-attempt latency (status code or error type)
+    fetch_retries_total{reason}                  retried attempts
+    fetch_tiles_total{outcome}                   downloaded / failed tiles
+    fetch_bytes_written_total{storage}           tile bytes persisted (files / shards)
+    fetch_write_seconds{storage}                 time spent persisting a tile (or a writer-stage batch)
+    fetch_write_backpressure_seconds             time a download waited on a full writer queue
+    event_loop_lag_seconds                       scheduling delay of the asyncio loop
+    decode_seconds                               decode + pre-process per tile
+    inference_batch_seconds / inference_tile_seconds   model time per batch / per tile
+    inference_tiles_total{source}                model / cached / prefiltered / unreadable
+"""
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- CONFIGURATION ---
+TELEMETRY_INTERVAL_S = 10
+# Histogram upper bounds in seconds (+Inf is implicit)
+LATENCY_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+EVENT_LOOP_PROBE_S = 0.1
+# Set by start() so worker processes log to the same file
+TELEMETRY_ENV = "ROOFTOP_PV_TELEMETRY_LOG"
+# ----------------------------------------
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_log_file = None
+_flusher = None
+_stop_flush = threading.Event()
+_server = None
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items()))) if labels else (name, ())
+
+
+def count(name, value=1, **labels):
+    """Adds value to a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Records one value (seconds) in a histogram."""
+    key = _key(name, labels)
+    slot = bisect.bisect_left(LATENCY_BUCKETS_S, value)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0, 0.0, [0] * (len(LATENCY_BUCKETS_S) + 1)]
+        hist[0] += 1
+        hist[1] += value
+        hist[2][slot] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observes the duration of the with-block in histogram name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _label_text(labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+
+def snapshot():
+    """Current metrics as a JSON-friendly dict ({"counters": {...}, "histograms": {...}})."""
+    with _lock:
+        counters = {name + _label_text(labels): value for (name, labels), value in _counters.items()}
+        histograms = {name + _label_text(labels): {"count": n, "sum": total, "buckets": list(buckets)}
+                      for (name, labels), (n, total, buckets) in _histograms.items()}
+    return {"counters": counters, "histograms": histograms}
+
+
+def prometheus_text():
+    """Metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, (n, total, list(buckets))) for key, (n, total, buckets) in _histograms.items())
+    for (name, labels), value in counters:
+        lines.append(f"{name}{_label_text(labels)} {value}")
+    for (name, labels), (n, total, buckets) in histograms:
+        cumulative = 0
+        for bound, bucket in zip(list(LATENCY_BUCKETS_S) + ["+Inf"], buckets):
+            cumulative += bucket
+            lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {cumulative}")
+        lines.append(f"{name}_sum{_label_text(labels)} {total}")
+        lines.append(f"{name}_count{_label_text(labels)} {n}")
+    return "\n".join(lines) + "\n"
+
+
+def event(kind, **fields):
+    """Appends one {"ts", "pid", "event", ...} JSON line to the log (no-op before start())."""
+    if _log_file is None:
+        return
+    record = {"ts": time.time(), "pid": os.getpid(), "event": kind, **fields}
+    line = json.dumps(record, separators=(",", ":"), default=str) + "\n"
+    with _lock:
+        _log_file.write(line)
+        _log_file.flush()
+
+
+def flush():
+    """Writes a snapshot line now."""
+    event("snapshot", **snapshot())
+
+
+def _flush_loop(interval_s):
+    while not _stop_flush.wait(interval_s):
+        flush()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start(log_path=None, port=None, interval_s=TELEMETRY_INTERVAL_S):
+    """Starts the JSON-lines log (and the Prometheus endpoint when port is given)."""
+    global _log_file, _flusher, _server
+    if log_path and _log_file is None:
+        folder = os.path.dirname(log_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        _log_file = open(log_path, "a")
+        os.environ[TELEMETRY_ENV] = os.path.abspath(log_path)
+        _stop_flush.clear()
+        _flusher = threading.Thread(target=_flush_loop, args=(interval_s,), daemon=True)
+        _flusher.start()
+    if port and _server is None:
+        _server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+
+
+def autostart():
+    """Joins the parent's log when started in a worker process (TELEMETRY_ENV set)."""
+    log_path = os.environ.get(TELEMETRY_ENV)
+    if log_path:
+        start(log_path)
+
+
+def stop():
+    """Writes a final snapshot and shuts the log and endpoint down."""
+    global _log_file, _flusher, _server
+    if _flusher is not None:
+        _stop_flush.set()
+        _flusher.join()
+        _flusher = None
+    if _log_file is not None:
+        flush()
+        _log_file.close()
+        _log_file = None
+    if _server is not None:
+        _server.shutdown()
+        _server = None
+
+
+async def monitor_event_loop(probe_s=EVENT_LOOP_PROBE_S):
+    """Task recording how late the loop wakes a probe_s sleep (cancel it when done)."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(probe_s)
+        observe("event_loop_lag_seconds", max(0.0, loop.time() - start - probe_s))
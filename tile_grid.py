@@ -0,0 +1,218 @@
+"""
+Vectorized tile-grid generation shared by the fetcher, plotter and heatmap stage.
+
+All candidate cell boxes of the disjoint grid are built as arrays and tested in
+bulk against a prepared boundary (an STRtree over the parts of a multipolygon),
+instead of one shapely Polygon + intersects() call per cell.
+
+Two addressing modes are provided:
+- "index": sequential indices in the same row-major (lat outer, lon inner)
+  INTERSECTS ordering as the original per-cell loop, so existing tile_{i}.png
+  folders stay valid.
+- "xyz": stable Web-Mercator z/x/y cells packed into one int64 id, independent
+  of the boundary, so tiles are reused across cities, campaigns and growing
+  boundaries (tile_{z}_{x}_{y}.png).
+"""
+import time
+import numpy as np
+import shapely
+from tqdm import tqdm
+import telemetry
+
+# --- CONFIGURATION ---
+DEFAULT_ZOOM = 19
+DEFAULT_TILE_SIZE_PX = 640
+ADDRESSING_INDEX = "index"
+ADDRESSING_XYZ = "xyz"
+# Candidate cells tested per vectorized batch (bounds peak memory on state-sized areas)
+GRID_CHUNK_CELLS = 250_000
+# ----------------------------------------
+
+
+def compute_tile_steps(miny, maxy, zoom=DEFAULT_ZOOM, tile_size_px=DEFAULT_TILE_SIZE_PX):
+    """
+    Returns (step_x_deg, step_y_deg, tile_size_meters, meters_per_pixel) for
+    disjoint tiles, evaluated at the mean latitude of the boundary.
+    """
+    avg_lat_rad = np.radians((miny + maxy) / 2)
+    meters_per_pixel = (156543.03 * np.cos(avg_lat_rad)) / (2**zoom)
+    tile_size_meters = tile_size_px * meters_per_pixel
+    step_y = tile_size_meters / 111320.0
+    step_x = tile_size_meters / (111320.0 * np.cos(avg_lat_rad))
+    return step_x, step_y, tile_size_meters, meters_per_pixel
+
+
+def grid_axes(polygon, step_x, step_y):
+    """Returns the (lon, lat) axis values of the grid over the boundary bounds."""
+    minx, miny, maxx, maxy = polygon.bounds
+    return np.arange(minx, maxx, step_x), np.arange(miny, maxy, step_y)
+
+
+def _build_intersector(polygon):
+    """Returns a function mapping an array of boxes to a boolean 'intersects' mask."""
+    parts = np.asarray(shapely.get_parts(polygon))
+    shapely.prepare(parts)
+
+    if len(parts) == 1:
+        part = parts[0]
+        return lambda boxes: shapely.intersects(part, boxes)
+
+    # Multipolygon: bbox-filter candidates through the tree, then run the exact
+    # predicate only on (part, box) pairs whose envelopes overlap.
+    tree = shapely.STRtree(parts)
+
+    def intersects(boxes):
+        box_idx, part_idx = tree.query(boxes)
+        hit = shapely.intersects(parts[part_idx], boxes[box_idx])
+        mask = np.zeros(len(boxes), dtype=bool)
+        mask[box_idx[hit]] = True
+        return mask
+
+    return intersects
+
+
+def iter_tile_grid(polygon, step_x, step_y, chunk_cells=GRID_CHUNK_CELLS, desc=None):
+    """
+    Lazily yields (indices, lats, lons) arrays, one chunk of grid rows at a time,
+    for every cell whose box intersects the polygon.
+    """
+    x_vals, y_vals = grid_axes(polygon, step_x, step_y)
+    half_step_x = step_x / 2
+    half_step_y = step_y / 2
+    intersects = _build_intersector(polygon)
+
+    rows_per_chunk = max(1, chunk_cells // max(1, len(x_vals)))
+    next_index = 0
+    with tqdm(total=len(x_vals) * len(y_vals), desc=desc, ncols=100, disable=desc is None) as pbar:
+        for start in range(0, len(y_vals), rows_per_chunk):
+            chunk_start = time.perf_counter()
+            lat_grid, lon_grid = np.meshgrid(y_vals[start:start + rows_per_chunk], x_vals, indexing="ij")
+            lats = lat_grid.ravel()
+            lons = lon_grid.ravel()
+            boxes = shapely.box(lons - half_step_x, lats - half_step_y, lons + half_step_x, lats + half_step_y)
+            mask = intersects(boxes)
+            pbar.update(len(lats))
+            telemetry.count("grid_cells_total", len(lats), addressing=ADDRESSING_INDEX)
+            telemetry.count("grid_seconds_total", time.perf_counter() - chunk_start, addressing=ADDRESSING_INDEX)
+
+            count = int(mask.sum())
+            if count:
+                indices = np.arange(next_index, next_index + count, dtype=np.int64)
+                next_index += count
+                yield indices, lats[mask], lons[mask]
+
+
+def generate_tile_grid(polygon, step_x, step_y, chunk_cells=GRID_CHUNK_CELLS, desc=None):
+    """Returns (indices, lats, lons) NumPy arrays of every tile intersecting the polygon."""
+    chunks = list(iter_tile_grid(polygon, step_x, step_y, chunk_cells=chunk_cells, desc=desc))
+    if not chunks:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    indices, lats, lons = (np.concatenate(parts) for parts in zip(*chunks))
+    return indices, lats, lons
+
+
+# --- Stable Web-Mercator z/x/y addressing ---
+# Cells are TILE_SIZE_PX-wide squares of the global Web-Mercator pixel grid at
+# ZOOM, so a tile's address depends only on (zoom, x, y) and never on the
+# boundary, RADIUS_KM or float stepping. Overlapping cities share addresses.
+MERCATOR_BASE_TILE_PX = 256
+# Packed ids carry this flag bit so they never collide with sequential indices
+XYZ_ID_FLAG = 1 << 62
+_XYZ_AXIS_BITS = 26
+_XYZ_AXIS_MASK = (1 << _XYZ_AXIS_BITS) - 1
+
+
+def latlon_to_pixel(lat, lon, zoom):
+    """Global Web-Mercator pixel coordinates (vectorized) at the given zoom."""
+    world_px = MERCATOR_BASE_TILE_PX * 2.0**zoom
+    lat_rad = np.radians(np.clip(lat, -85.05112878, 85.05112878))
+    px = (np.asarray(lon) + 180.0) / 360.0 * world_px
+    py = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / np.pi) / 2.0 * world_px
+    return px, py
+
+
+def pixel_to_latlon(px, py, zoom):
+    """Inverse of latlon_to_pixel; returns (lat, lon)."""
+    world_px = MERCATOR_BASE_TILE_PX * 2.0**zoom
+    lon = np.asarray(px) / world_px * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * np.asarray(py) / world_px))))
+    return lat, lon
+
+
+def xyz_to_id(zoom, x, y):
+    """Packs (zoom, x, y) into one int64 tile id (vectorized over x, y)."""
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    return XYZ_ID_FLAG | (np.int64(zoom) << (2 * _XYZ_AXIS_BITS)) | (x << _XYZ_AXIS_BITS) | y
+
+
+def id_to_xyz(tile_id):
+    """Unpacks an id from xyz_to_id back into (zoom, x, y)."""
+    tile_id = int(tile_id)
+    return ((tile_id & ~XYZ_ID_FLAG) >> (2 * _XYZ_AXIS_BITS),
+            (tile_id >> _XYZ_AXIS_BITS) & _XYZ_AXIS_MASK,
+            tile_id & _XYZ_AXIS_MASK)
+
+
+def is_xyz_id(tile_id):
+    return bool(int(tile_id) & XYZ_ID_FLAG)
+
+
+def tile_filename(tile_id):
+    """tile_{i}.png for sequential indices, tile_{z}_{x}_{y}.png for packed xyz ids."""
+    if is_xyz_id(tile_id):
+        return "tile_{}_{}_{}.png".format(*id_to_xyz(tile_id))
+    return f"tile_{int(tile_id)}.png"
+
+
+def xyz_cell_range(polygon, zoom=DEFAULT_ZOOM, tile_size_px=DEFAULT_TILE_SIZE_PX):
+    """Returns (x_vals, y_vals) cell columns/rows covering the polygon bounds."""
+    minx, miny, maxx, maxy = polygon.bounds
+    px0, py0 = latlon_to_pixel(maxy, minx, zoom)  # north-west corner
+    px1, py1 = latlon_to_pixel(miny, maxx, zoom)  # south-east corner
+    x_vals = np.arange(int(px0 // tile_size_px), int(px1 // tile_size_px) + 1, dtype=np.int64)
+    y_vals = np.arange(int(py0 // tile_size_px), int(py1 // tile_size_px) + 1, dtype=np.int64)
+    return x_vals, y_vals
+
+
+def iter_xyz_grid(polygon, zoom=DEFAULT_ZOOM, tile_size_px=DEFAULT_TILE_SIZE_PX,
+                  chunk_cells=GRID_CHUNK_CELLS, desc=None):
+    """
+    Lazily yields (tile_ids, lats, lons) arrays for every z/x/y cell whose
+    Web-Mercator footprint intersects the polygon; lat/lon are cell centres.
+    """
+    x_vals, y_vals = xyz_cell_range(polygon, zoom, tile_size_px)
+    # Mercator is separable, so cell edges/centres are computed once per axis
+    edge_lats, edge_lons = pixel_to_latlon(np.append(x_vals, x_vals[-1] + 1) * tile_size_px,
+                                           np.append(y_vals, y_vals[-1] + 1) * tile_size_px, zoom)
+    centre_lats, centre_lons = pixel_to_latlon((x_vals + 0.5) * tile_size_px, (y_vals + 0.5) * tile_size_px, zoom)
+    intersects = _build_intersector(polygon)
+
+    rows_per_chunk = max(1, chunk_cells // max(1, len(x_vals)))
+    col = np.arange(len(x_vals))
+    with tqdm(total=len(x_vals) * len(y_vals), desc=desc, ncols=100, disable=desc is None) as pbar:
+        for start in range(0, len(y_vals), rows_per_chunk):
+            chunk_start = time.perf_counter()
+            row_grid, col_grid = np.meshgrid(np.arange(start, min(start + rows_per_chunk, len(y_vals))), col, indexing="ij")
+            rows = row_grid.ravel()
+            cols = col_grid.ravel()
+            # North edge is row r, south edge is row r + 1 (pixel y grows southwards)
+            boxes = shapely.box(edge_lons[cols], edge_lats[rows + 1], edge_lons[cols + 1], edge_lats[rows])
+            mask = intersects(boxes)
+            pbar.update(len(rows))
+            telemetry.count("grid_cells_total", len(rows), addressing=ADDRESSING_XYZ)
+            telemetry.count("grid_seconds_total", time.perf_counter() - chunk_start, addressing=ADDRESSING_XYZ)
+
+            if mask.any():
+                rows, cols = rows[mask], cols[mask]
+                yield xyz_to_id(zoom, x_vals[cols], y_vals[rows]), centre_lats[rows], centre_lons[cols]
+
+
+def generate_xyz_grid(polygon, zoom=DEFAULT_ZOOM, tile_size_px=DEFAULT_TILE_SIZE_PX,
+                      chunk_cells=GRID_CHUNK_CELLS, desc=None):
+    """Returns (tile_ids, lats, lons) NumPy arrays of every z/x/y cell intersecting the polygon."""
+    chunks = list(iter_xyz_grid(polygon, zoom, tile_size_px, chunk_cells=chunk_cells, desc=desc))
+    if not chunks:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    tile_ids, lats, lons = (np.concatenate(parts) for parts in zip(*chunks))
+    return tile_ids, lats, lons
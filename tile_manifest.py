@@ -0,0 +1,136 @@
+"""
+Persistent per-folder tile manifest (SQLite) written during the fetch.
+
+One row per tile: index, lat, lon, zoom, status, byte size, content hash and
+timestamp. Resume, plotting and the heatmap stage read it with a single indexed
+query instead of globbing and regex-parsing every tile_*.png in the folder.
+"""
+import os
+import sqlite3
+import time
+import numpy as np
+
+# --- CONFIGURATION ---
+MANIFEST_FILENAME = "tile_manifest.sqlite"
+# Rows buffered before a commit while downloads are running
+COMMIT_EVERY = 500
+
+STATUS_DOWNLOADED = "downloaded"
+STATUS_FAILED = "failed"
+# ----------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    tile_index   INTEGER PRIMARY KEY,
+    lat          REAL    NOT NULL,
+    lon          REAL    NOT NULL,
+    zoom         INTEGER NOT NULL,
+    status       TEXT    NOT NULL,
+    byte_size    INTEGER,
+    content_hash TEXT,
+    updated_at   REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tiles_status ON tiles(status);
+"""
+
+
+def manifest_path(folder):
+    """Location of the manifest inside a tile folder (travels with the folder/zip)."""
+    return os.path.join(folder, MANIFEST_FILENAME)
+
+
+def manifest_exists(folder):
+    return os.path.isfile(manifest_path(folder))
+
+
+class TileManifest:
+    """SQLite-backed record of every tile fetched into a folder."""
+
+    def __init__(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        self.path = manifest_path(folder)
+        # Writes may run on tile_writer.py's thread (one thread at a time)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+    # --- Writes ---
+    def record_tile(self, index, lat, lon, zoom, status, byte_size=None, content_hash=None):
+        """Inserts or replaces the row for one tile; commits every COMMIT_EVERY rows."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (int(index), float(lat), float(lon), int(zoom), status, byte_size, content_hash, time.time()),
+        )
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+    def record_many(self, rows):
+        """Bulk insert of (index, lat, lon, zoom, status, byte_size, content_hash) rows."""
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((int(i), float(lat), float(lon), int(z), s, b, h, now) for i, lat, lon, z, s, b, h in rows),
+        )
+        self.commit()
+
+    def commit(self):
+        self._conn.commit()
+        self._pending = 0
+
+    def import_legacy_folder(self, folder, existing_indices, tile_indices, tile_lats, tile_lons, zoom):
+        """
+        One-time bootstrap for folders fetched before the manifest existed:
+        records already-present tile_{i}.png files using the grid coordinates.
+        """
+        in_grid = set(existing_indices).intersection(tile_indices.tolist())
+        rows = []
+        for index in sorted(in_grid):
+            byte_size = os.path.getsize(os.path.join(folder, f"tile_{index}.png"))
+            rows.append((index, tile_lats[index], tile_lons[index], zoom, STATUS_DOWNLOADED, byte_size, None))
+        self.record_many(rows)
+        return len(rows)
+
+    # --- Reads ---
+    def indices(self, status=STATUS_DOWNLOADED):
+        """Set of tile indices with the given status (one indexed read)."""
+        cur = self._conn.execute("SELECT tile_index FROM tiles WHERE status = ?", (status,))
+        return {row[0] for row in cur}
+
+    def tiles(self, status=STATUS_DOWNLOADED):
+        """Returns (indices, lats, lons) NumPy arrays of tiles with the given status, ordered by index."""
+        rows = self._conn.execute(
+            "SELECT tile_index, lat, lon FROM tiles WHERE status = ? ORDER BY tile_index", (status,)
+        ).fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+        arr = np.asarray(rows)
+        return arr[:, 0].astype(np.int64), arr[:, 1], arr[:, 2]
+
+    def status_counts(self):
+        """Returns {status: count}."""
+        return dict(self._conn.execute("SELECT status, COUNT(*) FROM tiles GROUP BY status"))
+
+    def summary(self, status=STATUS_DOWNLOADED):
+        """Returns (total bytes, last update time or None) of tiles with the given status."""
+        total_bytes, last_updated = self._conn.execute(
+            "SELECT COALESCE(SUM(byte_size), 0), MAX(updated_at) FROM tiles WHERE status = ?", (status,)
+        ).fetchone()
+        return total_bytes, last_updated
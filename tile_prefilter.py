@@ -0,0 +1,148 @@
+"""
+Cheap rooftop screen run before Mask R-CNN.
+
+Two optional signals decide whether a tile can contain rooftop PV at all:
+- an image score on a PREFILTER_SIZE x PREFILTER_SIZE downsample: edge texture
+  over pixels that are neither vegetation (excess green) nor water/shadow
+  (dark). Its cutoff is calibrated on the annotated training tiles so that
+  RECALL_TARGET of the tiles with panels pass.
+- a building-footprint overlay: tiles whose box touches no OSM building.
+Modes: "image" screens every tile by score, "footprints" only keeps tiles on a
+building (so the rest are never fetched or decoded), "both" keeps building
+tiles unconditionally and screens the others by score.
+"""
+import json
+import os
+import numpy as np
+import cv2
+import shapely
+from tqdm import tqdm
+from tile_grid import compute_tile_steps, DEFAULT_ZOOM, DEFAULT_TILE_SIZE_PX
+
+# --- CONFIGURATION ---
+PREFILTER_MODES = ("image", "footprints", "both")
+PREFILTER_SIZE = 64
+# Share of annotated tiles with panels the image screen must let through
+RECALL_TARGET = 0.99
+# Excess green (2G - R - B) above which a pixel counts as vegetation
+VEGETATION_EXG = 20
+# Mean BGR level below which a pixel counts as water / deep shadow
+DARK_LEVEL = 45
+# Footprints closer than this to a tile edge still count (covers OSM misalignment)
+FOOTPRINT_BUFFER_PX = 32
+# ----------------------------------------
+
+
+def rooftop_score(bgr_image):
+    """Mean edge magnitude (0-1) over built-up-looking pixels of a downsampled tile."""
+    small = cv2.resize(bgr_image, (PREFILTER_SIZE, PREFILTER_SIZE), interpolation=cv2.INTER_AREA)
+    pixels = small.astype(np.float32)
+    b, g, r = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    built = ((2 * g - r - b) <= VEGETATION_EXG) & (pixels.mean(axis=2) >= DARK_LEVEL)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+    edges = np.hypot(cv2.Sobel(gray, cv2.CV_32F, 1, 0), cv2.Sobel(gray, cv2.CV_32F, 0, 1))
+    return float((edges * built).mean() / 255.0)
+
+
+def positive_training_images(annotations_path):
+    """Paths of the images in a COCO annotation file that contain at least one panel."""
+    with open(annotations_path) as f:
+        coco = json.load(f)
+    with_panels = {ann["image_id"] for ann in coco["annotations"]}
+    folder = os.path.dirname(annotations_path)
+    return [os.path.join(folder, img["file_name"]) for img in coco["images"] if img["id"] in with_panels]
+
+
+def calibrate_threshold(image_paths, recall_target=RECALL_TARGET, downsample=1):
+    """
+    Highest score cutoff that keeps recall_target of the given tiles with panels
+    (scored after shrinking them downsample times, to match coarser imagery).
+    """
+    scores = []
+    for img_path in tqdm(image_paths, desc="Calibrating prefilter", leave=False, ncols=100):
+        img = cv2.imread(img_path)
+        if img is not None:
+            if downsample > 1:
+                img = cv2.resize(img, (img.shape[1] // downsample, img.shape[0] // downsample), interpolation=cv2.INTER_AREA)
+            scores.append(rooftop_score(img))
+    if not scores:
+        raise ValueError("No readable calibration images with panels")
+    return float(np.quantile(scores, 1.0 - recall_target, method="lower"))
+
+
+def fetch_building_footprints(polygon):
+    """
+    OSM building footprints inside the boundary as an array of shapely
+    geometries, or None when the query fails (no overlay then).
+    """
+    import osmnx as ox
+    try:
+        buildings = ox.features_from_polygon(polygon, tags={"building": True})
+    except Exception as e:
+        # osmnx raises for empty areas as well as for Overpass/network errors
+        print(f"⚠️ Building footprint query failed ({type(e).__name__}: {e}); footprint overlay disabled")
+        return None
+    return np.asarray(buildings.geometry.values)
+
+
+def tile_boxes(lats, lons, zoom=DEFAULT_ZOOM, tile_size_px=DEFAULT_TILE_SIZE_PX, buffer_px=0):
+    """Ground footprint (lon/lat boxes) of tiles centred on lats/lons, grown by buffer_px."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    step_x, step_y, _, _ = compute_tile_steps(lats, lats, zoom, tile_size_px + 2 * buffer_px)
+    return shapely.box(lons - step_x / 2, lats - step_y / 2, lons + step_x / 2, lats + step_y / 2)
+
+
+class TilePrefilter:
+    """Screens tiles by image score and/or building footprints (see module docstring)."""
+
+    def __init__(self, threshold=None, footprints=None, zoom=DEFAULT_ZOOM, tile_size_px=DEFAULT_TILE_SIZE_PX):
+        self.threshold = threshold
+        self.zoom = zoom
+        self.tile_size_px = tile_size_px
+        self.footprint_tree = shapely.STRtree(footprints) if footprints is not None else None
+        self.building_ids = set()
+
+    def __getstate__(self):
+        # Worker processes only call keep(); the tree stays in the parent
+        state = self.__dict__.copy()
+        state["footprint_tree"] = None
+        return state
+
+    def overlay(self, tile_ids, lats, lons):
+        """
+        Records tiles that touch a footprint and returns the mask of tiles that
+        still need their image (all of them unless only footprints are used).
+        """
+        needed = np.ones(len(tile_ids), dtype=bool)
+        if self.footprint_tree is None:
+            return needed
+        boxes = tile_boxes(lats, lons, self.zoom, self.tile_size_px, FOOTPRINT_BUFFER_PX)
+        on_building = np.zeros(len(tile_ids), dtype=bool)
+        on_building[np.unique(self.footprint_tree.query(boxes, predicate="intersects")[0])] = True
+        self.building_ids.update(np.asarray(tile_ids)[on_building].tolist())
+        return on_building if self.threshold is None else needed
+
+    def keep(self, tile_id, bgr_image):
+        """True when the decoded tile should go to the model."""
+        if self.threshold is None or tile_id in self.building_ids:
+            return True
+        return rooftop_score(bgr_image) >= self.threshold
+
+
+def build_prefilter(mode, annotations_path=None, polygon=None, recall_target=RECALL_TARGET,
+                    zoom=DEFAULT_ZOOM, tile_size_px=DEFAULT_TILE_SIZE_PX):
+    """TilePrefilter for one of PREFILTER_MODES (None disables screening)."""
+    if mode is None:
+        return None
+    if mode not in PREFILTER_MODES:
+        raise ValueError(f"Unknown prefilter mode {mode!r}; expected one of {PREFILTER_MODES}")
+    threshold = footprints = None
+    if mode in ("image", "both"):
+        threshold = calibrate_threshold(positive_training_images(annotations_path), recall_target)
+        print(f"🧮 Prefilter score cutoff {threshold:.4f} (recall target {recall_target:.0%})")
+    if mode in ("footprints", "both"):
+        footprints = fetch_building_footprints(polygon)
+        if footprints is not None:
+            print(f"🏠 Prefilter overlay: {len(footprints)} building footprints")
+    return TilePrefilter(threshold, footprints, zoom, tile_size_px)
@@ -0,0 +1,200 @@
+"""
+Sharded packed tile store: tiles are appended into large shard files with an
+offset index, instead of one tile_{i}.png file per tile.
+
+Any tile can be read back as raw PNG bytes through mmap without extracting
+anything, so the fetcher, plotter and inference stage work on the store in
+place (no zip/unzip, no per-file inode or glob overhead).
+
+Layout of a store folder:
+    shard_00000.bin, shard_00001.bin, ...   concatenated PNG payloads
+    tile_store.sqlite                       tile_id -> (shard, offset, length)
+"""
+import glob
+import mmap
+import os
+import re
+import sqlite3
+from tqdm import tqdm
+from tile_grid import xyz_to_id
+
+# --- CONFIGURATION ---
+STORE_INDEX_FILENAME = "tile_store.sqlite"
+SHARD_PATTERN = "shard_{:05d}.bin"
+# Start a new shard once the current one reaches this size
+SHARD_MAX_BYTES = 1 << 30
+# Index rows buffered before a commit
+COMMIT_EVERY = 500
+# ----------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    tile_id INTEGER PRIMARY KEY,
+    shard   INTEGER NOT NULL,
+    offset  INTEGER NOT NULL,
+    length  INTEGER NOT NULL
+);
+"""
+
+
+def store_exists(folder):
+    return os.path.isfile(os.path.join(folder, STORE_INDEX_FILENAME))
+
+
+class ShardedTileStore:
+    """Append-only shard files + SQLite offset index, read through mmap."""
+
+    def __init__(self, folder, shard_max_bytes=SHARD_MAX_BYTES):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.shard_max_bytes = shard_max_bytes
+        # Writes may run on tile_writer.py's thread (one thread at a time)
+        self._conn = sqlite3.connect(os.path.join(folder, STORE_INDEX_FILENAME), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._pending = 0
+        self._writer = None
+        self._writer_shard = None
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _shard_path(self, shard):
+        return os.path.join(self.folder, SHARD_PATTERN.format(shard))
+
+    # --- Writes ---
+    def _open_writer(self, incoming_bytes):
+        """Opens the shard to append to, rotating once the current one is full."""
+        if self._writer is not None:
+            if self._writer.tell() + incoming_bytes <= self.shard_max_bytes:
+                return
+            self._writer.close()
+            shard = self._writer_shard + 1
+        else:
+            # Resume the newest shard; unindexed bytes left by a crash are simply skipped over
+            row = self._conn.execute("SELECT MAX(shard) FROM blobs").fetchone()
+            shard = row[0] if row[0] is not None else 0
+        self._writer = open(self._shard_path(shard), "ab")
+        self._writer_shard = shard
+
+    def put(self, tile_id, content):
+        """Appends one tile payload and indexes it (re-puts point at the newest copy)."""
+        self._open_writer(len(content))
+        offset = self._writer.tell()
+        self._writer.write(content)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)",
+            (int(tile_id), self._writer_shard, offset, len(content)),
+        )
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.flush()
+
+    def flush(self):
+        """Makes written payloads visible to readers, then commits their index rows."""
+        if self._writer is not None:
+            self._writer.flush()
+        self._conn.commit()
+        self._pending = 0
+
+    def sync(self):
+        """flush() with the current shard fsynced first (durable before its index rows commit)."""
+        if self._writer is not None:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+        self.flush()
+
+    def close(self):
+        if self._conn is None:
+            return
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        for mm in self._maps.values():
+            mm.close()
+        self._maps = {}
+        self._conn.close()
+        self._conn = None
+
+    # --- Reads ---
+    def _map(self, shard, end):
+        mm = self._maps.get(shard)
+        if mm is None or len(mm) < end:
+            if mm is not None:
+                mm.close()
+            if self._writer is not None and self._writer_shard == shard:
+                self._writer.flush()
+            with open(self._shard_path(shard), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[shard] = mm
+        return mm
+
+    def get(self, tile_id):
+        """Returns the tile payload as bytes, or None if the tile is not stored."""
+        row = self._conn.execute("SELECT shard, offset, length FROM blobs WHERE tile_id = ?", (int(tile_id),)).fetchone()
+        if row is None:
+            return None
+        shard, offset, length = row
+        return self._map(shard, offset + length)[offset:offset + length]
+
+    def __contains__(self, tile_id):
+        return self._conn.execute("SELECT 1 FROM blobs WHERE tile_id = ?", (int(tile_id),)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+
+    def ids(self):
+        """Set of all stored tile ids (one indexed read)."""
+        return {row[0] for row in self._conn.execute("SELECT tile_id FROM blobs")}
+
+    def iter_tiles(self, tile_ids=None):
+        """
+        Yields (tile_id, bytes) in shard/offset order (sequential reads), for all
+        tiles or only the given ids.
+        """
+        rows = self._conn.execute("SELECT tile_id, shard, offset, length FROM blobs ORDER BY shard, offset").fetchall()
+        if tile_ids is not None:
+            wanted = set(int(i) for i in tile_ids)
+            rows = [row for row in rows if row[0] in wanted]
+        for tile_id, shard, offset, length in rows:
+            yield tile_id, self._map(shard, offset + length)[offset:offset + length]
+
+
+def tile_id_from_filename(filename):
+    """Parses tile_{i}.png / tile_{z}_{x}_{y}.png back into a tile id (None if not a tile)."""
+    match = re.search(r"tile_(\d+)(?:_(\d+)_(\d+))?\.png$", filename)
+    if not match:
+        return None
+    if match.group(2) is None:
+        return int(match.group(1))
+    return int(xyz_to_id(*(int(g) for g in match.groups())))
+
+
+def pack_tile_folder(src_folder, store_folder):
+    """Packs an existing folder of tile PNG files into a sharded store; returns the tile count."""
+    packed = 0
+    with ShardedTileStore(store_folder) as store:
+        existing = store.ids()
+        for f_path in tqdm(sorted(glob.glob(os.path.join(src_folder, "tile_*.png"))), desc="Packing tiles", ncols=100):
+            tile_id = tile_id_from_filename(os.path.basename(f_path))
+            if tile_id is None or tile_id in existing:
+                continue
+            with open(f_path, "rb") as f:
+                store.put(tile_id, f.read())
+            packed += 1
+    return packed
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        print("Usage: python tile_store.py <tile_png_folder> <store_folder>")
+        sys.exit(1)
+    count = pack_tile_folder(sys.argv[1], sys.argv[2])
+    print(f"✅ Packed {count} tiles into '{sys.argv[2]}'")
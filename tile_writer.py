@@ -0,0 +1,190 @@
+"""
+Writer stage for the async tile fetcher: tile payloads and manifest rows are
+persisted on one dedicated thread instead of on the event loop.
+
+fetch_tile hands each outcome to TileWriter.put(), which only queues it. A
+drain task collects up to WRITE_BATCH queued tiles and writes them in one
+executor call: payloads first (tile_*.png files or the shard store), then
+the fsync policy, then the manifest rows, so a committed row never points at
+bytes that are not on disk. Slow storage (network filesystems, mounted Drive
+folders) therefore only delays the writer; downloads keep going until
+WRITE_QUEUE_SIZE tiles are waiting, and only then do workers wait in put().
+If a write fails, the drain task ends with the error: put() re-raises it
+(also to workers already waiting on a full queue) and `failed` is set, so
+the fetch workers stop instead of downloading tiles that cannot be saved.
+
+The manifest and shard store are used from the writer thread only while the
+writer runs; checkpoint() commits them on that same thread.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telemetry
+from tile_grid import tile_filename
+from tile_manifest import STATUS_DOWNLOADED, STATUS_FAILED
+
+# --- CONFIGURATION ---
+# Tiles written per executor call
+WRITE_BATCH = 64
+# Tiles (payloads held in memory) queued before put() waits for the writer
+WRITE_QUEUE_SIZE = 128
+# "none": leave flushing to the OS
+# "batch": fsync every tile (and the folder) of a batch before its manifest rows
+# "tile": fsync each tile as it is written
+FSYNC_POLICY = "none"
+FSYNC_POLICIES = ("none", "batch", "tile")
+# ----------------------------------------
+
+
+class TileWriter:
+    """Queue + single writer thread persisting tiles and manifest rows in batches."""
+
+    def __init__(self, folder, zoom, manifest=None, tile_store=None, fsync=FSYNC_POLICY,
+                 batch_size=WRITE_BATCH, queue_size=WRITE_QUEUE_SIZE):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync}' (expected one of {FSYNC_POLICIES})")
+        self.folder = folder
+        self.zoom = zoom
+        self.manifest = manifest
+        self.tile_store = tile_store
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.storage = "files" if tile_store is None else "shards"
+        self._queue = None
+        self._drain = None
+        self._executor = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def start(self):
+        os.makedirs(self.folder, exist_ok=True)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="tile_writer")
+        self._drain = asyncio.create_task(self._drain_loop())
+
+    @property
+    def failed(self):
+        """True once a write failed (the drain task ended with an error)."""
+        return (self._drain is not None and self._drain.done() and not self._drain.cancelled()
+                and self._drain.exception() is not None)
+
+    async def put(self, i, lat, lon, content=None):
+        """Queues a downloaded tile (content) or a failed one (content=None)."""
+        self._check_drain()
+        if not self._queue.full():
+            self._queue.put_nowait((i, lat, lon, content))
+            return
+        wait_start = time.perf_counter()
+        put_task = asyncio.ensure_future(self._queue.put((i, lat, lon, content)))
+        try:
+            # A drain that dies while we wait would never make room in the queue
+            await asyncio.wait({put_task, self._drain}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            queued = put_task.done() and not put_task.cancelled()
+            if not queued:
+                put_task.cancel()
+        telemetry.observe("fetch_write_backpressure_seconds", time.perf_counter() - wait_start)
+        if not queued:
+            self._check_drain()
+
+    def _check_drain(self):
+        """Re-raises a write failure instead of queueing forever."""
+        if self._drain.done():
+            self._drain.result()
+            raise RuntimeError("Tile writer is closed")
+
+    async def checkpoint(self):
+        """Commits everything written so far (runs between batches on the writer thread)."""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._commit)
+
+    async def close(self):
+        """Writes what is still queued, commits and stops the writer thread."""
+        if self._drain is None:
+            return
+        try:
+            if not self._drain.done():
+                await self._queue.put(None)
+            await self._drain
+            await self.checkpoint()
+        finally:
+            self._executor.shutdown(wait=True)
+            self._drain = None
+
+    async def _drain_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    await loop.run_in_executor(self._executor, self._write_batch, batch)
+                    return
+                batch.append(item)
+            await loop.run_in_executor(self._executor, self._write_batch, batch)
+
+    # --- Writer thread ---
+    def _write_batch(self, batch):
+        start = time.perf_counter()
+        downloaded = [item for item in batch if item[3] is not None]
+        if self.tile_store is not None:
+            for i, _, _, content in downloaded:
+                self.tile_store.put(i, content)
+            if self.fsync != "none":
+                self.tile_store.sync()
+        else:
+            self._write_files(downloaded)
+        if self.manifest is not None:
+            for i, lat, lon, content in batch:
+                if content is None:
+                    self.manifest.record_tile(i, lat, lon, self.zoom, STATUS_FAILED)
+                else:
+                    self.manifest.record_tile(i, lat, lon, self.zoom, STATUS_DOWNLOADED, len(content),
+                                              hashlib.sha1(content).hexdigest())
+        telemetry.observe("fetch_write_seconds", time.perf_counter() - start, storage=self.storage)
+        telemetry.count("fetch_bytes_written_total", sum(len(item[3]) for item in downloaded), storage=self.storage)
+
+    def _write_files(self, downloaded):
+        synced = []
+        try:
+            for i, _, _, content in downloaded:
+                f = open(os.path.join(self.folder, tile_filename(i)), "wb")
+                if self.fsync == "batch":
+                    synced.append(f)  # Kept open until the whole batch is fsynced, closed in finally
+                    f.write(content)
+                    continue
+                with f:
+                    f.write(content)
+                    if self.fsync == "tile":
+                        f.flush()
+                        os.fsync(f.fileno())
+            for f in synced:
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            for f in synced:
+                f.close()
+        if downloaded and self.fsync != "none" and hasattr(os, "O_DIRECTORY"):
+            # New directory entries are durable only once the folder itself is synced
+            fd = os.open(self.folder, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _commit(self):
+        if self.tile_store is not None:
+            self.tile_store.flush()
+        if self.manifest is not None:
+            self.manifest.commit()